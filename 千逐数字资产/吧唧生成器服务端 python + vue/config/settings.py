@@ -1,5 +1,6 @@
 # config/settings.py - 应用配置
 import os
+import json
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -15,6 +16,13 @@ class Config:
     EXPORT_FOLDER = os.environ.get('EXPORT_FOLDER', 'static/exports')
     MAX_CONTENT_LENGTH = int(os.environ.get('MAX_CONTENT_LENGTH', 5242880))  # 5MB
     ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'webp'}
+    # 上传处理：读取块大小、用于解析文件头的开头字节数、最大像素数（防解压缩炸弹）
+    UPLOAD_CHUNK_SIZE = int(os.environ.get('UPLOAD_CHUNK_SIZE', 1024 * 1024))
+    UPLOAD_HEADER_BYTES = int(os.environ.get('UPLOAD_HEADER_BYTES', 1024 * 1024))
+    UPLOAD_MAX_PIXELS = int(os.environ.get('UPLOAD_MAX_PIXELS', 178956970))
+    # 去重存储：上传后没有订单引用的文件保留时间（秒）及回收检查间隔（秒）
+    UPLOAD_ORPHAN_SECONDS = int(os.environ.get('UPLOAD_ORPHAN_SECONDS', 24 * 3600))
+    UPLOAD_ORPHAN_COLLECT_INTERVAL = int(os.environ.get('UPLOAD_ORPHAN_COLLECT_INTERVAL', 3600))
     
     # 导出文件夹结构配置
     USE_DATE_FOLDER_STRUCTURE = os.environ.get('USE_DATE_FOLDER_STRUCTURE', 'true').lower() == 'true'
@@ -22,6 +30,59 @@ class Config:
     # 图片处理配置
     MAX_IMAGE_SIZE = (20000, 20000)  # 最大图片尺寸
     BAJI_SIZE = (68, 68)  # 吧唧尺寸(mm)
+    # 渲染模式: region(旋转->裁切->缩放)、affine(单次仿射变换直接采样) 或 tiled(与region一致，按条带处理控制内存)
+    RENDER_MODE = os.environ.get('RENDER_MODE', 'region')
+    # 输出远小于原图时按比例缩小解码（JPEG使用DCT draft，其它格式使用reduce）
+    RENDER_DRAFT_DECODE = os.environ.get('RENDER_DRAFT_DECODE', 'true').lower() == 'true'
+    # 渲染内存预算（每个渲染进程）：解码后最大像素数、解码峰值内存(MB)、条带行数；进程池大小 x 预算应小于容器内存
+    RENDER_PIXEL_BUDGET = int(os.environ.get('RENDER_PIXEL_BUDGET', 40000000))
+    RENDER_MEMORY_BUDGET = int(os.environ.get('RENDER_MEMORY_BUDGET_MB', 384)) * 1024 * 1024
+    RENDER_TILE_ROWS = int(os.environ.get('RENDER_TILE_ROWS', 256))
+    # 缩放比例范围，超出时 clamp(截断) 或 reject(拒绝)
+    RENDER_SCALE_MIN = float(os.environ.get('RENDER_SCALE_MIN', 0.01))
+    RENDER_SCALE_MAX = float(os.environ.get('RENDER_SCALE_MAX', 50))
+    RENDER_SCALE_POLICY = os.environ.get('RENDER_SCALE_POLICY', 'clamp')
+    # 上传时生成多分辨率金字塔（长边像素），预览渲染优先使用满足分辨率的最小层级
+    IMAGE_PYRAMID_ENABLED = os.environ.get('IMAGE_PYRAMID_ENABLED', 'true').lower() == 'true'
+    IMAGE_PYRAMID_LEVELS = [int(v) for v in os.environ.get('IMAGE_PYRAMID_LEVELS', '2048,1024,512').split(',')]
+    # 渲染缓存：磁盘层容量上限(MB)和内存层最多保留的渲染结果数
+    RENDER_CACHE_ENABLED = os.environ.get('RENDER_CACHE_ENABLED', 'true').lower() == 'true'
+    RENDER_CACHE_MAX_BYTES = int(os.environ.get('RENDER_CACHE_MAX_MB', 512)) * 1024 * 1024
+    RENDER_CACHE_MEMORY_ITEMS = int(os.environ.get('RENDER_CACHE_MEMORY_ITEMS', 32))
+    # 原图内容哈希记忆的最大条目数（按最近使用淘汰）
+    RENDER_CACHE_SOURCE_HASH_ITEMS = int(os.environ.get('RENDER_CACHE_SOURCE_HASH_ITEMS', 4096))
+    # 渲染流水线阶段缓存（每个渲染进程一份，按内存占用MB淘汰）
+    RENDER_STAGE_CACHE_ENABLED = os.environ.get('RENDER_STAGE_CACHE_ENABLED', 'true').lower() == 'true'
+    RENDER_STAGE_CACHE_MAX_BYTES = int(os.environ.get('RENDER_STAGE_CACHE_MAX_MB', 128)) * 1024 * 1024
+    # 渲染进程池：进程数(0为在请求线程中渲染，同一原图固定由同一进程渲染)、单任务超时(秒)、最大排队数、每个进程执行多少任务后回收
+    RENDER_POOL_SIZE = int(os.environ.get('RENDER_POOL_SIZE', 2))
+    RENDER_JOB_TIMEOUT = int(os.environ.get('RENDER_JOB_TIMEOUT', 30))
+    RENDER_QUEUE_DEPTH = int(os.environ.get('RENDER_QUEUE_DEPTH', 16))
+    RENDER_WORKER_MAX_JOBS = int(os.environ.get('RENDER_WORKER_MAX_JOBS', 200))
+    # 持久化渲染队列：创建订单时入队渲染，由 worker 领取（租约秒数、最大尝试次数、重试基础间隔秒数、轮询间隔秒数）
+    RENDER_QUEUE_ENABLED = os.environ.get('RENDER_QUEUE_ENABLED', 'true').lower() == 'true'
+    RENDER_QUEUE_LEASE_SECONDS = int(os.environ.get('RENDER_QUEUE_LEASE_SECONDS', 120))
+    RENDER_QUEUE_MAX_ATTEMPTS = int(os.environ.get('RENDER_QUEUE_MAX_ATTEMPTS', 3))
+    RENDER_QUEUE_RETRY_DELAY = int(os.environ.get('RENDER_QUEUE_RETRY_DELAY', 10))
+    RENDER_QUEUE_POLL_INTERVAL = float(os.environ.get('RENDER_QUEUE_POLL_INTERVAL', 1.0))
+    # Web进程内启动的 worker 线程数（单独运行 worker.py 时可设为0）
+    RENDER_QUEUE_EMBEDDED_WORKERS = int(os.environ.get('RENDER_QUEUE_EMBEDDED_WORKERS', 1))
+    # 衍生图编码配置覆盖（JSON，按配置名覆盖 preview/thumbnail/gallery/archive 的格式和参数）
+    RENDER_ENCODER_PROFILES = json.loads(os.environ.get('RENDER_ENCODER_PROFILES', '{}'))
+    # 临时预览存储：有效期(秒)、内存上限(MB)；开启溢出时超出内存上限的预览写入临时目录（默认系统临时目录/baji_previews）
+    PREVIEW_STORE_TTL = int(os.environ.get('PREVIEW_STORE_TTL', 300))
+    PREVIEW_STORE_MAX_BYTES = int(os.environ.get('PREVIEW_STORE_MAX_MB', 64)) * 1024 * 1024
+    PREVIEW_STORE_SPILL = os.environ.get('PREVIEW_STORE_SPILL', 'false').lower() == 'true'
+    PREVIEW_STORE_SPILL_DIR = os.environ.get('PREVIEW_STORE_SPILL_DIR')
+    # 实时预览通道：渲染循环线程数、最大会话数、会话空闲超时(秒)、事件流心跳间隔(秒)
+    PREVIEW_LIVE_WORKERS = int(os.environ.get('PREVIEW_LIVE_WORKERS', 4))
+    PREVIEW_LIVE_MAX_SESSIONS = int(os.environ.get('PREVIEW_LIVE_MAX_SESSIONS', 200))
+    PREVIEW_LIVE_IDLE_TIMEOUT = int(os.environ.get('PREVIEW_LIVE_IDLE_TIMEOUT', 120))
+    PREVIEW_LIVE_HEARTBEAT = int(os.environ.get('PREVIEW_LIVE_HEARTBEAT', 15))
+    # 渲染阶段指标（耗时/像素数/峰值内存直方图，管理端 /monitor/metrics 查看）；几何调试日志默认关闭，开启后按采样率输出
+    RENDER_METRICS_ENABLED = os.environ.get('RENDER_METRICS_ENABLED', 'true').lower() == 'true'
+    RENDER_DEBUG_LOG = os.environ.get('RENDER_DEBUG_LOG', 'false').lower() == 'true'
+    RENDER_DEBUG_SAMPLE_RATE = float(os.environ.get('RENDER_DEBUG_SAMPLE_RATE', 0.01))
     
     # PDF生成配置
     PDF_FORMATS = {
@@ -29,6 +90,20 @@ class Config:
         'a4_9': {'page_size': 'A4', 'items_per_page': 9},
         'a4_12': {'page_size': 'A4', 'items_per_page': 12}
     }
+    # PDF导出图片准备：线程数、已提交准备但尚未绘制的订单数上限（限制同时驻留内存的图片）
+    PDF_PREPARE_WORKERS = int(os.environ.get('PDF_PREPARE_WORKERS', os.cpu_count() or 2))
+    PDF_PREPARE_MAX_INFLIGHT = int(os.environ.get('PDF_PREPARE_MAX_INFLIGHT', 32))
+    # 后台PDF导出任务：Web进程内的导出线程数、超过多少秒没有进度的未完成任务视为中断
+    EXPORT_JOB_WORKERS = int(os.environ.get('EXPORT_JOB_WORKERS', 2))
+    EXPORT_JOB_STALE_SECONDS = int(os.environ.get('EXPORT_JOB_STALE_SECONDS', 600))
+    # 分卷导出：默认每卷页数(0为单个PDF，请求可用 volume_sheets 指定)、失败分卷的自动重试次数、ZIP流式输出的块大小
+    EXPORT_VOLUME_SHEETS = int(os.environ.get('EXPORT_VOLUME_SHEETS', 0))
+    EXPORT_VOLUME_RETRIES = int(os.environ.get('EXPORT_VOLUME_RETRIES', 2))
+    EXPORT_ZIP_CHUNK_SIZE = int(os.environ.get('EXPORT_ZIP_CHUNK_SIZE', 1024 * 1024))
+    # 导出结果缓存（打印结果下载、发票）：按输入指纹复用已生成的PDF，有效期(秒)和容量上限(MB)
+    EXPORT_CACHE_ENABLED = os.environ.get('EXPORT_CACHE_ENABLED', 'true').lower() == 'true'
+    EXPORT_CACHE_MAX_AGE = int(os.environ.get('EXPORT_CACHE_MAX_AGE', 24 * 3600))
+    EXPORT_CACHE_MAX_BYTES = int(os.environ.get('EXPORT_CACHE_MAX_MB', 512)) * 1024 * 1024
     
     # 业务配置
     ORDER_PREFIX = os.environ.get('ORDER_PREFIX', 'BJI')
@@ -10,6 +10,7 @@ from utils.file_manager import file_manager
 from utils.logger import logger
 from utils.performance_optimizer import performance_optimizer
 from utils.system_monitor import system_monitor
+from utils.render_queue import render_queue
 import os
 
 def main():
@@ -46,6 +47,13 @@ def main():
         #     'features': ['case_display', 'file_management', 'file_logging', 'recommendation', 'monitoring', 'optimization']
         # })
     
+    # 在Web进程中启动渲染队列 worker 线程（单独部署 worker.py 时设置 RENDER_QUEUE_EMBEDDED_WORKERS=0）
+    # debug 模式下 reloader 的监控进程不处理请求，只在实际服务的子进程中启动
+    embedded_workers = app.config.get('RENDER_QUEUE_EMBEDDED_WORKERS', 1)
+    if app.config.get('RENDER_QUEUE_ENABLED') and embedded_workers and os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        render_queue.start_embedded_workers(app, embedded_workers)
+        print(f"✅ 渲染队列 worker 已启动 ({embedded_workers})")
+    
     print("✅ 目录结构检查完成")
     print("✅ 文件管理系统初始化完成")
     print("🚀 启动应用...")
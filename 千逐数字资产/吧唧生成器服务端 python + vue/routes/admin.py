@@ -1,7 +1,7 @@
 # routes/admin.py - 管理端API路由
 import os
 import json
-from flask import Blueprint, request, jsonify, session, current_app
+from flask import Blueprint, request, jsonify, session, current_app, Response, stream_with_context
 from functools import wraps
 from datetime import datetime, timedelta
 from utils.models import Order, Coupon, SystemConfig, Case, CaseInteraction, DeviceSession, PrintJob, db
@@ -9,6 +9,17 @@ from utils.logger import logger
 from utils.security_auditor import security_auditor
 from utils.system_monitor import system_monitor
 from utils.performance_optimizer import performance_optimizer
+from utils.render_cache import render_cache
+from utils.render_stage_cache import stage_cache
+from utils.render_executor import render_executor
+from utils.render_queue import render_queue
+from utils.render_metrics import render_metrics
+from utils.preview_store import preview_store
+from utils.live_preview import live_preview
+from utils.upload_store import upload_store
+from utils.export_jobs import export_jobs
+from utils.export_cache import export_cache
+from utils.export_volumes import volume_exporter
 
 admin_bp = Blueprint('admin', __name__, url_prefix='/api/v1/admin')
 
@@ -236,6 +247,14 @@ def export_pdf():
         filter_status = data.get('filter_status')
         auto_complete = data.get('auto_complete', False)  # 是否自动标记为完成
         
+        # 分卷导出：每卷页数，0为生成单个PDF
+        try:
+            volume_sheets = int(data.get('volume_sheets', volume_exporter.get_setting('volume_sheets')) or 0)
+        except (TypeError, ValueError):
+            volume_sheets = -1
+        if volume_sheets < 0:
+            return jsonify({'success': False, 'error': '分卷页数无效'}), 400
+        
         if filter_status == 'printing':
             # 获取所有打印中状态的打印任务对应的订单
             printing_jobs = PrintJob.query.filter(
@@ -271,49 +290,25 @@ def export_pdf():
                     'error': '没有符合条件的订单可以导出。请确保有已支付的订单。'
                 }), 400
         
-        # 生成PDF
-        from utils.pdf_generator import PDFGenerator
-        generator = PDFGenerator()
-        pdf_path = generator.generate_baji_pdf(order_ids, pdf_format, baji_size)
-        
-        # 如果启用了自动完成，更新打印任务和订单状态
-        exported_count = 0
-        if auto_complete and filter_status == 'printing':
-            for order_id in order_ids:
-                # 更新打印任务状态为已完成
-                print_jobs = PrintJob.query.filter(
-                    PrintJob.order_id == order_id,
-                    PrintJob.status == 'printing'
-                ).all()
-                
-                for print_job in print_jobs:
-                    print_job.status = 'completed'
-                    print_job.completed_at = datetime.utcnow()
-                    print_job.updated_at = datetime.utcnow()
-                
-                # 更新订单状态为已打印
-                order = Order.query.get(order_id)
-                if order:
-                    order.status = 'printed'  # 新增已打印状态
-                    order.updated_at = datetime.utcnow()
-                    exported_count += 1
-            
-            db.session.commit()
+        # 登记后台导出任务：PDF生成和自动完成（打印任务、订单状态）都在任务完成时执行
+        job = export_jobs.submit(order_ids, pdf_format, baji_size, filter_status, auto_complete, volume_sheets)
         
         # 记录操作日志
         log_operation_local('export_pdf', 'orders', None, {
             'order_count': len(order_ids),
             'pdf_format': pdf_format,
             'baji_size': baji_size,
-            'exported_count': exported_count if auto_complete else len(order_ids)
+            'auto_complete': bool(auto_complete),
+            'volume_sheets': volume_sheets,
+            'job_id': job.job_id
         })
         
         return jsonify({
             'success': True,
-            'pdf_path': os.path.basename(pdf_path),
-            'download_url': f'/api/v1/admin/download/{os.path.basename(pdf_path)}',
-            'exported_count': exported_count if auto_complete else len(order_ids)
-        })
+            'job_id': job.job_id,
+            'status_url': f'/api/v1/admin/export/jobs/{job.job_id}',
+            'job': job.to_dict()
+        }), 202
         
     except Exception as e:
         current_app.logger.error(f"导出PDF失败: {str(e)}")
@@ -321,6 +316,128 @@ def export_pdf():
         current_app.logger.error(f"详细错误: {traceback.format_exc()}")
         return jsonify({'error': '导出PDF失败'}), 500
 
+@admin_bp.route('/export/jobs/<job_id>', methods=['GET'])
+@require_admin_login
+def get_export_job(job_id):
+    """导出任务状态（已完成页数 / 总页数）"""
+    try:
+        job = export_jobs.get(job_id)
+        if not job:
+            return jsonify({'success': False, 'error': '导出任务不存在'}), 404
+        
+        result = job.to_dict()
+        base_url = f'/api/v1/admin/export/jobs/{job.job_id}'
+        if job.status == export_jobs.STATUS_DONE:
+            result['download_url'] = f'{base_url}/download'
+        if export_jobs.is_volume_job(job) and os.path.exists(job.file_path):
+            # 分卷状态：已完成的分卷在任务结束前即可下载
+            manifest = volume_exporter.load(job.file_path)
+            result['manifest_url'] = f'{base_url}/manifest'
+            result['volumes'] = [{
+                'index': volume['index'],
+                'filename': volume['filename'],
+                'pages': volume['pages'],
+                'order_count': len(volume['order_ids']),
+                'status': volume['status'],
+                'attempts': volume['attempts'],
+                'file_size': volume['file_size'],
+                'error': volume['error'],
+                'download_url': f"{base_url}/volumes/{volume['index']}" if volume['status'] == 'done' else None
+            } for volume in manifest['volumes']]
+        return jsonify({'success': True, 'job': result})
+        
+    except Exception as e:
+        current_app.logger.error(f"获取导出任务失败: {str(e)}")
+        return jsonify({'success': False, 'error': '获取导出任务失败'}), 500
+
+@admin_bp.route('/export/jobs/<job_id>/download', methods=['GET'])
+@require_admin_login
+def download_export_job(job_id):
+    """下载导出任务生成的PDF（支持 Range 请求断点续传）"""
+    try:
+        job = export_jobs.get(job_id)
+        if not job:
+            return jsonify({'success': False, 'error': '导出任务不存在'}), 404
+        if job.status != export_jobs.STATUS_DONE:
+            return jsonify({'success': False, 'error': '导出任务尚未完成', 'status': job.status}), 409
+        if not job.file_path or not os.path.exists(job.file_path):
+            return jsonify({'success': False, 'error': '文件不存在'}), 404
+        
+        if export_jobs.is_volume_job(job):
+            # 分卷任务：清单和全部分卷打包为流式ZIP
+            zip_name = f"baji_export_{job.job_id}.zip"
+            security_auditor.log_file_download(zip_name, os.path.dirname(job.file_path), 'admin')
+            return Response(stream_with_context(volume_exporter.stream_zip(job.file_path)), mimetype='application/zip',
+                            headers={'Content-Disposition': f'attachment; filename={zip_name}'})
+        
+        filename = os.path.basename(job.file_path)
+        security_auditor.log_file_download(filename, job.file_path, 'admin')
+        
+        # conditional=True：按 Range / If-Range 返回 206 部分内容
+        from flask import send_file
+        return send_file(job.file_path, mimetype='application/pdf', as_attachment=True,
+                         download_name=filename, conditional=True, etag=True)
+        
+    except Exception as e:
+        current_app.logger.error(f"下载导出文件失败: {str(e)}")
+        return jsonify({'success': False, 'error': '下载导出文件失败'}), 500
+
+@admin_bp.route('/export/jobs/<job_id>/manifest', methods=['GET'])
+@require_admin_login
+def get_export_manifest(job_id):
+    """分卷导出任务的清单"""
+    try:
+        job = export_jobs.get(job_id)
+        if not job or not export_jobs.is_volume_job(job) or not os.path.exists(job.file_path):
+            return jsonify({'success': False, 'error': '分卷清单不存在'}), 404
+        return jsonify({'success': True, 'manifest': volume_exporter.load(job.file_path)})
+        
+    except Exception as e:
+        current_app.logger.error(f"获取分卷清单失败: {str(e)}")
+        return jsonify({'success': False, 'error': '获取分卷清单失败'}), 500
+
+@admin_bp.route('/export/jobs/<job_id>/volumes/<int:index>', methods=['GET'])
+@require_admin_login
+def download_export_volume(job_id, index):
+    """下载一个已完成的分卷（支持 Range 请求断点续传）"""
+    try:
+        job = export_jobs.get(job_id)
+        if not job or not export_jobs.is_volume_job(job) or not os.path.exists(job.file_path):
+            return jsonify({'success': False, 'error': '分卷清单不存在'}), 404
+        
+        volume_path = volume_exporter.volume_path(job.file_path, volume_exporter.load(job.file_path), index)
+        if not volume_path:
+            return jsonify({'success': False, 'error': '分卷不存在或尚未完成'}), 404
+        
+        filename = f"baji_export_{job.job_id}_{os.path.basename(volume_path)}"
+        security_auditor.log_file_download(filename, volume_path, 'admin')
+        
+        from flask import send_file
+        return send_file(volume_path, mimetype='application/pdf', as_attachment=True,
+                         download_name=filename, conditional=True, etag=True)
+        
+    except Exception as e:
+        current_app.logger.error(f"下载分卷失败: {str(e)}")
+        return jsonify({'success': False, 'error': '下载分卷失败'}), 500
+
+@admin_bp.route('/export/jobs/<job_id>/volumes/<int:index>/retry', methods=['POST'])
+@require_admin_login
+def retry_export_volume(job_id, index):
+    """重新生成失败的分卷（后台执行，其它分卷不受影响）"""
+    try:
+        job = export_jobs.get(job_id)
+        if not job or not export_jobs.is_volume_job(job):
+            return jsonify({'success': False, 'error': '分卷导出任务不存在'}), 404
+        if not export_jobs.retry_volume(job, index):
+            return jsonify({'success': False, 'error': '只能重试已结束任务中未完成的分卷'}), 409
+        
+        log_operation_local('retry_export_volume', 'export_jobs', None, {'job_id': job_id, 'volume': index})
+        return jsonify({'success': True, 'job_id': job_id, 'status_url': f'/api/v1/admin/export/jobs/{job_id}'}), 202
+        
+    except Exception as e:
+        current_app.logger.error(f"重试分卷失败: {str(e)}")
+        return jsonify({'success': False, 'error': '重试分卷失败'}), 500
+
 @admin_bp.route('/export/preview', methods=['POST'])
 @require_admin_login
 def export_preview():
@@ -486,9 +603,10 @@ def batch_delete_orders():
                     deleted_print_jobs_count += 1
                 
                 # 删除相关文件
-                if order.original_image_path and os.path.exists(order.original_image_path):
+                # 原图由去重存储按引用计数管理，其它订单仍在使用时不删除
+                if order.original_image_path:
                     try:
-                        os.remove(order.original_image_path)
+                        upload_store.release(order.original_image_path)
                     except Exception as e:
                         current_app.logger.warning(f"删除原始图片失败: {str(e)}")
                 
@@ -606,9 +724,10 @@ def delete_order(order_id):
             db.session.delete(print_job)
         
         # 删除相关文件
-        if order.original_image_path and os.path.exists(order.original_image_path):
+        # 原图由去重存储按引用计数管理，其它订单仍在使用时不删除
+        if order.original_image_path:
             try:
-                os.remove(order.original_image_path)
+                upload_store.release(order.original_image_path)
             except Exception as e:
                 current_app.logger.warning(f"删除原始图片失败: {str(e)}")
         
@@ -664,9 +783,10 @@ def batch_orders():
                         db.session.delete(print_job)
                     
                     # 删除相关文件
-                    if order.original_image_path and os.path.exists(order.original_image_path):
+                    # 原图由去重存储按引用计数管理，其它订单仍在使用时不删除
+                    if order.original_image_path:
                         try:
-                            os.remove(order.original_image_path)
+                            upload_store.release(order.original_image_path)
                         except Exception as e:
                             current_app.logger.warning(f"删除原始图片失败: {str(e)}")
                     
@@ -1613,8 +1733,9 @@ def delete_case(case_id):
         case = Case.query.get_or_404(case_id)
         
         # 删除相关文件
-        if case.original_image_path and os.path.exists(case.original_image_path):
-            os.remove(case.original_image_path)
+        # 原图由去重存储按引用计数管理，订单或其它案例仍在使用时不删除
+        if case.original_image_path:
+            upload_store.release(case.original_image_path)
         if case.preview_image_path and os.path.exists(case.preview_image_path):
             os.remove(case.preview_image_path)
         if case.final_image_path and os.path.exists(case.final_image_path):
@@ -1657,8 +1778,8 @@ def batch_cases():
                 case = Case.query.get(case_id)
                 if case:
                     # 删除相关文件
-                    if case.original_image_path and os.path.exists(case.original_image_path):
-                        os.remove(case.original_image_path)
+                    if case.original_image_path:
+                        upload_store.release(case.original_image_path)
                     if case.preview_image_path and os.path.exists(case.preview_image_path):
                         os.remove(case.preview_image_path)
                     if case.final_image_path and os.path.exists(case.final_image_path):
@@ -1824,6 +1945,7 @@ def create_case():
         if case.is_featured:
             case.featured_at = datetime.utcnow()
         
+        upload_store.acquire(case.original_image_path)
         db.session.add(case)
         db.session.commit()
         
@@ -1870,6 +1992,7 @@ def create_case_from_order(order_id):
         case.is_public = True
         case.is_featured = False
         
+        upload_store.acquire(case.original_image_path)
         db.session.add(case)
         db.session.commit()
         
@@ -1943,6 +2066,7 @@ def batch_create_cases_from_orders():
                 case.is_public = True
                 case.is_featured = False
                 
+                upload_store.acquire(case.original_image_path)
                 db.session.add(case)
                 created_cases.append(case)
                 
@@ -2022,6 +2146,16 @@ def get_performance_metrics():
     """获取性能指标"""
     try:
         metrics = performance_optimizer.get_performance_metrics()
+        metrics['render_cache'] = render_cache.get_stats()
+        metrics['render_stage_cache'] = stage_cache.get_stats()
+        metrics['render_executor'] = render_executor.get_stats()
+        metrics['render_queue'] = render_queue.get_stats()
+        metrics['render_stages'] = render_metrics.get_stats()
+        metrics['preview_store'] = preview_store.get_stats()
+        metrics['live_preview'] = live_preview.get_stats()
+        metrics['upload_store'] = upload_store.get_stats()
+        metrics['export_jobs'] = export_jobs.get_stats()
+        metrics['export_cache'] = export_cache.get_stats()
         
         return jsonify({
             'success': True,
@@ -2246,14 +2380,19 @@ def download_print_result(job_id):
         pdf_format = print_settings.get('format', 'a4_6')
         baji_size = print_settings.get('size', '68x68')
         
-        # 生成PDF
-        pdf_path = generator.generate_baji_pdf([order.id], pdf_format, baji_size)
+        # 生成PDF：订单、母版内容和打印设置不变时直接使用已生成的文件
+        cache_key = export_cache.fingerprint('baji', [order], format=pdf_format, size=baji_size)
+        pdf_path, cache_hit = export_cache.get_or_build(
+            cache_key,
+            lambda output_path: generator.generate_baji_pdf([order.id], pdf_format, baji_size, output_path=output_path)
+        )
         
         # 记录下载操作
         log_operation_local('download_print_result', 'print_jobs', job_id, {
             'print_job_no': print_job.print_job_no,
             'order_no': print_job.order_no,
-            'pdf_file': os.path.basename(pdf_path)
+            'pdf_file': os.path.basename(pdf_path),
+            'cache_hit': cache_hit
         })
         
         # 返回文件下载
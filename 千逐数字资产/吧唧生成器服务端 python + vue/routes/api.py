@@ -1,13 +1,23 @@
 # routes/api.py - API路由
+import io
 import os
 import uuid
 from datetime import datetime
-from flask import Blueprint, request, jsonify, send_file, current_app
+from flask import Blueprint, request, jsonify, send_file, current_app, url_for, Response, stream_with_context
 from utils.device_middleware import require_device_id, optional_device_id, get_device_id_from_request, validate_device_access
 from utils.logger import logger
 from utils.recommendation_engine import recommendation_engine
-from utils.helpers import validate_image_file, generate_unique_filename, get_file_info, save_file_with_permissions
+from utils.helpers import generate_unique_filename
+from utils.upload_ingest import upload_ingestor, UploadRejected
+from utils.upload_store import upload_store
 from utils.baji_processor import BajiProcessor
+from utils.render_cache import render_cache
+from utils.encoder_profiles import encoder_profiles
+from utils.preview_store import preview_store
+from utils.live_preview import live_preview, LivePreviewBusy
+from utils.render_executor import render_executor, RenderQueueFull, RenderTimeout
+from utils.render_queue import render_queue
+from utils.export_cache import export_cache
 from utils.security_auditor import security_auditor
 from utils.order_service import create_order_record
 from utils.models import Order, Coupon, Case, CaseInteraction, db
@@ -47,46 +57,91 @@ def upload_image():
         if file.filename == '':
             return jsonify({'success': False, 'error': '没有选择文件'}), 400
         
-        # 验证文件
-        is_valid, error_msg = validate_image_file(file)
-        if not is_valid:
-            # 记录安全违规
-            security_auditor.log_security_violation('INVALID_FILE_UPLOAD', {
-                'filename': file.filename,
-                'error': error_msg
-            })
-            return jsonify({'success': False, 'error': error_msg}), 400
-        
         # 使用文件管理器获取分目录的路径
         from utils.file_manager import file_manager
         filepath = file_manager.get_upload_path(file.filename)
         
-        # 保存文件并设置安全权限
-        save_file_with_permissions(file, filepath)
-        
-        # 获取图片信息
-        image_info = get_file_info(filepath)
+        # 单次读取：写入文件的同时计算哈希、校验文件头并解析图片尺寸，保存后不再重新读取
+        try:
+            ingested = upload_ingestor.ingest(file, filepath)
+        except UploadRejected as e:
+            # 记录安全违规
+            security_auditor.log_security_violation('INVALID_FILE_UPLOAD', {
+                'filename': file.filename,
+                'error': str(e)
+            })
+            return jsonify({'success': False, 'error': str(e)}), 400
+        image_info = ingested.image_info
         
+        # 按内容哈希去重：相同图片复用已存储的文件（以及它的金字塔和渲染缓存）
+        filepath, deduplicated = upload_store.register(ingested)
+        render_cache.remember_source_hash(filepath, ingested.content_hash)
+
+        # 生成多分辨率金字塔，失败不影响上传（渲染时回退到原图）；命中已有内容时复用已生成的金字塔
+        from utils.image_pyramid import image_pyramid
+        if current_app.config.get('IMAGE_PYRAMID_ENABLED', True) and not (deduplicated and image_pyramid.load(filepath)):
+            try:
+                image_pyramid.build(filepath, current_app.config.get('IMAGE_PYRAMID_LEVELS'))
+            except Exception as e:
+                current_app.logger.warning(f"生成图片金字塔失败: {str(e)}")
+
         # 从文件路径中提取文件名
         filename_only = os.path.basename(filepath)
         
         # 记录文件上传事件
         security_auditor.log_file_upload(
             filename_only, 
-            image_info['size'] if image_info else 0, 
+            image_info['size'], 
             'SUCCESS'
         )
         
         return jsonify({
             'success': True,
             'file_path': filepath,
-            'image_info': image_info
+            'image_info': image_info,
+            'deduplicated': deduplicated
         })
         
     except Exception as e:
         current_app.logger.error(f"上传失败: {str(e)}")
         return jsonify({'success': False, 'error': str(e)}), 500
 
+def _build_preview_params(data, default_quality=BajiProcessor.QUALITY_STANDARD):
+    """由预览请求参数构造渲染参数，提供默认值"""
+    preview_params = {
+        'image': {
+            'original_path': data['image_path'],
+            'width': data.get('width', 0),
+            'height': data.get('height', 0),
+            'format': data.get('format', 'jpg')
+        },
+        'edit_params': {
+            'scale': data.get('scale', 1.0),
+            'rotation': data.get('rotation', 0),
+            'offset_x': data.get('offset_x', 0),
+            'offset_y': data.get('offset_y', 0)
+        },
+        'baji_specs': {
+            'size': 68,
+            'dpi': 300,
+            'format': 'png',
+            'quality': 95
+        },
+        'user_preferences': {
+            'auto_enhance': True,
+            'smart_crop': False,
+            'color_correction': True,
+            'sharpening': False
+        },
+        # 渲染质量档位：draft / standard / final
+        'quality': data.get('quality') or default_quality
+    }
+    
+    # 可选指定渲染模式（region / affine），便于逐像素对比两种渲染路径
+    if data.get('render_mode'):
+        preview_params['render_options'] = {'mode': data['render_mode']}
+    return preview_params
+
 @api_bp.route('/preview', methods=['POST'])
 def generate_preview():
     """生成预览API"""
@@ -97,52 +152,102 @@ def generate_preview():
         if not data.get('image_path'):
             return jsonify({'success': False, 'error': '缺少图片路径'}), 400
         
-        # 创建预览参数，提供默认值
-        preview_params = {
-            'image': {
-                'original_path': data['image_path'],
-                'width': data.get('width', 0),
-                'height': data.get('height', 0),
-                'format': data.get('format', 'jpg')
-            },
-            'edit_params': {
-                'scale': data.get('scale', 1.0),
-                'rotation': data.get('rotation', 0),
-                'offset_x': data.get('offset_x', 0),
-                'offset_y': data.get('offset_y', 0)
-            },
-            'baji_specs': {
-                'size': 68,
-                'dpi': 300,
-                'format': 'png',
-                'quality': 95
-            },
-            'user_preferences': {
-                'auto_enhance': True,
-                'smart_crop': False,
-                'color_correction': True,
-                'sharpening': False
-            }
-        }
+        preview_params = _build_preview_params(data)
         
-        # 处理图片
+        # 处理图片（相同原图和参数直接命中渲染缓存，未命中时提交到渲染进程池）
         processor = BajiProcessor(preview_params)
-        preview_image = processor.process_image()
+        artifacts, cache_key, cache_hit = render_cache.get_or_render(processor, render=render_executor.render)
         
-        # 保存预览图片
-        preview_filename = f"preview_{uuid.uuid4().hex[:8]}.png"
-        preview_path = os.path.join(current_app.config['EXPORT_FOLDER'], preview_filename)
-        preview_image.save(preview_path, 'PNG')
+        # 预览图按临时预览编码配置编码（命中渲染缓存时直接复用缓存中的编码），不写导出目录
+        format, image_bytes = BajiProcessor.encode_artifact(artifacts, 'print_master', 'preview')
+        mimetype = encoder_profiles.mimetype(format)
         
+        if data.get('response') == 'image':
+            # 直接返回图片字节
+            response = send_file(io.BytesIO(image_bytes), mimetype=mimetype)
+            response.headers['Cache-Control'] = 'no-store'
+            response.headers['X-Preview-Cache-Hit'] = str(cache_hit).lower()
+            return response
+        
+        preview_id = preview_store.put(image_bytes, mimetype)
         return jsonify({
             'success': True,
-            'preview_path': preview_path
+            'preview_id': preview_id,
+            'preview_url': url_for('api.get_preview_image', preview_id=preview_id),
+            'expires_in': preview_store.get_setting('ttl'),
+            'quality': preview_params['quality'],
+            'cache_hit': cache_hit
         })
         
+    except RenderQueueFull as e:
+        return jsonify({'success': False, 'error': str(e)}), 503
+    except RenderTimeout as e:
+        current_app.logger.error(f"生成预览超时: {str(e)}")
+        return jsonify({'success': False, 'error': str(e)}), 504
+    except ValueError as e:
+        # 参数校验失败（缩放超出范围、质量档位或DPI无效、超出解码内存预算等）
+        return jsonify({'success': False, 'error': str(e)}), 400
     except Exception as e:
         current_app.logger.error(f"生成预览失败: {str(e)}")
         return jsonify({'success': False, 'error': str(e)}), 500
 
+@api_bp.route('/previews/<preview_id>', methods=['GET'])
+def get_preview_image(preview_id):
+    """按预览ID读取临时预览图片"""
+    preview = preview_store.get(preview_id) if preview_store.is_valid_id(preview_id) else None
+    if preview is None:
+        return jsonify({'success': False, 'error': '预览不存在或已过期'}), 404
+    
+    image_bytes, mimetype = preview
+    response = send_file(io.BytesIO(image_bytes), mimetype=mimetype)
+    response.headers['Cache-Control'] = f"private, max-age={preview_store.get_setting('ttl')}"
+    return response
+
+@api_bp.route('/preview/live', methods=['POST'])
+@require_device_id
+def submit_live_preview():
+    """实时预览：提交最新的编辑参数，渲染完成的预览帧通过事件流推送"""
+    try:
+        data = request.get_json()
+        if not data or not data.get('image_path'):
+            return jsonify({'success': False, 'error': '缺少图片路径'}), 400
+        
+        # 实时预览帧默认使用 draft 档位
+        preview_params = _build_preview_params(data, BajiProcessor.QUALITY_DRAFT)
+        # 参数校验失败时直接返回错误，不进入渲染循环
+        BajiProcessor(preview_params)
+        
+        session_id, version = live_preview.submit(request.device_id, data['image_path'], preview_params)
+        return jsonify({
+            'success': True,
+            'session_id': session_id,
+            'version': version,
+            'events_url': url_for('api.live_preview_events', session_id=session_id)
+        }), 202
+        
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    except LivePreviewBusy as e:
+        return jsonify({'success': False, 'error': str(e)}), 503
+    except Exception as e:
+        current_app.logger.error(f"提交实时预览失败: {str(e)}")
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@api_bp.route('/preview/live/<session_id>/events')
+def live_preview_events(session_id):
+    """实时预览事件流（SSE）：frame / error 事件携带版本号，会话空闲超时后发送 end 事件"""
+    session = live_preview.get_session(session_id)
+    if session is None:
+        return jsonify({'success': False, 'error': '预览会话不存在或已过期'}), 404
+    
+    # 断线重连时从浏览器带回的最后事件ID之后继续推送
+    last_version = request.headers.get('Last-Event-ID', 0, type=int)
+    # 事件流在应用上下文中运行，心跳间隔和空闲超时读取应用配置
+    return Response(stream_with_context(live_preview.stream(session, last_version)), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
 @api_bp.route('/orders', methods=['GET'])
 @require_device_id
 def get_orders():
@@ -206,8 +311,8 @@ def create_order():
     try:
         device_id = get_device_id_from_request()
         
-        # 获取参数
-        params = request.get_json()
+        # 获取参数（不缓存原始请求体，base64 图片解码后只保留一份字节）
+        params = request.get_json(cache=False)
         
         # 验证参数
         if not params.get('image') or not params.get('edit_params'):
@@ -227,6 +332,8 @@ def create_order():
         # 处理图片数据 - 支持文件路径和base64格式
         image_data = params.get('image')
         image_path = None
+        source_data = None
+        stored_path = None
         
         if isinstance(image_data, dict):
             # 处理图片路径对象格式
@@ -257,48 +364,26 @@ def create_order():
                 current_app.logger.error(f"当前工作目录: {os.getcwd()}")
                 return jsonify({'success': False, 'error': f'图片文件不存在: {image_path}'}), 400
                 
+        elif isinstance(image_data, str) and len(image_data) < 4096 and os.path.exists(image_data):
+            # 处理文件路径字符串
+            image_path = image_data
         elif isinstance(image_data, str):
-            if image_data.startswith('data:image'):
-                # 处理data URL格式
-                import base64
-                header, data = image_data.split(',', 1)
-                image_bytes = base64.b64decode(data)
-                
-                # 保存临时图片文件
-                import tempfile
-                import uuid
-                temp_filename = f"temp_{uuid.uuid4().hex[:8]}.png"
-                temp_path = os.path.join(current_app.config['UPLOAD_FOLDER'], temp_filename)
-                
-                # 确保目录存在
-                os.makedirs(os.path.dirname(temp_path), exist_ok=True)
-                
-                with open(temp_path, 'wb') as f:
-                    f.write(image_bytes)
-                
-                image_path = temp_path
-                
-            elif os.path.exists(image_data):
-                # 处理文件路径字符串
-                image_path = image_data
-            else:
-                # 处理纯base64数据
-                import base64
-                image_bytes = base64.b64decode(image_data)
-                
-                # 保存临时图片文件
-                import tempfile
-                import uuid
-                temp_filename = f"temp_{uuid.uuid4().hex[:8]}.png"
-                temp_path = os.path.join(current_app.config['UPLOAD_FOLDER'], temp_filename)
-                
-                # 确保目录存在
-                os.makedirs(os.path.dirname(temp_path), exist_ok=True)
-                
-                with open(temp_path, 'wb') as f:
-                    f.write(image_bytes)
-                
-                image_path = temp_path
+            # data URL 或纯 base64 数据：直接解码到内存交给渲染，不写临时文件；
+            # 与上传相同的大小、格式、文件头和像素数检查
+            try:
+                source_data, ingested = upload_ingestor.ingest_base64(image_data)
+            except UploadRejected as e:
+                return jsonify({'success': False, 'error': str(e)}), 400
+            # 解码后不再持有 base64 字符串，图片尺寸和格式使用文件头解析结果
+            params['image'] = None
+            image_data = ingested.image_info
+            image_path = BajiProcessor.memory_source_path(ingested.content_hash)
+            # 原图按内容去重保存到上传存储，订单记录真实的原图路径（之后可以重新渲染和导出）
+            from utils.file_manager import file_manager
+            stored = upload_ingestor.store(source_data, ingested,
+                                           file_manager.get_upload_path(f"order.{image_data['format']}"))
+            stored_path, _ = upload_store.register(stored)
+            render_cache.remember_source_hash(stored_path, ingested.content_hash)
         else:
             return jsonify({'success': False, 'error': '无效的图片数据格式'}), 400
         
@@ -322,14 +407,11 @@ def create_order():
                 'smart_crop': False,
                 'color_correction': True,
                 'sharpening': False
-            }
+            },
+            # 订单按 baji_specs 的实际DPI生成打印母版（68mm at 300 DPI = 803px）
+            'quality': BajiProcessor.QUALITY_FINAL
         }
         
-        # 处理图片
-        processor = BajiProcessor(processor_params)
-        processed_image = processor.process_image()
-        
-        # 保存处理后的图片
         order_no = Order.generate_order_no()
         output_filename = f"{order_no}.png"
         
@@ -337,40 +419,49 @@ def create_order():
         from utils.file_manager import file_manager
         output_path = file_manager.get_dated_export_path(output_filename)
         
-        processor.save_processed_image(output_path)
-        
-        # 创建订单记录
-        order = create_order_record(processor_params, output_path, device_id)
-        
-        # 获取预览图片路径
-        preview_filename = f"preview_{output_filename.split('.')[0]}.png"
-        preview_path = file_manager.get_dated_export_path(preview_filename)
-        
-        # 更新订单记录，添加预览图片路径
-        if os.path.exists(preview_path):
-            # 从数据库获取Order对象
-            order_obj = Order.query.filter_by(order_no=order['order_no']).first()
-            if order_obj:
-                order_obj.preview_image_path = preview_path
-                db.session.commit()
-                print(f"🔍 订单预览图片路径已更新: {preview_path}")
-            else:
-                print(f"❌ 找不到订单对象: {order['order_no']}")
-        
-        # 清理临时文件（仅当是base64数据创建的临时文件时）
-        if isinstance(image_data, str) and (image_data.startswith('data:image') or not os.path.exists(image_data)):
-            try:
-                if 'temp_path' in locals() and os.path.exists(temp_path):
-                    os.remove(temp_path)
-            except:
-                pass
-        
+        processor = BajiProcessor(processor_params, source_data)
+        # 订单和渲染队列使用上传存储中的原图路径，本次请求直接渲染内存中的字节
+        order_params = processor_params
+        if stored_path:
+            order_params = dict(processor_params, image=dict(processor_params['image'], original_path=stored_path))
+        
+        # 订单按 final 档位渲染，预览（draft / standard）的缓存结果不会命中；
+        # 只有相同原图和参数之前已按 final 档位渲染过（如重复下单）时才复用缓存中的打印母版
+        cache_key = render_cache.make_key(processor) if render_cache.get_setting('enabled') else None
+        artifacts = render_cache.get(cache_key) if cache_key else None
+        
+        if artifacts is None and render_queue.get_setting('enabled'):
+            # 渲染入队，订单以 rendering 状态立即返回，图片路径由 worker 完成后回填
+            order = create_order_record(order_params, None, device_id,
+                                        order_no=order_no, status=render_queue.ORDER_STATUS_RENDERING)
+            render_queue.enqueue(order['id'], order_no, order_params, output_path)
+        else:
+            # 单次渲染：一次解码/变换，同时得到打印母版、设计预览图和缩略图
+            if artifacts is None:
+                artifacts = render_executor.render(processor)
+                if cache_key:
+                    render_cache.put(cache_key, artifacts)
+            saved_paths = processor.save_artifacts(artifacts, output_path)
+            
+            # 创建订单记录（订单号与导出文件名保持一致，扩展名按实际编码格式，缩略图作为预览图片），
+            # 同时记录打印母版元数据，之后的PDF导出和下载直接使用该母版
+            order = create_order_record(order_params, saved_paths['print_master'], device_id,
+                                        order_no=order_no, preview_path=saved_paths['thumbnail'],
+                                        print_master=processor.print_master_metadata(
+                                            artifacts, saved_paths['print_master']))
         
         return jsonify({
             'success': True,
             'order': order
         })
         
+    except RenderQueueFull as e:
+        return jsonify({'success': False, 'error': str(e)}), 503
+    except RenderTimeout as e:
+        current_app.logger.error(f"创建订单渲染超时: {str(e)}")
+        return jsonify({'success': False, 'error': str(e)}), 504
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
     except Exception as e:
         current_app.logger.error(f"创建订单失败: {str(e)}")
         import traceback
@@ -551,6 +642,13 @@ def delete_order(order_no):
             return jsonify({'success': False, 'error': '订单不存在'}), 404
         
         # 删除相关文件
+        # 原图由去重存储按引用计数管理，其它订单仍在使用时不删除
+        if order.original_image_path:
+            try:
+                upload_store.release(order.original_image_path)
+            except Exception as e:
+                current_app.logger.warning(f"删除原始图片失败: {str(e)}")
+        
         if order.processed_image_path and os.path.exists(order.processed_image_path):
             os.remove(order.processed_image_path)
         
@@ -702,7 +800,9 @@ def process_payment():
         order.payment_method = payment_method
         order.payment_status = 'paid'
         order.payment_time = datetime.utcnow()
-        order.status = 'processing'
+        if order.status != render_queue.ORDER_STATUS_RENDERING:
+            # 仍在渲染中的订单由渲染任务完成后进入 processing
+            order.status = 'processing'
         
         db.session.commit()
         
@@ -778,7 +878,10 @@ def get_invoice(order_no):
         # 生成发票PDF
         from utils.pdf_generator import PDFGenerator
         generator = PDFGenerator()
-        invoice_path = generator.generate_invoice(order)
+        invoice_path, _ = export_cache.get_or_build(
+            export_cache.fingerprint('invoice', [order], images=False),
+            lambda output_path: generator.generate_invoice(order, output_path)
+        )
         
         return send_file(invoice_path, as_attachment=True, download_name=f'invoice_{order_no}.pdf')
         
@@ -825,7 +928,10 @@ def download_invoice(order_no):
         # 生成发票PDF
         from utils.pdf_generator import PDFGenerator
         generator = PDFGenerator()
-        invoice_path = generator.generate_invoice(order)
+        invoice_path, _ = export_cache.get_or_build(
+            export_cache.fingerprint('invoice', [order], images=False),
+            lambda output_path: generator.generate_invoice(order, output_path)
+        )
         
         return send_file(invoice_path, as_attachment=True, download_name=f'invoice_{order_no}.pdf')
         
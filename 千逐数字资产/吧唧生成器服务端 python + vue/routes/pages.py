@@ -120,7 +120,7 @@ def payment():
         else:
             order = Order.query.filter_by(order_no=order_no).first()
             
-        if order and order.status in ['pending', 'processing']:  # 允许processing状态的订单进入支付页面
+        if order and order.status in ['pending', 'rendering', 'processing']:  # 允许渲染中和processing状态的订单进入支付页面
             order_info = {
                 'quantity': order.quantity,
                 'unit_price': order.unit_price,
@@ -222,12 +222,14 @@ def download_baji(order_no):
     if order.payment_status != 'paid':
         abort(404, "订单尚未支付")
     
-    # 检查文件是否存在
-    if not order.processed_image_path:
+    # 下载订单的打印母版（生成订单时按打印DPI保存的文件）
+    from utils.order_service import get_print_master
+    print_master = get_print_master(order)
+    if not print_master:
         abort(404, "文件不存在")
     
     # 规范化文件路径
-    file_path = order.processed_image_path.replace('\\', '/')
+    file_path = print_master['path'].replace('\\', '/')
     
     # 如果是相对路径，转换为绝对路径
     if not os.path.isabs(file_path):
@@ -246,8 +248,8 @@ def download_baji(order_no):
         'file_path': file_path
     })
     
-    # 返回文件
-    filename = f"baji_{order_no}.png"
+    # 返回文件（扩展名与打印母版的实际格式一致）
+    filename = f"baji_{order_no}{os.path.splitext(file_path)[1] or '.png'}"
     return send_file(file_path, as_attachment=True, download_name=filename)
 
 @pages_bp.route('/favicon.ico')
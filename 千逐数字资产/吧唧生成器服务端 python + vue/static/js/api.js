@@ -66,6 +66,30 @@ class ApiClient {
         });
     }
     
+    // 实时预览：提交最新编辑参数（服务端只保留每个会话最新的一组参数）
+    async submitLivePreview(imagePath, editParams = {}) {
+        return this.request(`${this.baseURL}/preview/live`, {
+            method: 'POST',
+            body: JSON.stringify({
+                image_path: imagePath,
+                ...editParams
+            })
+        });
+    }
+    
+    // 实时预览：订阅预览帧事件流，返回 EventSource（不再需要时调用 close()）
+    openLivePreview(eventsUrl, onFrame, onError) {
+        const source = new EventSource(eventsUrl);
+        source.addEventListener('frame', (event) => onFrame(JSON.parse(event.data)));
+        source.addEventListener('error', (event) => {
+            if (event.data && onError) {
+                onError(JSON.parse(event.data));
+            }
+        });
+        source.addEventListener('end', () => source.close());
+        return source;
+    }
+    
     getImageURL(filename) {
         return `${this.baseURL}/image/${filename}`;
     }
@@ -278,12 +302,32 @@ class ApiClient {
     
     // 打印管理API
     async exportPDF(exportData) {
+        // 返回后台导出任务ID，用 getExportJob 查询进度
         return this.request(`${this.adminBaseURL}/export/pdf`, {
             method: 'POST',
             body: JSON.stringify(exportData)
         });
     }
     
+    async getExportJob(jobId) {
+        return this.request(`${this.adminBaseURL}/export/jobs/${jobId}`);
+    }
+    
+    getExportJobDownloadURL(jobId) {
+        // 分卷导出任务下载的是包含清单和全部分卷的ZIP
+        return `${this.adminBaseURL}/export/jobs/${jobId}/download`;
+    }
+    
+    getExportVolumeURL(jobId, index) {
+        return `${this.adminBaseURL}/export/jobs/${jobId}/volumes/${index}`;
+    }
+    
+    async retryExportVolume(jobId, index) {
+        return this.request(`${this.adminBaseURL}/export/jobs/${jobId}/volumes/${index}/retry`, {
+            method: 'POST'
+        });
+    }
+    
     async previewExport(exportData) {
         return this.request(`${this.adminBaseURL}/export/preview`, {
             method: 'POST',
@@ -369,6 +413,8 @@ class ApiUtils {
     static getStatusText(status) {
         const statusMap = {
             'pending': '待支付',
+            'rendering': '生成中',
+            'render_failed': '生成失败',
             'processing': '处理中',
             'completed': '已完成',
             'cancelled': '已取消',
@@ -384,6 +430,8 @@ class ApiUtils {
     static getStatusClass(status) {
         const classMap = {
             'pending': 'status-pending',
+            'rendering': 'status-processing',
+            'render_failed': 'status-failed',
             'processing': 'status-processing',
             'completed': 'status-completed',
             'cancelled': 'status-cancelled',
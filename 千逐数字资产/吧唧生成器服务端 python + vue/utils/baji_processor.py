@@ -1,21 +1,124 @@
 # utils/baji_processor.py - 吧唧处理器
-from PIL import Image, ImageOps, ImageFilter, ImageDraw
+from PIL import Image, ImageDraw
+import io
 import math
 import os
-from flask import current_app
+import logging
+import time
+from collections import namedtuple
+from flask import current_app, has_app_context
+from utils.render_geometry import RenderGeometry
+from utils.image_pyramid import image_pyramid
+from utils.render_stage_cache import stage_cache
+from utils.color_correction import color_corrector
+from utils.render_metrics import render_metrics
+from utils.encoder_profiles import encoder_profiles
+
+logger = logging.getLogger(__name__)
+
+# 渲染阶段输出：阶段缓存中的键 + 图片
+RenderStage = namedtuple('RenderStage', ['key', 'image'])
+# 解码阶段输出：额外记录解码后相对原图的缩放比例
+DecodedSource = namedtuple('DecodedSource', ['key', 'image', 'scale'])
 
 class BajiProcessor:
     """吧唧处理器类 - 完美复现前端效果"""
     
-    def __init__(self, parameters):
+    PREVIEW_SIZE = 342    # 设计预览图: 58mm at 150 DPI
+    PRINT_SIZE = 402      # 打印图: 68mm at 150 DPI
+    THUMBNAIL_SIZE = 200  # 订单缩略图
+    FILL_COLOR = (255, 255, 255, 255)  # 旋转后空白区域的填充色
+    
+    # 渲染模式：region = 旋转 -> 裁切 -> 缩放；affine = 单个仿射变换直接采样最终图块；
+    # tiled = 与 region 结果一致，但按条带逐块 裁切 -> 转换 -> 旋转，不转换整张解码图
+    RENDER_MODE_REGION = 'region'
+    RENDER_MODE_AFFINE = 'affine'
+    RENDER_MODE_TILED = 'tiled'
+    
+    # 整张解码图转换为RGBA的内存超过预算的这个比例时，region 模式自动按条带处理
+    NORMALIZE_BUDGET_RATIO = 0.25
+    
+    # 渲染质量档位：
+    # draft = 交互预览，双线性缩放、解码分辨率再减半、不做自动对比度；
+    # standard = 默认渲染；final = 打印图按 baji_specs 的实际尺寸和DPI计算像素尺寸
+    QUALITY_DRAFT = 'draft'
+    QUALITY_STANDARD = 'standard'
+    QUALITY_FINAL = 'final'
+    # 档位 -> 缩放采样方法、仿射采样方法、解码时额外的缩小倍数、是否自动对比度、打印图是否按DPI计算尺寸、
+    # 是否使用金字塔（层级按有损JPEG保存，打印母版只从原图解码）
+    QUALITY_TIERS = {
+        QUALITY_DRAFT: {
+            'resize_resample': Image.Resampling.BILINEAR,
+            'sample_resample': Image.Resampling.BILINEAR,
+            'decode_reduction': 2,
+            'color_correction': False,
+            'print_dpi': False,
+            'use_pyramid': True
+        },
+        QUALITY_STANDARD: {
+            'resize_resample': Image.Resampling.LANCZOS,
+            'sample_resample': Image.Resampling.BICUBIC,
+            'decode_reduction': 1,
+            'color_correction': True,
+            'print_dpi': False,
+            'use_pyramid': True
+        },
+        QUALITY_FINAL: {
+            'resize_resample': Image.Resampling.LANCZOS,
+            'sample_resample': Image.Resampling.BICUBIC,
+            'decode_reduction': 1,
+            'color_correction': True,
+            'print_dpi': True,
+            'use_pyramid': False
+        }
+    }
+    # final 档位允许的打印DPI范围
+    PRINT_DPI_MIN = 72
+    PRINT_DPI_MAX = 1200
+    MM_PER_INCH = 25.4
+    
+    # 内存中的原图（订单请求中的 base64 图片）使用的路径前缀：memory:<内容sha256>
+    MEMORY_SOURCE_PREFIX = 'memory:'
+    
+    # 渲染算法版本，修改渲染结果时递增，使旧的渲染缓存失效
+    RENDER_VERSION = 3
+    
+    # 保存订单文件时各衍生图使用的编码配置（见 utils/encoder_profiles.py）和文件名前缀
+    ARTIFACT_PROFILES = {
+        'print_master': 'archive',
+        'design_preview': 'gallery',
+        'thumbnail': 'thumbnail'
+    }
+    ARTIFACT_PREFIXES = {'design_preview': 'design_', 'thumbnail': 'preview_'}
+    
+    # 渲染选项 -> (应用配置项, 默认值)
+    RENDER_OPTION_CONFIG = {
+        'mode': ('RENDER_MODE', RENDER_MODE_REGION),
+        'draft_decode': ('RENDER_DRAFT_DECODE', True),
+        'use_pyramid': ('IMAGE_PYRAMID_ENABLED', True),
+        'pixel_budget': ('RENDER_PIXEL_BUDGET', 40000000),
+        'memory_budget': ('RENDER_MEMORY_BUDGET', 384 * 1024 * 1024),
+        'tile_rows': ('RENDER_TILE_ROWS', 256),
+        'scale_min': ('RENDER_SCALE_MIN', 0.01),
+        'scale_max': ('RENDER_SCALE_MAX', 50.0),
+        'scale_policy': ('RENDER_SCALE_POLICY', 'clamp')
+    }
+    
+    def __init__(self, parameters, source_data=None):
+        """source_data 为内存中的原图字节，此时 image.original_path 为 memory:<内容sha256>"""
         self.params = parameters
+        self.source_data = source_data
         self.validate_parameters()
+        # 几何和保存路径的调试日志按采样率输出（默认关闭）
+        self.debug_log = render_metrics.sample_debug_log()
         
     def validate_parameters(self):
         """验证参数完整性"""
         # 检查基本参数
         if not self.get_nested_value('image.original_path'):
             raise ValueError("Missing required parameter: image.original_path")
+        if self.source_data is not None and not self.memory_digest:
+            raise ValueError("内存原图的 image.original_path 必须为 memory:<sha256>")
         
         # 为edit_params提供默认值
         edit_params = self.params.get('edit_params', {})
@@ -28,7 +131,101 @@ class BajiProcessor:
         if 'offset_y' not in edit_params:
             edit_params['offset_y'] = 0
         
+        edit_params['scale'] = self.check_scale(edit_params['scale'])
         self.params['edit_params'] = edit_params
+        
+        # 渲染质量档位，默认 standard
+        quality = self.params.get('quality') or self.QUALITY_STANDARD
+        if quality not in self.QUALITY_TIERS:
+            raise ValueError(f"Invalid quality: {quality}")
+        self.params['quality'] = quality
+        if self.tier['print_dpi']:
+            self.print_size()
+    
+    def check_scale(self, scale):
+        """在处理任何像素之前检查缩放比例
+        
+        过小的缩放意味着巨大的裁切窗口，过大的缩放意味着不到一个像素的窗口；
+        超出 [RENDER_SCALE_MIN, RENDER_SCALE_MAX] 时按配置截断（clamp）或拒绝（reject）。
+        """
+        try:
+            scale = float(scale)
+        except (TypeError, ValueError):
+            raise ValueError(f"Invalid scale: {scale}")
+        if not math.isfinite(scale) or scale <= 0:
+            raise ValueError(f"Invalid scale: {scale}")
+        
+        scale_min = self.get_render_option('scale_min')
+        scale_max = self.get_render_option('scale_max')
+        if scale_min <= scale <= scale_max:
+            return scale
+        if self.get_render_option('scale_policy') == 'reject':
+            raise ValueError(f"缩放比例超出范围 [{scale_min}, {scale_max}]: {scale}")
+        return min(max(scale, scale_min), scale_max)
+    
+    @classmethod
+    def memory_source_path(cls, digest):
+        return cls.MEMORY_SOURCE_PREFIX + digest
+    
+    @property
+    def memory_digest(self):
+        """内存原图的内容哈希；原图是文件时为 None"""
+        original_path = self.params['image']['original_path']
+        if self.source_data is None or not original_path.startswith(self.MEMORY_SOURCE_PREFIX):
+            return None
+        return original_path[len(self.MEMORY_SOURCE_PREFIX):]
+    
+    def _open_source(self, path):
+        """打开原图：内存原图每次使用新的 BytesIO（与 source_data 共享缓冲区，不复制）"""
+        if self.memory_digest and path == self.params['image']['original_path']:
+            return Image.open(io.BytesIO(self.source_data))
+        return Image.open(path)
+    
+    @property
+    def tier(self):
+        """当前质量档位的渲染设置"""
+        return self.QUALITY_TIERS[self.params.get('quality') or self.QUALITY_STANDARD]
+    
+    def print_size(self):
+        """打印图边长（像素）：final 档位按 baji_specs 的尺寸(mm)和DPI计算，其它档位为 PRINT_SIZE"""
+        if not self.tier['print_dpi']:
+            return self.PRINT_SIZE
+        
+        baji_specs = self.params.get('baji_specs') or {}
+        try:
+            size_mm = float(baji_specs.get('size', 68))
+            dpi = float(baji_specs.get('dpi', 300))
+        except (TypeError, ValueError):
+            raise ValueError(f"Invalid baji_specs: size={baji_specs.get('size')}, dpi={baji_specs.get('dpi')}")
+        if not (math.isfinite(size_mm) and size_mm > 0):
+            raise ValueError(f"Invalid baji_specs.size: {baji_specs.get('size')}")
+        if not self.PRINT_DPI_MIN <= dpi <= self.PRINT_DPI_MAX:
+            raise ValueError(f"打印DPI超出范围 [{self.PRINT_DPI_MIN}, {self.PRINT_DPI_MAX}]: {baji_specs.get('dpi')}")
+        return max(1, round(size_mm / self.MM_PER_INCH * dpi))
+    
+    def print_dpi(self):
+        """打印图的实际DPI：final 档位为 baji_specs.dpi，其它档位由 PRINT_SIZE 和吧唧尺寸换算"""
+        baji_specs = self.params.get('baji_specs') or {}
+        if self.tier['print_dpi']:
+            dpi = float(baji_specs.get('dpi', 300))
+        else:
+            dpi = self.PRINT_SIZE * self.MM_PER_INCH / float(baji_specs.get('size', 68))
+        return int(dpi) if dpi == int(dpi) else round(dpi, 2)
+    
+    def print_master_metadata(self, artifacts, path):
+        """打印母版的元数据（记录在订单中，PDF导出、下载、打印任务据此直接使用母版）"""
+        image = artifacts['print_master']
+        baji_specs = self.params.get('baji_specs') or {}
+        return {
+            'path': path,
+            'format': encoder_profiles.normalize_format(os.path.splitext(path)[1].lstrip('.')) or 'PNG',
+            'width': image.width,
+            'height': image.height,
+            'dpi': self.print_dpi(),
+            'size_mm': float(baji_specs.get('size', 68)),
+            'color_mode': image.mode,
+            'quality': self.params['quality']
+        }
     
     def get_nested_value(self, path):
         """获取嵌套字典值"""
@@ -41,286 +238,506 @@ class BajiProcessor:
         return value
     
     def process_image(self):
-        """处理图片，完全复现前端Canvas效果 - 新版本基于设计模式和打印模式"""
-        # 获取图片路径并处理相对路径
-        image_path = self.params['image']['original_path']
-        if not os.path.isabs(image_path):
-            # 如果是相对路径，尝试在uploads目录中查找
-            upload_folder = current_app.config.get('UPLOAD_FOLDER', 'static/uploads')
-            full_path = os.path.join(upload_folder, image_path)
-            if os.path.exists(full_path):
-                image_path = full_path
-            elif os.path.exists(image_path):
-                # 如果相对路径存在，使用它
-                pass
-            else:
-                raise FileNotFoundError(f"图片文件不存在: {image_path}")
-        
-        # 加载原始图片
-        original_image = Image.open(image_path)
+        """处理图片，返回打印图片（兼容旧接口）"""
+        return self.render_artifacts()['print_master']
+    
+    def render_artifacts(self):
+        """单次渲染，完全复现前端Canvas效果 - 基于设计模式和打印模式
+        
+        渲染分为明确的阶段：解码 -> 模式转换 -> 旋转 -> 裁切 -> 缩放 -> 颜色校正，
+        每个阶段的输出以上游阶段的键 + 本阶段输入为键缓存在进程内（stage_cache），
+        只改动一个参数的预览只重新执行变化点下游的阶段（渲染进程池按原图固定通道，同一原图的渲染落在同一进程）。
+        同时产出打印母版、设计预览图和缩略图，不写任何文件，保存由 save_artifacts 负责。
+        """
+        start = time.perf_counter()
+        image_path = self.resolve_image_path()
+        
+        # 解码阶段：按解码规划缩小解码分辨率（优先使用金字塔层级），后续几何计算都基于解码后的像素
+        source = self._stage_decode(image_path)
+        
+        # 几何计算：在旋转后坐标系中确定设计/打印裁切窗口，再映射回原图坐标
+        geometry = RenderGeometry(source.image.size, self.params['edit_params'], source.scale)
+        if self.debug_log:
+            self._debug_geometry(geometry)
+        
+        if self.get_render_option('mode') == self.RENDER_MODE_AFFINE:
+            preview_stage, print_stage = self._render_affine(source, geometry)
+        else:
+            preview_stage, print_stage = self._render_region(source, geometry)
+        
+        # 颜色校正阶段：应用用户偏好到打印图片
+        print_stage = self._stage_color(print_stage)
+        
+        # 缩略图直接从最终打印图片生成，不再重新渲染
+        thumbnail_stage = self._stage_resize(print_stage, self.THUMBNAIL_SIZE)
+        render_metrics.observe('render.wall_ms', round((time.perf_counter() - start) * 1000, 3))
+        
+        return {
+            'print_master': print_stage.image,
+            'design_preview': preview_stage.image,
+            'thumbnail': thumbnail_stage.image,
+            # 各结果在阶段缓存中的键，编码阶段据此复用已编码的数据
+            'stage_keys': {
+                'print_master': print_stage.key,
+                'design_preview': preview_stage.key,
+                'thumbnail': thumbnail_stage.key
+            }
+        }
+    
+    def _run_stage(self, stage, key, compute, input_image=None):
+        """执行一个渲染阶段，返回 RenderStage(键, 图片)；实际执行时（阶段缓存未命中）记录阶段指标"""
+        return RenderStage(key, stage_cache.get_or_compute(
+            stage, key, lambda: render_metrics.measure(stage, compute, input_image)))
+    
+    def cache_params(self):
+        """规范化的渲染参数（渲染缓存键的一部分）
         
+        只包含会影响渲染结果的参数，浮点数统一精度，渲染选项取实际生效的值。
+        """
+        edit_params = self.params['edit_params']
+        user_prefs = self.params.get('user_preferences', {})
         
-        # 转换为RGBA模式以支持透明度
-        if original_image.mode != 'RGBA':
-            if original_image.mode == 'P':
-                original_image = original_image.convert('RGBA')
+        def normalize(value):
+            return round(float(value), 4)
+        
+        return {
+            'version': self.RENDER_VERSION,
+            # 质量档位和打印图尺寸：draft 结果不会被当作打印图复用
+            'quality': self.params['quality'],
+            'print_size': self.print_size(),
+            'edit_params': {
+                'scale': normalize(edit_params['scale']),
+                'rotation': normalize(edit_params['rotation']),
+                'offset_x': normalize(edit_params['offset_x']),
+                'offset_y': normalize(edit_params['offset_y']),
+                'canvas_client_width': normalize(edit_params.get('canvas_client_width', 331)),
+                'canvas_client_height': normalize(edit_params.get('canvas_client_height', 331))
+            },
+            'user_preferences': {
+                'color_correction': bool(user_prefs.get('color_correction', True)),
+                'sharpening': bool(user_prefs.get('sharpening', False))
+            },
+            'render_options': {name: self.get_render_option(name) for name in sorted(self.RENDER_OPTION_CONFIG)}
+        }
+    
+    def plan_decode(self, source_size):
+        """解码规划：计算裁切区域在不损失输出分辨率的前提下允许的最大缩小倍数
+        
+        设计窗口最终缩放到342px、打印窗口缩放到打印图尺寸，原图像素只要不少于输出像素即可；
+        draft 档位再额外缩小 decode_reduction 倍（即使关闭了 RENDER_DRAFT_DECODE）。
+        """
+        decode_reduction = self.tier['decode_reduction']
+        if not self.get_render_option('draft_decode') and decode_reduction == 1:
+            return 1
+        
+        geometry = RenderGeometry(source_size, self.params['edit_params'])
+        design_ratio = geometry.visible_area_size / self.PREVIEW_SIZE
+        print_ratio = geometry.print_crop_half * 2 / self.print_size()
+        return max(1, min(design_ratio, print_ratio) * decode_reduction)
+    
+    def plan_source(self, image_path, source_size):
+        """解码规划：返回 (实际解码的文件, 解码时的整数缩小倍数)
+        
+        上传时生成过金字塔的图片先选用满足分辨率的最小层级，剩余的缩小倍数在解码时完成。
+        final 档位不使用金字塔，打印母版直接从原图按 draft/reduce 缩小解码。
+        """
+        max_reduction = self.plan_decode(source_size)
+        use_pyramid = self.get_render_option('use_pyramid') and self.tier['use_pyramid'] and not self.memory_digest
+        manifest = image_pyramid.load(image_path) if use_pyramid else None
+        
+        decode_path, factor = image_path, max(1, int(max_reduction))
+        if max_reduction >= 2:
+            level = image_pyramid.select_level(manifest, max_reduction)
+            if level:
+                decode_path = level['path']
+                factor = max(1, int(max_reduction * level['long_edge'] / max(source_size)))
+        
+        return self._fit_decode_budget(decode_path, factor, manifest)
+    
+    def _estimate_decode(self, decode_path, factor):
+        """只读取文件头，估算解码峰值内存，返回 (缩小倍数, 峰值字节数)
+        
+        解码后像素数超过 RENDER_PIXEL_BUDGET 时加大缩小倍数（只在极端尺寸下降低分辨率）。
+        JPEG 在DCT阶段最多直接缩小到1/8，其它格式需要先完整解码再 reduce()。
+        """
+        with self._open_source(decode_path) as header:
+            width, height = header.size
+            image_format = header.format
+            mode = header.mode
+        # PIL 内部 RGB/LA 等多通道模式每像素也占4字节
+        pixel_bytes = 1 if mode in ('1', 'L', 'P') else 4
+        
+        pixel_budget = self.get_render_option('pixel_budget')
+        while math.ceil(width / factor) * math.ceil(height / factor) > pixel_budget:
+            factor += 1
+        
+        if image_format == 'JPEG':
+            draft_scale = 2 ** min(3, int(math.log2(factor)))
+            peak = math.ceil(width / draft_scale) * math.ceil(height / draft_scale) * pixel_bytes
+        else:
+            peak = width * height * pixel_bytes
+            if factor > 1 and mode not in ('L', 'LA', 'RGB', 'RGBA'):
+                # 调色板等模式需要先转换为RGBA再缩小
+                peak += width * height * 4
+        peak += math.ceil(width / factor) * math.ceil(height / factor) * 4
+        return factor, peak
+    
+    def _fit_decode_budget(self, decode_path, factor, manifest):
+        """保证解码峰值内存不超过 RENDER_MEMORY_BUDGET，返回 (实际解码的文件, 缩小倍数)
+        
+        超出预算时改用能放进预算的最大金字塔层级（降低分辨率），没有合适层级时拒绝渲染。
+        """
+        memory_budget = self.get_render_option('memory_budget')
+        budget_factor, peak = self._estimate_decode(decode_path, factor)
+        if peak <= memory_budget:
+            return decode_path, budget_factor
+        
+        levels = sorted(manifest['levels'], key=lambda level: level['long_edge'], reverse=True) if manifest else []
+        for level in levels:
+            if level['path'] == decode_path or not os.path.exists(level['path']):
+                continue
+            level_factor, level_peak = self._estimate_decode(level['path'], 1)
+            if level_peak <= memory_budget:
+                if has_app_context():
+                    current_app.logger.warning(
+                        f"解码 {decode_path} 需要约 {peak // (1024 * 1024)}MB，超出渲染内存预算，改用金字塔层级 {level['long_edge']}")
+                return level['path'], level_factor
+        
+        raise ValueError(f"图片尺寸超出渲染内存预算（约需 {peak // (1024 * 1024)}MB），请缩小图片后重新上传")
+    
+    def _stage_decode(self, image_path):
+        """解码阶段，返回 DecodedSource(键, 图片, 相对原图的缩放比例)"""
+        with self._open_source(image_path) as header:
+            source_size = header.size
+        decode_path, factor = self.plan_source(image_path, source_size)
+        
+        if self.memory_digest:
+            # 内存原图按内容哈希作为键
+            key = (image_path, len(self.source_data), decode_path, factor)
+        else:
+            stat = os.stat(image_path)
+            key = (os.path.abspath(image_path), stat.st_size, stat.st_mtime_ns, decode_path, factor)
+        image = stage_cache.get_or_compute('decode', key, lambda: render_metrics.measure(
+            'decode', lambda: self._decode_source(decode_path, factor),
+            input_pixels=source_size[0] * source_size[1],
+            peak_bytes=self._estimate_decode(decode_path, factor)[1]))
+        return DecodedSource(key, image, image.size[0] / source_size[0])
+    
+    def _decode_source(self, decode_path, factor):
+        """解码图片并按整数倍缩小
+        
+        JPEG 使用 draft() 在DCT阶段直接按 1/2、1/4、1/8 解码；其它格式解码后用 reduce() 缩小。
+        """
+        source_image = self._open_source(decode_path)
+        if factor > 1:
+            width, height = source_image.size
+            if source_image.format == 'JPEG':
+                source_image.draft(source_image.mode, (math.ceil(width / factor), math.ceil(height / factor)))
             else:
-                # 创建白色背景
-                background = Image.new('RGBA', original_image.size, (255, 255, 255, 255))
-                if original_image.mode == 'RGB':
-                    original_image = original_image.convert('RGBA')
-            background.paste(original_image, mask=original_image.split()[-1] if original_image.mode == 'RGBA' else None)
-            original_image = background
-        
-        # 获取编辑参数
-        edit_params = self.params['edit_params']
-        scale = edit_params['scale']
-        rotation = edit_params['rotation']
-        offset_x = edit_params['offset_x']
-        offset_y = edit_params['offset_y']
-        
-        # 获取Canvas真实宽度331（前端传递）
-        canvas_client_width = edit_params.get('canvas_client_width', 331)
-        canvas_client_height = edit_params.get('canvas_client_height', 331)
-        canvas_size = min(canvas_client_width, canvas_client_height)
-        
-        print(f"🔍 新的处理逻辑 - 基于设计模式和打印模式:")
-        print(f"  Canvas真实宽度: {canvas_client_width}x{canvas_client_height}")
-        print(f"  Canvas尺寸: {canvas_size}")
-        print(f"  用户缩放比例: {scale}")
-        print(f"  旋转角度: {rotation}")
-        print(f"  偏移: ({offset_x}, {offset_y})")
-        
-        # 设计模式的数据计算 - 按照用户精确要求
-        # Canvas真实宽度331，缩放0.6时，可视区域大小 = 331/0.6 = 551.67
-        # 半可视区域 = 275.83
-        # 原图中心点512x512，裁切区域 = 512-275.83 到 512+275.83
-        
-        img_width, img_height = original_image.size
-        original_center_x = img_width / 2
-        original_center_y = img_height / 2
-        
-        # 计算可视区域大小（基于Canvas真实宽度331）
-        visible_area_size = canvas_size / scale  # 331 / 0.6 = 551.67
-        half_visible_area = visible_area_size / 2  # 275.83
-        
-        # 计算设计模式的裁切区域（考虑偏移和旋转）
-        # 偏移是相对于Canvas的像素偏移，需要转换为相对于原图的偏移
-        # Canvas显示区域大小 = canvas_size，原图对应区域大小 = visible_area_size
-        # 注意：前端向右拖拽时，图片向右移动，但裁切区域应该向左移动来显示图片的右侧部分
-        # 重要：前端的变换顺序是 translate -> rotate -> scale，所以偏移会受到旋转影响
-        
-        offset_scale_factor = visible_area_size / canvas_size
-        
-        # 简化偏移计算：既然我们已经先旋转图片，再在旋转后的图片上应用偏移
-        # 那么偏移计算应该基于旋转后的坐标系，直接应用偏移即可
-        # 不需要复杂的反向旋转计算，因为图片已经旋转了
-        image_offset_x = -offset_x * offset_scale_factor
-        image_offset_y = -offset_y * offset_scale_factor
-        
-        print(f"🔍 简化偏移计算:")
-        print(f"  原始Canvas偏移: ({offset_x}, {offset_y})")
-        print(f"  缩放因子: {offset_scale_factor}")
-        print(f"  旋转角度: {rotation}°")
-        print(f"  最终图片偏移: ({image_offset_x}, {image_offset_y})")
-        
-        design_crop_center_x = original_center_x + image_offset_x
-        design_crop_center_y = original_center_y + image_offset_y
-        
-        # 设计模式裁切区域
-        design_crop_left = design_crop_center_x - half_visible_area
-        design_crop_top = design_crop_center_y - half_visible_area
-        design_crop_right = design_crop_center_x + half_visible_area
-        design_crop_bottom = design_crop_center_y + half_visible_area
-        
-        # 确保裁切区域不超出原图边界
-        actual_design_crop_left = max(0, design_crop_left)
-        actual_design_crop_top = max(0, design_crop_top)
-        actual_design_crop_right = min(img_width, design_crop_right)
-        actual_design_crop_bottom = min(img_height, design_crop_bottom)
-        
-        design_crop_width = actual_design_crop_right - actual_design_crop_left
-        design_crop_height = actual_design_crop_bottom - actual_design_crop_top
-        
-        print(f"🔍 设计模式数据计算:")
-        print(f"  Canvas真实宽度: {canvas_size}")
-        print(f"  缩放比例: {scale}")
-        print(f"  可视区域大小: {visible_area_size}")
-        print(f"  半可视区域: {half_visible_area}")
-        print(f"  原始图片尺寸: {img_width}x{img_height}")
-        print(f"  原始中心点: ({original_center_x}, {original_center_y})")
-        print(f"  Canvas偏移: ({offset_x}, {offset_y})")
-        print(f"  图片偏移: ({image_offset_x}, {image_offset_y})")
-        print(f"  设计裁切中心: ({design_crop_center_x}, {design_crop_center_y})")
-        print(f"  设计裁切区域: ({design_crop_left}, {design_crop_top}) 到 ({design_crop_right}, {design_crop_bottom})")
-        print(f"  实际设计裁切区域: ({actual_design_crop_left}, {actual_design_crop_top}) 到 ({actual_design_crop_right}, {actual_design_crop_bottom})")
-        print(f"  设计裁切尺寸: {design_crop_width}x{design_crop_height}")
-        
-        # 正确的处理顺序：先旋转，再偏移，最后裁切
-        # 这样才符合前端的变换顺序：translate -> rotate -> scale -> drawImage
-        
-        # 步骤1: 先对完整图片进行旋转
-        if rotation != 0:
-            # PIL的rotate是逆时针，Canvas的rotate是顺时针，所以需要取反
-            rotated_image = original_image.rotate(-rotation, expand=True, fillcolor=(255, 255, 255, 255))
+                if source_image.mode not in ('L', 'LA', 'RGB', 'RGBA'):
+                    source_image = self._normalize_mode(source_image)
+                source_image = source_image.reduce(factor)
+        source_image.load()
+        return source_image
+    
+    def _stage_normalize(self, source):
+        """模式转换阶段：整张解码图转换为RGBA（逐像素转换，与先裁切再转换结果一致）"""
+        return self._run_stage('normalize', source.key, lambda: self._normalize_mode(source.image), source.image)
+    
+    def _stage_rotate(self, normalized, geometry, window):
+        """旋转阶段：取出旋转后坐标系中的一个窗口
+        
+        旋转只作用于窗口覆盖的原图区域，所以以窗口为键；颜色校正等下游参数变化时直接命中。
+        """
+        box = geometry.pixel_box(window)
+        key = (normalized.key, geometry.rotation, box)
+        return self._run_stage('rotate', key, lambda: self._extract_window(normalized.image, geometry, window)[0],
+                               normalized.image)
+    
+    def _stage_rotate_tiled(self, source, geometry, window):
+        """旋转阶段（条带）：逐条带 裁切 -> 转换 -> 旋转，峰值内存只有解码图加一个条带"""
+        box = geometry.pixel_box(window)
+        key = (source.key, geometry.rotation, box, 'tiled')
+        return self._run_stage('rotate', key, lambda: self._extract_window_tiled(source.image, geometry, window),
+                               source.image)
+    
+    def _fits_normalize_budget(self, source):
+        """整张解码图转换为RGBA是否在内存预算内"""
+        width, height = source.image.size
+        return width * height * 4 <= self.get_render_option('memory_budget') * self.NORMALIZE_BUDGET_RATIO
+    
+    def _stage_crop(self, window_stage, box):
+        """裁切阶段：从已旋转的窗口中裁出子区域"""
+        return self._run_stage('crop', (window_stage.key, box), lambda: window_stage.image.crop(box),
+                               window_stage.image)
+    
+    def _stage_resize(self, stage, output_size):
+        """缩放阶段：按质量档位的采样方法（默认LANCZOS）缩放到输出尺寸"""
+        size = (output_size, output_size)
+        resample = self.tier['resize_resample']
+        return self._run_stage('resize', (stage.key, size, resample),
+                               lambda: stage.image.resize(size, resample), stage.image)
+    
+    def _stage_color(self, print_stage):
+        """颜色校正阶段：只按不透明像素的直方图自动对比度，可选锐化（见 utils/color_correction.py）"""
+        user_prefs = self.params.get('user_preferences', {})
+        color_correction = bool(user_prefs.get('color_correction', True)) and self.tier['color_correction']
+        sharpening = bool(user_prefs.get('sharpening', False))
+        if not color_correction and not sharpening:
+            return print_stage
+        
+        return self._run_stage('color', (print_stage.key, color_correction, sharpening),
+                               lambda: color_corrector.apply(print_stage.image, color_correction, sharpening),
+                               print_stage.image)
+    
+    def _render_region(self, source, geometry):
+        """区域模式：旋转 -> 裁切 -> LANCZOS缩放，返回 (预览图阶段, 打印图阶段)
+        
+        tiled 模式或整图转换超出内存预算时按条带取出窗口，结果与整图转换完全一致。
+        """
+        # 只取出打印窗口覆盖的原图区域进行旋转，设计窗口包含在打印窗口内
+        if self.get_render_option('mode') == self.RENDER_MODE_TILED or not self._fits_normalize_budget(source):
+            print_crop = self._stage_rotate_tiled(source, geometry, geometry.print_window())
         else:
-            rotated_image = original_image
-        
-        
-        # 步骤2: 在旋转后的图片上计算偏移和裁切
-        # 重新计算旋转后图片的尺寸和中心点
-        rotated_width, rotated_height = rotated_image.size
-        rotated_center_x = rotated_width / 2
-        rotated_center_y = rotated_height / 2
-        
-        # 重新计算偏移（基于旋转后的图片）
-        # 既然我们已经先旋转了图片，偏移计算应该基于旋转后的图片坐标系
-        # 不需要调换X和Y，直接使用计算出的偏移值
-        rotated_offset_x = image_offset_x
-        rotated_offset_y = image_offset_y
-        
-        print(f"🔍 旋转后偏移应用:")
-        print(f"  计算出的偏移: ({image_offset_x}, {image_offset_y})")
-        print(f"  旋转角度: {rotation}°")
-        print(f"  应用到旋转后图片: ({rotated_offset_x}, {rotated_offset_y})")
-        
-        # 计算旋转后图片的裁切中心
-        rotated_crop_center_x = rotated_center_x + rotated_offset_x
-        rotated_crop_center_y = rotated_center_y + rotated_offset_y
-        
-        # 计算旋转后图片的裁切区域
-        rotated_crop_left = rotated_crop_center_x - half_visible_area
-        rotated_crop_top = rotated_crop_center_y - half_visible_area
-        rotated_crop_right = rotated_crop_center_x + half_visible_area
-        rotated_crop_bottom = rotated_crop_center_y + half_visible_area
-        
-        # 确保裁切区域不超出旋转后图片边界
-        actual_rotated_crop_left = max(0, rotated_crop_left)
-        actual_rotated_crop_top = max(0, rotated_crop_top)
-        actual_rotated_crop_right = min(rotated_width, rotated_crop_right)
-        actual_rotated_crop_bottom = min(rotated_height, rotated_crop_bottom)
-        
-        # 步骤3: 从旋转后的图片中裁切出最终区域
-        design_crop = rotated_image.crop((actual_rotated_crop_left, actual_rotated_crop_top, actual_rotated_crop_right, actual_rotated_crop_bottom))
-        
-        
-        # 更新变量名以保持兼容性
-        rotated_design = design_crop
-        
-        # 打印模式的数据计算 - 按照用户精确要求
-        # 对275.83这个图片高度加上68mm中多出的部分 = 275.83 * 68/58 = 323.33
-        # 打印裁切区域 = 512-323.33 到 512+323.33
-        
-        # 打印模式也使用相同的处理顺序：先旋转，再偏移，最后裁切
-        # 计算打印模式的裁切区域（基于旋转后的图片）
-        print_crop_half = half_visible_area * 68 / 58  # 275.83 * 68/58 = 323.33
-        
-        # 在旋转后的图片上计算打印模式的裁切区域
-        print_crop_center_x = rotated_center_x + rotated_offset_x
-        print_crop_center_y = rotated_center_y + rotated_offset_y
-        
-        # 打印模式裁切区域
-        print_crop_left = print_crop_center_x - print_crop_half
-        print_crop_top = print_crop_center_y - print_crop_half
-        print_crop_right = print_crop_center_x + print_crop_half
-        print_crop_bottom = print_crop_center_y + print_crop_half
-        
-        # 确保打印裁切区域不超出旋转后图片边界
-        actual_print_crop_left = max(0, print_crop_left)
-        actual_print_crop_top = max(0, print_crop_top)
-        actual_print_crop_right = min(rotated_width, print_crop_right)
-        actual_print_crop_bottom = min(rotated_height, print_crop_bottom)
-        
-        print_crop_width = actual_print_crop_right - actual_print_crop_left
-        print_crop_height = actual_print_crop_bottom - actual_print_crop_top
-        
-        print(f"🔍 打印模式数据计算:")
-        print(f"  打印裁切半区域: {print_crop_half}")
-        print(f"  旋转后图片尺寸: {rotated_width}x{rotated_height}")
-        print(f"  旋转后图片中心: ({rotated_center_x}, {rotated_center_y})")
-        print(f"  打印裁切中心: ({print_crop_center_x}, {print_crop_center_y})")
-        print(f"  打印裁切区域: ({print_crop_left}, {print_crop_top}) 到 ({print_crop_right}, {print_crop_bottom})")
-        print(f"  实际打印裁切区域: ({actual_print_crop_left}, {actual_print_crop_top}) 到 ({actual_print_crop_right}, {actual_print_crop_bottom})")
-        print(f"  打印裁切尺寸: {print_crop_width}x{print_crop_height}")
-        
-        # 从旋转后的图片中裁切出打印区域
-        print_crop = rotated_image.crop((actual_print_crop_left, actual_print_crop_top, actual_print_crop_right, actual_print_crop_bottom))
-        
+            normalized = self._stage_normalize(source)
+            print_crop = self._stage_rotate(normalized, geometry, geometry.print_window())
+        print_box = geometry.pixel_box(geometry.print_window())
+        design_box = geometry.pixel_box(geometry.design_window())
+        rotated_design = self._stage_crop(print_crop, (
+            design_box[0] - print_box[0],
+            design_box[1] - print_box[1],
+            design_box[2] - print_box[0],
+            design_box[3] - print_box[1]
+        ))
         
         # 生成最终图片 - 按照用户精确要求
         # 预览图: 342x342像素 (58mm at 150 DPI)
-        # 打印图: 402x402像素 (68mm at 150 DPI)
-        
-        preview_size = 342  # 58mm at 150 DPI
-        print_size = 402    # 68mm at 150 DPI
+        # 打印图: 402x402像素 (68mm at 150 DPI)，final 档位按 baji_specs 的DPI计算
         
         # 生成预览图片（从设计模式裁切生成）
-        preview_image = rotated_design.resize((preview_size, preview_size), Image.Resampling.LANCZOS)
+        preview_stage = self._stage_resize(rotated_design, self.PREVIEW_SIZE)
         
         # 生成打印图片（从打印模式裁切生成）
-        print_image = print_crop.resize((print_size, print_size), Image.Resampling.LANCZOS)
-        
-        # 使用文件管理器获取基于日期的导出路径
-        from utils.file_manager import file_manager
-        
-        # 保存预览图片
-        preview_filename = f"preview_{os.path.basename(image_path).split('.')[0]}.png"
-        preview_path = file_manager.get_dated_export_path(preview_filename)
-        preview_image.save(preview_path, 'PNG')
-        print(f"🔍 预览图片已保存: {preview_path} (尺寸: {preview_size}x{preview_size})")
-        
-        # 保存打印图片
-        print_filename = f"print_{os.path.basename(image_path).split('.')[0]}.png"
-        print_path = file_manager.get_dated_export_path(print_filename)
-        print_image.save(print_path, 'PNG')
-        print(f"🔍 打印图片已保存: {print_path} (尺寸: {print_size}x{print_size})")
-        
-        # 应用用户偏好到打印图片
-        user_prefs = self.params.get('user_preferences', {})
+        print_stage = self._stage_resize(print_crop, self.print_size())
         
-        if user_prefs.get('color_correction', True):
-            # 只对非透明区域应用颜色校正
-            if print_image.mode == 'RGBA':
-                # 分离RGB和Alpha通道
-                rgb_image = Image.new('RGB', print_image.size, (255, 255, 255))
-                rgb_image.paste(print_image, mask=print_image.split()[-1])
-                rgb_image = ImageOps.autocontrast(rgb_image)
-                # 重新组合
-                print_image = Image.merge('RGBA', (*rgb_image.split(), print_image.split()[-1]))
+        return preview_stage, print_stage
+    
+    def _render_affine(self, source, geometry):
+        """仿射模式：偏移/旋转/缩放/裁切合并为一个矩阵，直接采样最终图块
+        
+        不分配旋转后的整图和裁切中间图，旋转、裁切和缩放合并为一个采样阶段，
+        返回 (预览图阶段, 打印图阶段)。
+        """
+        # 不透明图片直接在解码图上采样，带透明度或调色板的图片先转换模式（超出内存预算时只转换窗口区域）
+        if source.image.mode not in ('RGB', 'L') and self._fits_normalize_budget(source):
+            source = self._stage_normalize(source)
+        
+        preview_stage = self._stage_sample(source, geometry, geometry.design_window(), self.PREVIEW_SIZE)
+        print_stage = self._stage_sample(source, geometry, geometry.print_window(), self.print_size())
+        return preview_stage, print_stage
+    
+    def _stage_sample(self, source, geometry, window, output_size):
+        """采样阶段（仿射模式）：从解码图直接采样一个 output_size x output_size 的图块"""
+        box = geometry.pixel_box(window)
+        resample = self.tier['sample_resample']
+        key = (source.key, geometry.rotation, box, output_size, resample)
+        return self._run_stage('sample', key,
+                               lambda: self._sample_tile(source.image, geometry, box, output_size, resample),
+                               source.image)
+    
+    def _sample_tile(self, source_image, geometry, box, output_size, resample=Image.Resampling.BICUBIC):
+        """从原图直接采样一个 output_size x output_size 的图块"""
+        size = (output_size, output_size)
+        
+        if source_image.mode in ('RGB', 'L'):
+            # 不透明图片直接在原图上采样，图块再转换为RGBA
+            fillcolor = self.FILL_COLOR[:3] if source_image.mode == 'RGB' else self.FILL_COLOR[0]
+            matrix = geometry.tile_matrix(box, size)
+            tile = source_image.transform(size, Image.Transform.AFFINE, matrix,
+                                          resample, fillcolor=fillcolor)
+            return self._normalize_mode(tile)
+        
+        # 带透明度的图片只采样窗口覆盖的原图区域
+        source_box = geometry.source_bbox(box)
+        if source_box is None:
+            return Image.new('RGBA', size, self.FILL_COLOR)
+        region = self._normalize_mode(source_image.crop(source_box))
+        matrix = geometry.tile_matrix(box, size, region_origin=source_box[:2])
+        return region.transform(size, Image.Transform.AFFINE, matrix,
+                                resample, fillcolor=self.FILL_COLOR)
+    
+    def get_render_option(self, name):
+        """读取渲染选项：优先使用参数中的 render_options，其次是应用配置"""
+        render_options = self.params.get('render_options') or {}
+        if name in render_options:
+            return render_options[name]
+        
+        config_key, default = self.RENDER_OPTION_CONFIG[name]
+        if has_app_context():
+            return current_app.config.get(config_key, default)
+        return default
+    
+    def resolve_image_path(self):
+        """获取图片路径并处理相对路径（内存原图直接返回 memory:<sha256>）"""
+        image_path = self.params['image']['original_path']
+        if self.memory_digest:
+            return image_path
+        if not os.path.isabs(image_path):
+            # 如果是相对路径，尝试在uploads目录中查找
+            upload_folder = current_app.config.get('UPLOAD_FOLDER', 'static/uploads')
+            full_path = os.path.join(upload_folder, image_path)
+            if os.path.exists(full_path):
+                image_path = full_path
+            elif os.path.exists(image_path):
+                # 如果相对路径存在，使用它
+                pass
             else:
-                print_image = ImageOps.autocontrast(print_image)
-        
-        if user_prefs.get('sharpening', False):
-            print_image = print_image.filter(ImageFilter.SHARPEN)
-        
-        # 重新保存处理后的打印图片
-        print_image.save(print_path, 'PNG')
-        
-        # 返回打印图片作为主要结果
-        return print_image
+                raise FileNotFoundError(f"图片文件不存在: {image_path}")
+        return image_path
     
-    def save_processed_image(self, output_path):
-        """保存处理后的图片"""
-        processed_image = self.process_image()
+    @staticmethod
+    def _normalize_mode(image):
+        """转换为RGBA模式以支持透明度"""
+        if image.mode != 'RGBA':
+            image = image.convert('RGBA')
+        return image
+    
+    def _extract_window(self, source_image, geometry, window):
+        """从原图中取出旋转后坐标系中的一个窗口
+        
+        等价于先整图旋转(expand)再裁切，但只解码、转换、旋转窗口覆盖的原图区域。
+        返回 (窗口图片, 取整后的窗口坐标)。
+        """
+        box = geometry.pixel_box(window)
+        size = (box[2] - box[0], box[3] - box[1])
+        
+        if not geometry.is_rotated:
+            # 未旋转时窗口就是原图中的区域，直接裁切
+            return self._normalize_mode(source_image.crop(box)), box
+        
+        source_box = geometry.source_bbox(box)
+        if source_box is None:
+            # 窗口完全落在原图之外，只有填充色
+            return Image.new('RGBA', size, self.FILL_COLOR), box
+        
+        region = self._normalize_mode(source_image.crop(source_box))
+        matrix = geometry.region_matrix(box, source_box[:2])
+        window_image = region.transform(size, Image.Transform.AFFINE, matrix,
+                                        Image.Resampling.NEAREST, fillcolor=self.FILL_COLOR)
+        return window_image, box
+    
+    def _extract_window_tiled(self, source_image, geometry, window):
+        """按水平条带取出旋转后坐标系中的一个窗口
+        
+        每个条带只裁切、转换、旋转它覆盖的原图区域，再贴到窗口图片中；
+        条带起点按定点数对齐（region_matrix），拼接结果与一次取出整个窗口逐像素一致。
+        """
+        box = geometry.pixel_box(window)
+        width, height = box[2] - box[0], box[3] - box[1]
+        
+        if not geometry.is_rotated:
+            # 未旋转时窗口就是原图中的区域，只转换窗口
+            return self._normalize_mode(source_image.crop(box))
+        
+        window_image = Image.new('RGBA', (width, height), self.FILL_COLOR)
+        tile_rows = max(1, int(self.get_render_option('tile_rows')))
+        for top in range(box[1], box[3], tile_rows):
+            strip = (box[0], top, box[2], min(top + tile_rows, box[3]))
+            source_box = geometry.source_bbox(strip)
+            if source_box is None:
+                # 条带完全落在原图之外，保留填充色
+                continue
+            
+            region = self._normalize_mode(source_image.crop(source_box))
+            matrix = geometry.region_matrix(strip, source_box[:2])
+            tile = region.transform((width, strip[3] - strip[1]), Image.Transform.AFFINE, matrix,
+                                    Image.Resampling.NEAREST, fillcolor=self.FILL_COLOR)
+            window_image.paste(tile, (0, top - box[1]))
+        
+        return window_image
+    
+    def _debug_geometry(self, geometry):
+        """输出几何计算调试信息（RENDER_DEBUG_LOG 开启且被采样时）"""
+        info = geometry.describe()
+        logger.info(
+            "吧唧几何计算: 解码尺寸=%s 解码缩放=%s 旋转后尺寸=%s Canvas尺寸=%s 缩放=%s 旋转=%s° "
+            "可视区域大小=%s 图片偏移=%s 设计裁切区域=%s 打印裁切区域=%s",
+            info['source_size'], info['source_scale'], info['rotated_size'], info['canvas_size'],
+            info['scale'], info['rotation'], info['visible_area_size'], info['image_offset'],
+            info['design_window'], info['print_window'])
+    
+    def save_artifacts(self, artifacts, output_path):
+        """保存单次渲染的全部衍生图，每个文件按其编码配置只编码一次
         
-        # 获取保存参数
+        打印母版写入 output_path（扩展名按实际格式调整，文件中记录打印DPI），设计预览图和缩略图写在同一目录下：
+        design_<名称> 和 preview_<名称>。返回各衍生图的实际路径。
+        baji_specs.format / quality 作用于打印母版，baji_specs.artifacts.<衍生图>.format / quality 作用于其它衍生图。
+        """
         baji_specs = self.params.get('baji_specs', {})
-        format = baji_specs.get('format', 'PNG')
-        quality = baji_specs.get('quality', 95)
+        artifact_specs = baji_specs.get('artifacts') or {}
         
-        if format.upper() == 'JPEG':
-            processed_image.save(output_path, format, quality=quality, optimize=True)
-        else:
-            processed_image.save(output_path, format, optimize=True)
+        output_dir = os.path.dirname(output_path)
+        base_name = os.path.basename(output_path).split('.')[0]
         
-        # 同时生成预览图片（小尺寸，和设计效果一致）
-        preview_size = 200
-        preview_image = processed_image.resize((preview_size, preview_size), Image.Resampling.LANCZOS)
-        
-        # 保存预览图片
-        preview_filename = f"preview_{os.path.basename(output_path).split('.')[0]}.png"
-        preview_path = os.path.join(os.path.dirname(output_path), preview_filename)
-        preview_image.save(preview_path, 'PNG')
-        print(f"🔍 预览图片已保存: {preview_path}")
-        
-        return output_path, preview_path
+        saved_paths = {}
+        for name, profile in self.ARTIFACT_PROFILES.items():
+            if name == 'print_master':
+                format, data = self.encode_artifact(artifacts, name, profile, baji_specs.get('format'),
+                                                    baji_specs.get('quality'), self.print_dpi())
+            else:
+                specs = artifact_specs.get(name, {})
+                format, data = self.encode_artifact(artifacts, name, profile, specs.get('format'), specs.get('quality'))
+            path = os.path.join(output_dir, self.ARTIFACT_PREFIXES.get(name, '') + base_name +
+                                encoder_profiles.extension(format))
+            render_metrics.measure('save', lambda: self._write_file(path, data), peak_bytes=len(data))
+            saved_paths[name] = path
+        if self.debug_log:
+            logger.info("渲染结果已保存: %s", saved_paths)
+        
+        return saved_paths
+    
+    @staticmethod
+    def _write_file(path, data):
+        with open(path, 'wb') as f:
+            f.write(data)
+    
+    @classmethod
+    def encode_artifact(cls, artifacts, name, profile='preview', format=None, quality=None, dpi=None):
+        """按编码配置编码一个渲染结果，返回 (格式, 字节)
+        
+        编码结果按 (衍生图, 格式, 参数) 记录在 artifacts['encoded'] 中，
+        同一份渲染结果以相同编码写入渲染缓存和订单文件时不重复编码。
+        """
+        format, options = encoder_profiles.resolve(profile, format, quality, dpi)
+        encoded = artifacts.setdefault('encoded', {})
+        memo_key = cls._encoded_key(name, format, options)
+        if memo_key not in encoded:
+            stage_key = artifacts.get('stage_keys', {}).get(name)
+            encoded[memo_key] = cls._stage_encode(artifacts[name], stage_key, profile, format, options)
+        return format, encoded[memo_key]
+    
+    @classmethod
+    def remember_encoded(cls, artifacts, name, profile, data, format=None):
+        """记录已按编码配置编码好的字节（如从渲染缓存读取的文件），之后保存时直接复用"""
+        format, options = encoder_profiles.resolve(profile, format)
+        artifacts.setdefault('encoded', {})[cls._encoded_key(name, format, options)] = data
+    
+    @staticmethod
+    def _encoded_key(name, format, options):
+        return (name, format, tuple(sorted(options.items())))
+    
+    @staticmethod
+    def _stage_encode(image, image_key, profile, format, options):
+        """编码阶段：返回编码后的字节，同一图片和编码参数只编码一次"""
+        def encode():
+            return encoder_profiles.encode(image, profile, format, options)
+        
+        if image_key is None:
+            # 来自渲染缓存磁盘层的结果没有阶段键，直接编码
+            return encode()
+        return stage_cache.get_or_compute('encode', (image_key, format, tuple(sorted(options.items()))), encode)
+    
+    def save_processed_image(self, output_path):
+        """保存处理后的图片（兼容旧接口），返回 (打印图路径, 预览图路径)"""
+        paths = self.save_artifacts(self.render_artifacts(), output_path)
+        return paths['print_master'], paths['thumbnail']
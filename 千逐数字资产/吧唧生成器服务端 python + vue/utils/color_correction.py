@@ -0,0 +1,132 @@
+# utils/color_correction.py - 打印图颜色校正
+from PIL import Image, ImageOps, ImageFilter
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+class ColorCorrector:
+    """打印图颜色校正（自动对比度 + 可选锐化）
+
+    RGBA 打印图块在 NumPy 数组上一次完成：
+    - 只统计完全不透明像素的各通道直方图（透明背景和半透明边缘不参与对比度拉伸）
+    - 由直方图一次性生成三个通道的查找表，就地应用到数组
+    - 需要锐化时在同一个数组上直接做 3x3 卷积（与 ImageFilter.SHARPEN 相同的核）
+    透明区域仍按白底合成，转为不带 Alpha 的格式时与原先一致。
+
+    未安装 numpy 或非 RGBA 图片时使用 Pillow 实现。
+    """
+
+    # ImageFilter.SHARPEN: 中心 32，周围 -2，除以 16
+    SHARPEN_CENTER = 32
+    SHARPEN_NEIGHBOR = -2
+    SHARPEN_SCALE = 16
+
+    @staticmethod
+    def numpy_available():
+        return np is not None
+
+    def apply(self, image, color_correction=True, sharpening=False):
+        """返回校正后的新图片，不修改输入"""
+        if not color_correction and not sharpening:
+            return image
+        if np is not None and image.mode == 'RGBA':
+            return self._apply_numpy(image, color_correction, sharpening)
+        return self._apply_pil(image, color_correction, sharpening)
+
+    @staticmethod
+    def build_lut(histograms):
+        """由各通道直方图生成查找表（与 ImageOps.autocontrast(cutoff=0) 相同的映射），返回 (通道数, 256) 数组"""
+        ramp = np.arange(256, dtype=np.float64)
+        lut = np.empty((len(histograms), 256), dtype=np.uint8)
+        for channel, histogram in enumerate(histograms):
+            levels = np.flatnonzero(histogram)
+            if levels.size == 0 or levels[-1] <= levels[0]:
+                lut[channel] = ramp
+                continue
+            lo, hi = int(levels[0]), int(levels[-1])
+            scale = 255.0 / (hi - lo)
+            # 与 Pillow 一样先截断再裁剪到 0-255
+            lut[channel] = np.clip((ramp * scale - lo * scale).astype(np.int64), 0, 255)
+        return lut
+
+    def _apply_numpy(self, image, color_correction, sharpening):
+        pixels = np.array(image)  # (高, 宽, 4) 的独立副本
+        rgb = pixels[..., :3]
+        alpha = pixels[..., 3]
+
+        if color_correction:
+            opaque_mask = alpha == 255
+            if opaque_mask.all():
+                opaque = pixels.reshape(-1, 4)
+            else:
+                # 按白底合成透明区域（与 Image.paste 带蒙版时的整数混合一致）
+                weight = alpha[..., None].astype(np.uint16)
+                blended = rgb * weight + 255 * (255 - weight) + 128
+                rgb[...] = ((blended >> 8) + blended) >> 8
+                opaque = rgb[opaque_mask]
+
+            if opaque.size:
+                histograms = [np.bincount(opaque[:, channel], minlength=256) for channel in range(3)]
+                lut = self.build_lut(histograms)
+                for channel in range(3):
+                    np.take(lut[channel], rgb[..., channel], out=rgb[..., channel])
+
+        if sharpening:
+            pixels = self._sharpen(pixels)
+        return Image.fromarray(pixels, 'RGBA')
+
+    def _sharpen(self, pixels):
+        """3x3 锐化，边缘一圈像素保持不变（与 Pillow 的 3x3 滤镜一致）"""
+        height, width = pixels.shape[:2]
+        if height < 3 or width < 3:
+            return pixels
+
+        # 卷积结果在 -4080 ~ 8160 之间，int16 足够
+        source = pixels.astype(np.int16)
+        neighbors = source[:-2, :-2] + source[:-2, 1:-1] + source[:-2, 2:] \
+            + source[1:-1, :-2] + source[1:-1, 2:] \
+            + source[2:, :-2] + source[2:, 1:-1] + source[2:, 2:]
+        total = source[1:-1, 1:-1] * self.SHARPEN_CENTER + neighbors * self.SHARPEN_NEIGHBOR
+        # 四舍五入后裁剪到 0-255
+        sharpened = np.floor_divide(total * 2 + self.SHARPEN_SCALE, self.SHARPEN_SCALE * 2)
+        pixels[1:-1, 1:-1] = np.clip(sharpened, 0, 255)
+        return pixels
+
+    @staticmethod
+    def _apply_pil(image, color_correction, sharpening):
+        if color_correction:
+            if image.mode == 'RGBA':
+                # 只统计不透明像素：透明区域在直方图中按白色计入
+                alpha = image.getchannel('A')
+                rgb_image = Image.new('RGB', image.size, (255, 255, 255))
+                rgb_image.paste(image, mask=alpha)
+                opaque_mask = alpha.point(lambda value: 255 if value == 255 else 0)
+                histogram = rgb_image.histogram(mask=opaque_mask)
+                if sum(histogram):
+                    lut = []
+                    for channel in range(3):
+                        lut.extend(ColorCorrector._autocontrast_lut(histogram[channel * 256:(channel + 1) * 256]))
+                    rgb_image = rgb_image.point(lut)
+                image = Image.merge('RGBA', (*rgb_image.split(), alpha))
+            else:
+                image = ImageOps.autocontrast(image)
+
+        if sharpening:
+            image = image.filter(ImageFilter.SHARPEN)
+        return image
+
+    @staticmethod
+    def _autocontrast_lut(histogram):
+        levels = [level for level, count in enumerate(histogram) if count]
+        if not levels or levels[-1] <= levels[0]:
+            return list(range(256))
+        lo, hi = levels[0], levels[-1]
+        scale = 255.0 / (hi - lo)
+        return [min(255, max(0, int(level * scale - lo * scale))) for level in range(256)]
+
+
+# 全局颜色校正实例
+color_corrector = ColorCorrector()
@@ -0,0 +1,118 @@
+# utils/encoder_profiles.py - 衍生图编码配置
+import io
+from PIL import Image, features
+from flask import current_app, has_app_context
+from utils.render_metrics import render_metrics
+
+
+class EncoderProfiles:
+    """命名的编码配置
+
+    不同用途的衍生图使用不同的编码：
+    - preview：临时预览（渲染缓存），低 zlib 级别的PNG，优先编码速度
+    - thumbnail：订单缩略图，WebP 有损压缩
+    - gallery：展示图（设计预览图），JPEG 有损压缩
+    - archive：存档的打印母版，高压缩级别的PNG
+    RENDER_ENCODER_PROFILES 可以按名称覆盖或新增配置，例如 {"thumbnail": {"format": "JPEG", "quality": 80}}。
+
+    每次编码按配置名记录耗时和输出字节数（encode.<配置名>.wall_ms / output_bytes）。
+    """
+
+    DEFAULT_PROFILES = {
+        'preview': {'format': 'PNG', 'compress_level': 1},
+        'thumbnail': {'format': 'WEBP', 'quality': 80, 'method': 4},
+        'gallery': {'format': 'JPEG', 'quality': 85},
+        'archive': {'format': 'PNG', 'compress_level': 9}
+    }
+
+    # 格式 -> (文件扩展名, 该格式接受的编码参数)
+    FORMATS = {
+        'PNG': ('.png', ('compress_level', 'dpi')),
+        'JPEG': ('.jpg', ('quality', 'optimize', 'progressive', 'subsampling', 'dpi')),
+        'WEBP': ('.webp', ('quality', 'method', 'lossless'))
+    }
+    FORMAT_ALIASES = {'JPG': 'JPEG'}
+
+    # 运行环境的 Pillow 不支持 WebP 时使用的格式
+    WEBP_FALLBACK = 'JPEG'
+
+    # 编码配置 -> (应用配置项, 默认值)
+    SETTING_CONFIG = {
+        'profiles': ('RENDER_ENCODER_PROFILES', {})
+    }
+
+    def get_setting(self, name):
+        """读取编码配置：有应用上下文时使用应用配置"""
+        config_key, default = self.SETTING_CONFIG[name]
+        if has_app_context():
+            return current_app.config.get(config_key, default)
+        return default
+
+    def get_profile(self, name):
+        """内置配置与应用配置合并后的编码配置"""
+        overrides = self.get_setting('profiles') or {}
+        if name not in self.DEFAULT_PROFILES and name not in overrides:
+            raise ValueError(f"未知的编码配置: {name}")
+        profile = dict(self.DEFAULT_PROFILES.get(name, {}))
+        profile.update(overrides.get(name, {}))
+        return profile
+
+    def normalize_format(self, format):
+        """规范化格式名，不支持的格式返回 None"""
+        if not format:
+            return None
+        format = str(format).upper()
+        format = self.FORMAT_ALIASES.get(format, format)
+        if format not in self.FORMATS:
+            return None
+        if format == 'WEBP' and not features.check('webp'):
+            return self.WEBP_FALLBACK
+        return format
+
+    def resolve(self, profile_name, format=None, quality=None, dpi=None):
+        """返回 (格式, 编码参数)；format / quality 为调用方（如 baji_specs）指定的值，优先于配置
+
+        dpi 写入文件的分辨率信息（PNG pHYs / JPEG JFIF），格式不支持时忽略。
+        """
+        profile = self.get_profile(profile_name)
+        format = self.normalize_format(format) or self.normalize_format(profile.pop('format', 'PNG')) or 'PNG'
+        if quality is not None:
+            profile['quality'] = int(quality)
+        if dpi:
+            profile['dpi'] = (dpi, dpi)
+
+        # 只保留目标格式接受的参数（如PNG忽略 quality）
+        allowed = self.FORMATS[format][1]
+        return format, {key: value for key, value in profile.items() if key in allowed}
+
+    def extension(self, format):
+        return self.FORMATS[self.normalize_format(format) or 'PNG'][0]
+
+    def mimetype(self, format):
+        return Image.MIME.get(self.normalize_format(format) or 'PNG', 'application/octet-stream')
+
+    @staticmethod
+    def flatten(image):
+        """转换为JPEG可保存的RGB图片，透明区域按白底合成（与PDF导出一致）"""
+        if image.mode in ('RGBA', 'LA', 'PA', 'P') or 'transparency' in image.info:
+            rgba = image.convert('RGBA')
+            rgb_image = Image.new('RGB', rgba.size, (255, 255, 255))
+            rgb_image.paste(rgba, mask=rgba.getchannel('A'))
+            return rgb_image
+        return image.convert('RGB')
+
+    def encode(self, image, profile_name, format, options):
+        """按已解析的格式和参数编码图片，记录该配置的编码耗时和字节数"""
+        def encode():
+            buffer = io.BytesIO()
+            target = image
+            if format == 'JPEG' and image.mode not in ('RGB', 'L'):
+                target = self.flatten(image)
+            target.save(buffer, format, **options)
+            return buffer.getvalue()
+
+        return render_metrics.measure(f"encode.{profile_name}", encode, image)
+
+
+# 全局编码配置实例
+encoder_profiles = EncoderProfiles()
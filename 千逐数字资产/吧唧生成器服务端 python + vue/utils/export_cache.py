@@ -0,0 +1,183 @@
+# utils/export_cache.py - 导出结果缓存
+import os
+import json
+import time
+import uuid
+import hashlib
+import threading
+from flask import current_app, has_app_context
+from utils.file_manager import file_manager
+
+
+class ExportCache:
+    """按输入指纹缓存导出的PDF
+
+    指纹 = 导出类型 + 生成器版本 + 导出参数（格式、尺寸）+ 每个订单的ID、updated_at 和打印母版内容哈希。
+    输入不变时直接返回已生成的文件（打印结果下载、发票），订单或图片变化后指纹随之变化。
+    文件保存在 static/cache/exports/<指纹>.pdf，超过有效期的条目删除，
+    总字节数超过上限时从最早生成的条目开始删除。
+    """
+
+    # 缓存配置 -> (应用配置项, 默认值)
+    SETTING_CONFIG = {
+        'enabled': ('EXPORT_CACHE_ENABLED', True),
+        'max_bytes': ('EXPORT_CACHE_MAX_BYTES', 512 * 1024 * 1024),
+        'max_age': ('EXPORT_CACHE_MAX_AGE', 24 * 3600)
+    }
+
+    def __init__(self, cache_path=None):
+        self.cache_path = cache_path or file_manager.export_cache_path
+        self._lock = threading.Lock()
+        self.stats = {
+            'hits': 0,
+            'misses': 0,
+            'stores': 0,
+            'expired': 0,
+            'evictions': 0
+        }
+
+    def get_setting(self, name):
+        """读取缓存配置：有应用上下文时使用应用配置"""
+        config_key, default = self.SETTING_CONFIG[name]
+        if has_app_context():
+            return current_app.config.get(config_key, default)
+        return default
+
+    def fingerprint(self, kind, orders, images=True, **options):
+        """计算导出输入的指纹；images 为 False 时不读取订单图片（如发票）"""
+        from utils.pdf_generator import PDFGenerator
+
+        payload = {
+            'kind': kind,
+            'version': PDFGenerator.VERSION,
+            'options': options,
+            'orders': [self._order_inputs(order, images) for order in sorted(orders, key=lambda order: order.id)]
+        }
+        encoded = json.dumps(payload, sort_keys=True, separators=(',', ':'), default=str)
+        return hashlib.sha256(encoded.encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def _order_inputs(order, images):
+        inputs = {
+            'id': order.id,
+            'updated_at': order.updated_at.isoformat() if order.updated_at else None
+        }
+        if images:
+            from utils.order_service import get_print_master
+            from utils.render_cache import render_cache
+            print_master = get_print_master(order)
+            path = print_master['path'] if print_master else None
+            # 内容哈希按路径、大小、修改时间记忆，未变化的母版不重复读取
+            inputs['image'] = render_cache.source_hash(path) if path and os.path.exists(path) else None
+        return inputs
+
+    def cache_dir(self):
+        # send_file 按应用根目录解析相对路径，缓存文件统一使用绝对路径
+        return os.path.abspath(str(self.cache_path))
+
+    def entry_path(self, key):
+        return os.path.join(self.cache_dir(), f"{key}.pdf")
+
+    def get_or_build(self, key, build):
+        """返回 (文件路径, 是否命中)；未命中时调用 build(输出路径) 生成文件
+
+        缓存关闭时调用 build(None)，由生成器使用默认路径。
+        """
+        if not self.get_setting('enabled'):
+            return build(None), False
+
+        path = self.entry_path(key)
+        try:
+            age = time.time() - os.path.getmtime(path)
+        except OSError:
+            age = None
+        if age is not None and age <= self.get_setting('max_age'):
+            with self._lock:
+                self.stats['hits'] += 1
+            return path, True
+
+        with self._lock:
+            self.stats['misses'] += 1
+        # 写入临时文件后原子替换，并发请求不会读到未写完的文件
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        part_path = f"{path}.{uuid.uuid4().hex}.part"
+        try:
+            build(part_path)
+            os.replace(part_path, path)
+        except BaseException:
+            try:
+                os.remove(part_path)
+            except OSError:
+                pass
+            raise
+
+        with self._lock:
+            self.stats['stores'] += 1
+        self._evict(keep=path)
+        return path, False
+
+    def _scan_entries(self):
+        """扫描缓存目录，返回 [(生成时间, 大小, 路径)]"""
+        entries = []
+        cache_dir = self.cache_dir()
+        if not os.path.isdir(cache_dir):
+            return entries
+        for entry in os.scandir(cache_dir):
+            if entry.is_file() and entry.name.endswith('.pdf'):
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        return entries
+
+    def _evict(self, keep=None):
+        """删除过期条目；总字节数超过上限时从最早生成的条目开始删除，直到降到上限的90%"""
+        max_bytes = self.get_setting('max_bytes')
+        expire_before = time.time() - self.get_setting('max_age')
+        entries = []
+        total = 0
+        for mtime, size, path in self._scan_entries():
+            if mtime < expire_before and path != keep:
+                self._remove(path, 'expired')
+                continue
+            entries.append((mtime, size, path))
+            total += size
+
+        if total > max_bytes:
+            target = max_bytes * 0.9
+            for _, size, path in sorted(entries):
+                if total <= target:
+                    break
+                if path == keep:
+                    continue
+                self._remove(path, 'evictions')
+                total -= size
+
+    def _remove(self, path, counter):
+        try:
+            os.remove(path)
+        except OSError:
+            return
+        with self._lock:
+            self.stats[counter] += 1
+
+    def clear(self):
+        """清空缓存"""
+        for _, _, path in self._scan_entries():
+            self._remove(path, 'evictions')
+
+    def get_stats(self):
+        """命中统计和磁盘占用"""
+        entries = self._scan_entries()
+        with self._lock:
+            stats = dict(self.stats)
+        stats['entries'] = len(entries)
+        stats['disk_bytes'] = sum(size for _, size, _ in entries)
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = round(stats['hits'] / lookups, 4) if lookups else 0.0
+        return stats
+
+
+# 全局导出缓存实例
+export_cache = ExportCache()
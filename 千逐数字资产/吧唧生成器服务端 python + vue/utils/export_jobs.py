@@ -0,0 +1,212 @@
+# utils/export_jobs.py - 后台PDF导出任务
+import os
+import json
+import uuid
+import threading
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+from flask import current_app, has_app_context
+from utils.models import ExportJob, Order, PrintJob, db
+from utils.export_volumes import volume_exporter
+
+
+class ExportJobManager:
+    """后台PDF导出任务（export_jobs 表）
+
+    /export/pdf 只登记任务并立即返回任务ID，PDF在后台线程中生成：
+    - 每绘制完一页更新任务进度（已完成页数 / 总页数），状态接口直接读取任务表，多进程部署时同样可查
+    - 生成完成后才执行自动完成（打印中的打印任务 -> completed，订单 -> printed），不在HTTP请求中执行
+    - 完成的文件通过下载接口读取，支持 HTTP Range（断点续传）
+    - 指定 volume_sheets 时按分卷导出（见 utils/export_volumes.py），任务文件为分卷清单，
+      失败的分卷可以单独重试，全部分卷完成后才执行自动完成
+    任务线程在Web进程内运行；进程退出导致超过 EXPORT_JOB_STALE_SECONDS 没有进度的任务视为中断。
+    """
+
+    STATUS_QUEUED = 'queued'
+    STATUS_RUNNING = 'running'
+    STATUS_DONE = 'done'
+    STATUS_FAILED = 'failed'
+
+    # 任务配置 -> (应用配置项, 默认值)
+    SETTING_CONFIG = {
+        'workers': ('EXPORT_JOB_WORKERS', 2),
+        'stale_seconds': ('EXPORT_JOB_STALE_SECONDS', 600)
+    }
+
+    def __init__(self):
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def get_setting(self, name):
+        """读取任务配置：有应用上下文时使用应用配置"""
+        config_key, default = self.SETTING_CONFIG[name]
+        if has_app_context():
+            return current_app.config.get(config_key, default)
+        return default
+
+    @staticmethod
+    def export_dir():
+        """导出目录（与 PDFGenerator 一致：项目根目录下的 static/exports）"""
+        return os.path.join(os.path.dirname(current_app.root_path), 'static', 'exports')
+
+    def submit(self, order_ids, pdf_format='a4_6', baji_size='68x68', filter_status=None, auto_complete=False,
+               volume_sheets=0):
+        """登记导出任务并提交到后台线程，返回任务；volume_sheets 大于0时按每卷N页分卷导出"""
+        job_id = uuid.uuid4().hex
+        if volume_sheets:
+            file_path = os.path.join(self.export_dir(), f"baji_export_{job_id}", volume_exporter.MANIFEST_NAME)
+            volume_exporter.create(file_path, order_ids, pdf_format, baji_size, volume_sheets)
+        else:
+            file_path = os.path.join(self.export_dir(), f"baji_export_{job_id}.pdf")
+        job = ExportJob(
+            job_id=job_id,
+            status=self.STATUS_QUEUED,
+            order_ids=json.dumps(order_ids),
+            pdf_format=pdf_format,
+            baji_size=baji_size,
+            filter_status=filter_status,
+            auto_complete=bool(auto_complete),
+            file_path=file_path
+        )
+        db.session.add(job)
+        db.session.commit()
+
+        self._get_executor().submit(self._run, current_app._get_current_object(), job_id)
+        return job
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.get_setting('workers'),
+                                                    thread_name_prefix='pdf-export')
+            return self._executor
+
+    @staticmethod
+    def is_volume_job(job):
+        """是否为分卷导出任务（任务文件为分卷清单）"""
+        return bool(job.file_path) and os.path.basename(job.file_path) == volume_exporter.MANIFEST_NAME
+
+    def retry_volume(self, job, index):
+        """重新生成分卷导出任务中未完成的一个分卷（后台执行），返回是否已提交"""
+        if not self.is_volume_job(job) or job.status != self.STATUS_FAILED:
+            return False
+        manifest = volume_exporter.load(job.file_path)
+        if index not in volume_exporter.unfinished_volumes(manifest):
+            return False
+
+        # 条件更新：并发的重试请求只有一个能把任务重新排队
+        requeued = ExportJob.query.filter_by(job_id=job.job_id, status=self.STATUS_FAILED).update({
+            'status': self.STATUS_QUEUED,
+            'error_message': None,
+            'completed_at': None,
+            'updated_at': datetime.utcnow()
+        }, synchronize_session=False)
+        db.session.commit()
+        if requeued != 1:
+            return False
+        self._get_executor().submit(self._run, current_app._get_current_object(), job.job_id, [index])
+        return True
+
+    def _run(self, app, job_id, volume_indexes=None):
+        """执行导出任务（后台线程）"""
+        with app.app_context():
+            try:
+                self.run_job(job_id, volume_indexes)
+            except Exception as e:
+                db.session.rollback()
+                current_app.logger.error(f"导出任务失败 {job_id}: {str(e)}")
+                self._update(job_id, status=self.STATUS_FAILED, error_message=str(e),
+                             completed_at=datetime.utcnow())
+            finally:
+                db.session.remove()
+
+    def run_job(self, job_id, volume_indexes=None):
+        """生成PDF（或分卷）、按需自动完成订单，并记录结果；volume_indexes 为只重新生成的分卷"""
+        from utils.pdf_generator import PDFGenerator
+
+        job = ExportJob.query.filter_by(job_id=job_id).first()
+        if job is None or job.status != self.STATUS_QUEUED:
+            return
+        order_ids = json.loads(job.order_ids)
+        file_path, pdf_format, baji_size = job.file_path, job.pdf_format, job.baji_size
+        auto_complete = job.auto_complete and job.filter_status == 'printing'
+        volume_job = self.is_volume_job(job)
+        self._update(job_id, status=self.STATUS_RUNNING, started_at=datetime.utcnow())
+        progress = lambda done, total: self._update(job_id, pages_done=done, pages_total=total)
+
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        if volume_job:
+            manifest = volume_exporter.run(file_path, progress=progress, indexes=volume_indexes)
+            failed = volume_exporter.failed_volumes(manifest)
+            if failed:
+                # 已完成的分卷保留，失败的分卷可以单独重试
+                self._update(job_id, status=self.STATUS_FAILED, completed_at=datetime.utcnow(),
+                             error_message=f"分卷 {', '.join(map(str, failed))} 生成失败，可单独重试")
+                return
+            file_size = sum(volume['file_size'] for volume in manifest['volumes'])
+        else:
+            PDFGenerator().generate_baji_pdf(order_ids, pdf_format, baji_size,
+                                             output_path=file_path, progress=progress)
+            file_size = os.path.getsize(file_path)
+
+        exported_count = len(order_ids)
+        if auto_complete:
+            exported_count = self.auto_complete_orders(order_ids)
+
+        self._update(job_id, status=self.STATUS_DONE, file_size=file_size,
+                     exported_count=exported_count, completed_at=datetime.utcnow())
+
+    @staticmethod
+    def auto_complete_orders(order_ids):
+        """打印中的打印任务标记为已完成，订单标记为已打印，返回更新的订单数"""
+        now = datetime.utcnow()
+        exported_count = 0
+        for order_id in order_ids:
+            print_jobs = PrintJob.query.filter(
+                PrintJob.order_id == order_id,
+                PrintJob.status == 'printing'
+            ).all()
+            for print_job in print_jobs:
+                print_job.status = 'completed'
+                print_job.completed_at = now
+                print_job.updated_at = now
+
+            order = Order.query.get(order_id)
+            if order:
+                order.status = 'printed'
+                order.updated_at = now
+                exported_count += 1
+        db.session.commit()
+        return exported_count
+
+    @staticmethod
+    def _update(job_id, **values):
+        """按任务ID更新字段并提交"""
+        values['updated_at'] = datetime.utcnow()
+        ExportJob.query.filter_by(job_id=job_id).update(values, synchronize_session=False)
+        db.session.commit()
+
+    def get(self, job_id):
+        """读取任务；长时间没有进度的未完成任务标记为中断"""
+        job = ExportJob.query.filter_by(job_id=job_id).first()
+        if job is None or job.status not in (self.STATUS_QUEUED, self.STATUS_RUNNING):
+            return job
+
+        stale_before = datetime.utcnow() - timedelta(seconds=self.get_setting('stale_seconds'))
+        if job.updated_at and job.updated_at < stale_before:
+            job.status = self.STATUS_FAILED
+            job.error_message = '导出任务中断，请重新导出'
+            job.completed_at = datetime.utcnow()
+            db.session.commit()
+        return job
+
+    def get_stats(self):
+        """各状态的任务数"""
+        counts = dict(db.session.query(ExportJob.status, db.func.count(ExportJob.id))
+                      .group_by(ExportJob.status).all())
+        return {status: counts.get(status, 0)
+                for status in (self.STATUS_QUEUED, self.STATUS_RUNNING, self.STATUS_DONE, self.STATUS_FAILED)}
+
+
+# 全局导出任务实例
+export_jobs = ExportJobManager()
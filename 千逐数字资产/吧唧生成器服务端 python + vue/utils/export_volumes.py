@@ -0,0 +1,217 @@
+# utils/export_volumes.py - 分卷PDF导出
+import io
+import os
+import json
+import zipfile
+import hashlib
+from datetime import datetime
+from flask import current_app, has_app_context
+from utils.models import db
+
+
+class _StreamBuffer(io.RawIOBase):
+    """只写的缓冲区：ZipFile 写入的字节由生成器取走，不在内存中保留整个ZIP"""
+
+    def __init__(self):
+        self._chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def take(self):
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+class VolumeExporter:
+    """分卷PDF导出
+
+    超大批量的订单按每卷N页拆分为多个PDF（分卷）：
+    - 每个分卷单独创建、绘制并保存画布，写完即关闭文件，内存占用只与单卷大小有关
+    - 清单（manifest.json）记录每个分卷的订单ID、页数、文件大小、sha256 和状态，每完成一卷就原子更新
+    - 失败的分卷自动重试 EXPORT_VOLUME_RETRIES 次，仍失败时只标记该卷，其它分卷照常生成，之后可以单独重试
+    - 全部分卷和清单可以打包为流式ZIP下载，边读文件边输出，不生成临时ZIP
+    """
+
+    MANIFEST_NAME = 'manifest.json'
+    STATUS_PENDING = 'pending'
+    STATUS_DONE = 'done'
+    STATUS_FAILED = 'failed'
+
+    # 分卷配置 -> (应用配置项, 默认值)
+    SETTING_CONFIG = {
+        'volume_sheets': ('EXPORT_VOLUME_SHEETS', 0),
+        'retries': ('EXPORT_VOLUME_RETRIES', 2),
+        'zip_chunk_size': ('EXPORT_ZIP_CHUNK_SIZE', 1024 * 1024)
+    }
+
+    def get_setting(self, name):
+        """读取分卷配置：有应用上下文时使用应用配置"""
+        config_key, default = self.SETTING_CONFIG[name]
+        if has_app_context():
+            return current_app.config.get(config_key, default)
+        return default
+
+    @staticmethod
+    def volume_filename(index):
+        return f"volume_{index:03d}.pdf"
+
+    def create(self, manifest_path, order_ids, pdf_format, baji_size, volume_sheets):
+        """按版面把订单拆分为每卷 volume_sheets 页的分卷，写入初始清单并返回"""
+        from utils.pdf_generator import PDFGenerator
+
+        items_per_page = PDFGenerator()._get_layout_config(pdf_format, baji_size)['items_per_page']
+        orders_per_volume = max(1, int(volume_sheets)) * items_per_page
+        order_ids = sorted(order_ids)
+
+        volumes = []
+        for start in range(0, len(order_ids), orders_per_volume):
+            volume_ids = order_ids[start:start + orders_per_volume]
+            volumes.append({
+                'index': len(volumes) + 1,
+                'filename': self.volume_filename(len(volumes) + 1),
+                'order_ids': volume_ids,
+                'pages': (len(volume_ids) + items_per_page - 1) // items_per_page,
+                'status': self.STATUS_PENDING,
+                'attempts': 0,
+                'file_size': None,
+                'sha256': None,
+                'error': None
+            })
+
+        manifest = {
+            'pdf_format': pdf_format,
+            'baji_size': baji_size,
+            'volume_sheets': int(volume_sheets),
+            'order_count': len(order_ids),
+            'pages_total': sum(volume['pages'] for volume in volumes),
+            'generator_version': PDFGenerator.VERSION,
+            'created_at': datetime.utcnow().isoformat(),
+            'volumes': volumes
+        }
+        os.makedirs(os.path.dirname(manifest_path), exist_ok=True)
+        self.save(manifest_path, manifest)
+        return manifest
+
+    @staticmethod
+    def load(manifest_path):
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    @staticmethod
+    def save(manifest_path, manifest):
+        """原子写入清单"""
+        part_path = f"{manifest_path}.part"
+        with open(part_path, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=2)
+        os.replace(part_path, manifest_path)
+
+    def run(self, manifest_path, progress=None, indexes=None):
+        """生成清单中未完成的分卷（或 indexes 指定的分卷），返回更新后的清单
+
+        progress(已完成页数, 总页数) 按已完成分卷的页数加上当前分卷的进度调用。
+        每卷完成后清空数据库会话，调用方不应再使用之前加载的对象。
+        """
+        manifest = self.load(manifest_path)
+        pages_total = manifest['pages_total']
+
+        for volume in manifest['volumes']:
+            if indexes is not None and volume['index'] not in indexes:
+                continue
+            if volume['status'] == self.STATUS_DONE:
+                continue
+
+            pages_before = sum(other['pages'] for other in manifest['volumes']
+                               if other['status'] == self.STATUS_DONE)
+            volume_progress = None
+            if progress:
+                def volume_progress(done, total, pages_before=pages_before):
+                    progress(pages_before + done, pages_total)
+
+            self._generate_volume(manifest_path, manifest, volume, volume_progress)
+            self.save(manifest_path, manifest)
+            # 释放本卷加载的订单，会话中的对象不随批量大小增长
+            db.session.expunge_all()
+
+        manifest['completed_at'] = datetime.utcnow().isoformat() if self.is_complete(manifest) else None
+        self.save(manifest_path, manifest)
+        return manifest
+
+    def _generate_volume(self, manifest_path, manifest, volume, progress):
+        """生成一个分卷，失败时重试；结果记录在 volume 中"""
+        from utils.pdf_generator import PDFGenerator
+
+        output_path = os.path.join(os.path.dirname(manifest_path), volume['filename'])
+        part_path = f"{output_path}.part"
+        for _ in range(1 + max(0, self.get_setting('retries'))):
+            volume['attempts'] += 1
+            try:
+                PDFGenerator().generate_baji_pdf(volume['order_ids'], manifest['pdf_format'], manifest['baji_size'],
+                                                 output_path=part_path, progress=progress)
+                os.replace(part_path, output_path)
+            except Exception as e:
+                if os.path.exists(part_path):
+                    os.remove(part_path)
+                volume.update(status=self.STATUS_FAILED, error=str(e))
+                if has_app_context():
+                    current_app.logger.warning(f"分卷生成失败 {volume['filename']} (第{volume['attempts']}次): {str(e)}")
+                continue
+
+            volume.update(status=self.STATUS_DONE, error=None, file_size=os.path.getsize(output_path),
+                          sha256=self._file_hash(output_path))
+            return
+
+    def _file_hash(self, path):
+        sha256 = hashlib.sha256()
+        chunk_size = self.get_setting('zip_chunk_size')
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(chunk_size), b''):
+                sha256.update(chunk)
+        return sha256.hexdigest()
+
+    def is_complete(self, manifest):
+        return all(volume['status'] == self.STATUS_DONE for volume in manifest['volumes'])
+
+    def failed_volumes(self, manifest):
+        return [volume['index'] for volume in manifest['volumes'] if volume['status'] == self.STATUS_FAILED]
+
+    def unfinished_volumes(self, manifest):
+        """失败或尚未生成（任务中断）的分卷"""
+        return [volume['index'] for volume in manifest['volumes'] if volume['status'] != self.STATUS_DONE]
+
+    def volume_path(self, manifest_path, manifest, index):
+        """已完成分卷的文件路径，不存在或未完成时返回 None"""
+        for volume in manifest['volumes']:
+            if volume['index'] == index and volume['status'] == self.STATUS_DONE:
+                path = os.path.join(os.path.dirname(manifest_path), volume['filename'])
+                return path if os.path.exists(path) else None
+        return None
+
+    def stream_zip(self, manifest_path):
+        """流式输出包含清单和全部已完成分卷的ZIP（PDF已压缩，按存储方式打包）"""
+        manifest = self.load(manifest_path)
+        chunk_size = self.get_setting('zip_chunk_size')
+        buffer = _StreamBuffer()
+
+        with zipfile.ZipFile(buffer, 'w', compression=zipfile.ZIP_STORED, allowZip64=True) as archive:
+            archive.writestr(self.MANIFEST_NAME, json.dumps(manifest, ensure_ascii=False, indent=2))
+            yield buffer.take()
+            for volume in manifest['volumes']:
+                path = self.volume_path(manifest_path, manifest, volume['index'])
+                if path is None:
+                    continue
+                with open(path, 'rb') as source, archive.open(volume['filename'], 'w', force_zip64=True) as target:
+                    for chunk in iter(lambda: source.read(chunk_size), b''):
+                        target.write(chunk)
+                        yield buffer.take()
+                yield buffer.take()
+        yield buffer.take()
+
+
+# 全局分卷导出实例
+volume_exporter = VolumeExporter()
@@ -12,7 +12,10 @@ class FileManager:
     def __init__(self, base_path='static'):
         self.base_path = Path(base_path)
         self.upload_path = self.base_path / 'uploads'
+        self.derivative_path = self.upload_path / 'derivatives'
         self.export_path = self.base_path / 'exports'
+        self.render_cache_path = self.base_path / 'cache' / 'render'
+        self.export_cache_path = self.base_path / 'cache' / 'exports'
         self.log_path = self.base_path / 'logs'
         
         # 确保目录存在
@@ -22,6 +25,9 @@ class FileManager:
         """确保所有必要的目录存在"""
         directories = [
             self.upload_path,
+            self.derivative_path,
+            self.render_cache_path,
+            self.export_cache_path,
             self.export_path / 'pdf',
             self.export_path / 'images',
             self.export_path / 'temp',
@@ -73,6 +79,17 @@ class FileManager:
         except ValueError:
             return str(month_dir).replace('\\', '/')
     
+    def get_derivative_dir(self, source_path, create=True):
+        """获取上传图片衍生文件（多分辨率金字塔等）的目录
+        
+        以源文件名（不含扩展名）作为子目录名，上传文件名本身已唯一。
+        """
+        stem = os.path.splitext(os.path.basename(str(source_path)))[0]
+        derivative_dir = self.derivative_path / stem
+        if create:
+            derivative_dir.mkdir(parents=True, exist_ok=True)
+        return derivative_dir
+    
     def get_export_path(self, file_type='pdf', filename=None):
         """获取导出文件路径"""
         now = datetime.now()
@@ -170,11 +187,14 @@ class FileManager:
         
         return file_record
     
+    # 计算哈希时每次读取的字节数
+    HASH_CHUNK_SIZE = 1024 * 1024
+    
     def _calculate_hash(self, file_path):
         """计算文件MD5哈希"""
         hash_md5 = hashlib.md5()
         with open(file_path, "rb") as f:
-            for chunk in iter(lambda: f.read(4096), b""):
+            for chunk in iter(lambda: f.read(self.HASH_CHUNK_SIZE), b""):
                 hash_md5.update(chunk)
         return hash_md5.hexdigest()
     
@@ -0,0 +1,162 @@
+# utils/image_pyramid.py - 上传图片多分辨率金字塔
+import os
+import json
+import math
+import shutil
+from PIL import Image
+from flask import current_app, has_app_context
+from utils.file_manager import file_manager
+
+
+class ImagePyramid:
+    """上传图片多分辨率金字塔
+
+    上传时按长边 2048 / 1024 / 512 生成缩小版本，存放在 file_manager 管理的
+    衍生文件目录中，并写入 pyramid.json 清单。预览渲染时根据需要的分辨率选择
+    最小的可用层级，交互式预览不必每次都解码原图。层级按有损JPEG保存，
+    打印母版（final 档位）不使用金字塔。
+    """
+
+    DEFAULT_LEVELS = (2048, 1024, 512)
+    MANIFEST_NAME = 'pyramid.json'
+    JPEG_QUALITY = 92
+    # 可以直接 reduce() 的模式，其它模式（如调色板）需要先转换为RGBA
+    REDUCE_MODES = ('L', 'RGB', 'RGBA')
+
+    # 金字塔配置 -> (应用配置项, 默认值)；解码内存预算与渲染共用
+    SETTING_CONFIG = {
+        'memory_budget': ('RENDER_MEMORY_BUDGET', 384 * 1024 * 1024)
+    }
+
+    def __init__(self, levels=None):
+        self.levels = tuple(sorted(levels or self.DEFAULT_LEVELS, reverse=True))
+
+    def get_setting(self, name):
+        """读取金字塔配置：有应用上下文时使用应用配置"""
+        config_key, default = self.SETTING_CONFIG[name]
+        if has_app_context():
+            return current_app.config.get(config_key, default)
+        return default
+
+    @classmethod
+    def _estimate_build(cls, source, factor):
+        """估算生成金字塔的解码峰值内存：解码 + 模式转换 + reduce() 结果"""
+        width, height = source.size
+        pixel_bytes = 1 if source.mode in ('1', 'L', 'P') else 4
+        peak = width * height * pixel_bytes
+        if source.mode not in cls.REDUCE_MODES:
+            peak += width * height * 4
+        if factor > 1:
+            peak += math.ceil(width / factor) * math.ceil(height / factor) * 4
+        return peak
+
+    def build(self, source_path, levels=None):
+        """为上传图片生成金字塔，返回层级清单
+
+        只生成比原图小的层级，每一层都由上一层缩小得到（原图只解码一次）。
+        解码时先用 draft()（JPEG）/ reduce() 缩小到不小于最大层级，峰值内存超过
+        RENDER_MEMORY_BUDGET 时不生成金字塔（渲染时回退到原图，由渲染的解码规划控制内存）。
+        """
+        levels = tuple(sorted(levels or self.levels, reverse=True))
+        stat = os.stat(source_path)
+
+        with Image.open(source_path) as source:
+            source_size = source.size
+            long_edge = max(source_size)
+            target_levels = [level for level in levels if level < long_edge]
+            if not target_levels:
+                return None
+
+            # JPEG 可以直接按最大层级做DCT缩小解码
+            if source.format == 'JPEG':
+                ratio = target_levels[0] / long_edge
+                source.draft(source.mode, (int(source_size[0] * ratio), int(source_size[1] * ratio)))
+
+            # 其余的整数倍缩小由 reduce() 完成，缩小后仍不小于最大层级
+            factor = max(1, int(max(source.size) / target_levels[0]))
+            peak = self._estimate_build(source, factor)
+            if peak > self.get_setting('memory_budget'):
+                if has_app_context():
+                    current_app.logger.warning(
+                        f"生成金字塔 {source_path} 需要约 {peak // (1024 * 1024)}MB，超出解码内存预算，跳过")
+                return None
+
+            current = source if source.mode in self.REDUCE_MODES else source.convert('RGBA')
+            if factor > 1:
+                current = current.reduce(factor)
+            has_alpha = current.mode == 'RGBA'
+
+            derivative_dir = file_manager.get_derivative_dir(source_path)
+            entries = []
+            for level in target_levels:
+                ratio = level / long_edge
+                size = (max(1, round(source_size[0] * ratio)), max(1, round(source_size[1] * ratio)))
+                current = current.resize(size, Image.Resampling.LANCZOS)
+
+                if has_alpha:
+                    level_path = derivative_dir / f"{level}.png"
+                    current.save(level_path, 'PNG', compress_level=1)
+                else:
+                    level_path = derivative_dir / f"{level}.jpg"
+                    current.save(level_path, 'JPEG', quality=self.JPEG_QUALITY)
+
+                entries.append({
+                    'long_edge': level,
+                    'width': size[0],
+                    'height': size[1],
+                    'path': str(level_path).replace('\\', '/')
+                })
+
+        manifest = {
+            'source_size': list(source_size),
+            'source_bytes': stat.st_size,
+            'source_mtime': stat.st_mtime,
+            'levels': entries
+        }
+        with open(derivative_dir / self.MANIFEST_NAME, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f)
+
+        return manifest
+
+    def load(self, source_path):
+        """读取金字塔清单；不存在或与原图不一致（文件被替换）时返回 None"""
+        manifest_path = file_manager.get_derivative_dir(source_path, create=False) / self.MANIFEST_NAME
+        if not manifest_path.exists():
+            return None
+
+        try:
+            with open(manifest_path, 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+            stat = os.stat(source_path)
+        except (OSError, ValueError):
+            return None
+
+        if manifest.get('source_bytes') != stat.st_size or manifest.get('source_mtime') != stat.st_mtime:
+            return None
+        return manifest
+
+    def remove(self, source_path):
+        """删除上传图片的全部金字塔层级"""
+        derivative_dir = file_manager.get_derivative_dir(source_path, create=False)
+        shutil.rmtree(derivative_dir, ignore_errors=True)
+
+    def select_level(self, manifest, max_reduction):
+        """选择仍能保证输出分辨率的最小层级
+
+        max_reduction 为相对原图允许的最大缩小倍数；没有合适层级时返回 None（使用原图）。
+        """
+        if not manifest:
+            return None
+
+        source_long_edge = max(manifest['source_size'])
+        candidates = [
+            level for level in manifest['levels']
+            if source_long_edge / level['long_edge'] <= max_reduction and os.path.exists(level['path'])
+        ]
+        if not candidates:
+            return None
+        return min(candidates, key=lambda level: level['long_edge'])
+
+
+# 全局金字塔实例
+image_pyramid = ImagePyramid()
@@ -0,0 +1,198 @@
+# utils/live_preview.py - 实时预览通道
+import json
+import time
+import base64
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from flask import current_app, has_app_context
+
+
+class LivePreviewBusy(Exception):
+    """实时预览会话数已满"""
+
+
+class PreviewSession:
+    """一个编辑会话（设备 + 上传图片）的实时预览状态"""
+
+    def __init__(self, session_id):
+        self.session_id = session_id
+        self.condition = threading.Condition()
+        self.pending = None          # 最新的待渲染参数（新参数直接覆盖旧参数）
+        self.version = 0             # 最新参数的版本号
+        self.rendering = False       # 是否有渲染循环在执行
+        self.frame = None            # 最近完成的预览帧
+        self.last_active = time.time()
+        self.closed = False
+        self.stats = {'submitted': 0, 'rendered': 0, 'superseded': 0, 'failed': 0}
+
+
+class LivePreviewManager:
+    """实时预览通道
+
+    客户端用 POST 提交最新的编辑参数，用 SSE 接收渲染完成的低分辨率预览帧：
+    - 每个会话（设备 + 上传图片）只保留最新一组待渲染参数，渲染开始前被新参数覆盖的参数直接丢弃
+    - 每个会话同时最多一个渲染在执行，渲染循环在有界线程池中运行，实际渲染提交到渲染进程池
+    - 预览帧是缩略图尺寸的有损编码（thumbnail 编码配置），以 data URL 随事件推送
+    因此无论客户端提交多快，每个会话占用的渲染资源都有上限。
+    """
+
+    # 通道配置 -> (应用配置项, 默认值)
+    SETTING_CONFIG = {
+        'workers': ('PREVIEW_LIVE_WORKERS', 4),
+        'max_sessions': ('PREVIEW_LIVE_MAX_SESSIONS', 200),
+        'idle_timeout': ('PREVIEW_LIVE_IDLE_TIMEOUT', 120),
+        'heartbeat': ('PREVIEW_LIVE_HEARTBEAT', 15)
+    }
+
+    # 预览帧使用的衍生图和编码配置
+    FRAME_ARTIFACT = 'thumbnail'
+    FRAME_PROFILE = 'thumbnail'
+
+    def __init__(self):
+        self._sessions = {}
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def get_setting(self, name):
+        """读取通道配置：有应用上下文时使用应用配置"""
+        config_key, default = self.SETTING_CONFIG[name]
+        if has_app_context():
+            return current_app.config.get(config_key, default)
+        return default
+
+    @staticmethod
+    def session_id(device_id, image_path):
+        """会话ID：由设备ID和上传图片路径派生"""
+        return hashlib.sha256(f"{device_id}:{image_path}".encode('utf-8')).hexdigest()[:32]
+
+    def get_session(self, session_id):
+        with self._lock:
+            self._expire_idle()
+            return self._sessions.get(session_id)
+
+    def submit(self, device_id, image_path, preview_params):
+        """提交一组编辑参数，返回 (会话ID, 版本号)；渲染在后台进行"""
+        session_id = self.session_id(device_id, image_path)
+        with self._lock:
+            self._expire_idle()
+            session = self._sessions.get(session_id)
+            if session is None:
+                if len(self._sessions) >= self.get_setting('max_sessions'):
+                    raise LivePreviewBusy('实时预览繁忙，请稍后重试')
+                session = self._sessions[session_id] = PreviewSession(session_id)
+
+        with session.condition:
+            if session.pending is not None:
+                # 尚未开始渲染的旧参数被覆盖
+                session.stats['superseded'] += 1
+            session.pending = preview_params
+            session.version += 1
+            session.last_active = time.time()
+            session.stats['submitted'] += 1
+            version = session.version
+            start_loop = not session.rendering
+            session.rendering = True
+
+        if start_loop:
+            self._get_executor().submit(self._render_loop, current_app._get_current_object(), session)
+        return session_id, version
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.get_setting('workers'),
+                                                    thread_name_prefix='live-preview')
+            return self._executor
+
+    def _render_loop(self, app, session):
+        """会话的渲染循环：每次取最新参数渲染，直到没有待渲染参数"""
+        with app.app_context():
+            while True:
+                with session.condition:
+                    params, version = session.pending, session.version
+                    session.pending = None
+                    if params is None or session.closed:
+                        session.rendering = False
+                        return
+
+                try:
+                    frame = self.render_frame(params)
+                    frame.update(event='frame', version=version)
+                except Exception as e:
+                    current_app.logger.error(f"实时预览渲染失败 {session.session_id}: {str(e)}")
+                    frame = {'event': 'error', 'version': version, 'error': str(e)}
+
+                with session.condition:
+                    # 计数只在持有 condition 时修改，与 submit() / get_stats() 互斥
+                    session.stats['rendered' if frame['event'] == 'frame' else 'failed'] += 1
+                    session.frame = frame
+                    session.last_active = time.time()
+                    session.condition.notify_all()
+
+    def render_frame(self, preview_params):
+        """渲染一帧：命中渲染缓存时直接复用，返回事件数据"""
+        from utils.baji_processor import BajiProcessor
+        from utils.encoder_profiles import encoder_profiles
+        from utils.render_cache import render_cache
+        from utils.render_executor import render_executor
+
+        processor = BajiProcessor(preview_params)
+        artifacts, _, cache_hit = render_cache.get_or_render(processor, render=render_executor.render)
+        format, image_bytes = BajiProcessor.encode_artifact(artifacts, self.FRAME_ARTIFACT, self.FRAME_PROFILE)
+        encoded = base64.b64encode(image_bytes).decode('ascii')
+        return {
+            'image': f"data:{encoder_profiles.mimetype(format)};base64,{encoded}",
+            'cache_hit': cache_hit
+        }
+
+    def stream(self, session, last_version=0):
+        """SSE 事件流：推送比 last_version 新的预览帧，空闲时发送心跳，会话过期后结束"""
+        heartbeat = self.get_setting('heartbeat')
+        idle_timeout = self.get_setting('idle_timeout')
+        while True:
+            with session.condition:
+                if session.frame is None or session.frame['version'] <= last_version:
+                    session.condition.wait(heartbeat)
+                frame = session.frame
+                closed = session.closed or time.time() - session.last_active > idle_timeout
+
+            if frame is not None and frame['version'] > last_version:
+                last_version = frame['version']
+                data = {key: value for key, value in frame.items() if key != 'event'}
+                yield f"id: {last_version}\nevent: {frame['event']}\ndata: {json.dumps(data)}\n\n"
+            elif closed:
+                yield "event: end\ndata: {}\n\n"
+                return
+            else:
+                yield ": keepalive\n\n"
+
+    def _expire_idle(self):
+        """关闭空闲超时的会话（调用方持有锁）"""
+        now = time.time()
+        idle_timeout = self.get_setting('idle_timeout')
+        for session_id, session in list(self._sessions.items()):
+            if now - session.last_active > idle_timeout and not session.rendering:
+                with session.condition:
+                    session.closed = True
+                    session.condition.notify_all()
+                del self._sessions[session_id]
+
+    def get_stats(self):
+        """会话数和各会话计数之和"""
+        with self._lock:
+            sessions = list(self._sessions.values())
+        totals = {'submitted': 0, 'rendered': 0, 'superseded': 0, 'failed': 0}
+        rendering = 0
+        for session in sessions:
+            with session.condition:
+                for key in totals:
+                    totals[key] += session.stats[key]
+                rendering += session.rendering
+        totals['sessions'] = len(sessions)
+        totals['rendering'] = rendering
+        return totals
+
+
+# 全局实时预览通道实例
+live_preview = LivePreviewManager()
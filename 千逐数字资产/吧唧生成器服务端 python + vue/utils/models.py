@@ -1,6 +1,7 @@
 # models.py - 数据库模型定义
 from flask_sqlalchemy import SQLAlchemy
 from datetime import datetime
+import os
 import json
 
 db = SQLAlchemy()
@@ -519,3 +520,122 @@ class FileManagement(db.Model):
             'updated_at': self.updated_at.isoformat()
         }
 
+class UploadObject(db.Model):
+    """上传内容对象模型（按内容哈希去重，引用计数）"""
+    __tablename__ = 'upload_objects'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    content_hash = db.Column(db.String(64), unique=True, nullable=False, index=True)  # sha256
+    file_path = db.Column(db.String(500), nullable=False, index=True)
+    file_size = db.Column(db.Integer, nullable=False)
+    width = db.Column(db.Integer)
+    height = db.Column(db.Integer)
+    format = db.Column(db.String(10))
+    ref_count = db.Column(db.Integer, default=0)
+    last_referenced_at = db.Column(db.DateTime, default=datetime.utcnow)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'content_hash': self.content_hash,
+            'file_path': self.file_path,
+            'file_size': self.file_size,
+            'width': self.width,
+            'height': self.height,
+            'format': self.format,
+            'ref_count': self.ref_count,
+            'last_referenced_at': self.last_referenced_at.isoformat() if self.last_referenced_at else None,
+            'created_at': self.created_at.isoformat(),
+            'updated_at': self.updated_at.isoformat()
+        }
+
+class RenderJob(db.Model):
+    """渲染任务模型（持久化渲染队列）"""
+    __tablename__ = 'render_jobs'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    order_id = db.Column(db.Integer, db.ForeignKey('orders.id'), nullable=False)
+    order_no = db.Column(db.String(32), nullable=False)
+    params = db.Column(db.Text, nullable=False)  # JSON格式存储渲染参数
+    output_path = db.Column(db.String(255), nullable=False)
+    status = db.Column(db.String(20), default='queued', index=True)  # queued, running, done, failed
+    attempts = db.Column(db.Integer, default=0)
+    max_attempts = db.Column(db.Integer, default=3)
+    available_at = db.Column(db.DateTime, default=datetime.utcnow)  # 重试退避：此时间之后才能被领取
+    lease_owner = db.Column(db.String(100))
+    lease_expires_at = db.Column(db.DateTime)
+    error_message = db.Column(db.Text)
+    started_at = db.Column(db.DateTime)
+    completed_at = db.Column(db.DateTime)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    # 关系（渲染任务随订单删除）
+    order = db.relationship('Order', foreign_keys=[order_id],
+                            backref=db.backref('render_jobs', cascade='all, delete-orphan'))
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'order_id': self.order_id,
+            'order_no': self.order_no,
+            'output_path': self.output_path,
+            'status': self.status,
+            'attempts': self.attempts,
+            'max_attempts': self.max_attempts,
+            'available_at': self.available_at.isoformat() if self.available_at else None,
+            'lease_owner': self.lease_owner,
+            'lease_expires_at': self.lease_expires_at.isoformat() if self.lease_expires_at else None,
+            'error_message': self.error_message,
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'completed_at': self.completed_at.isoformat() if self.completed_at else None,
+            'created_at': self.created_at.isoformat(),
+            'updated_at': self.updated_at.isoformat()
+        }
+
+
+class ExportJob(db.Model):
+    """PDF导出任务模型（后台生成，记录页数进度）"""
+    __tablename__ = 'export_jobs'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    job_id = db.Column(db.String(32), unique=True, nullable=False, index=True)
+    status = db.Column(db.String(20), default='queued', index=True)  # queued, running, done, failed
+    order_ids = db.Column(db.Text, nullable=False)  # JSON格式存储订单ID列表
+    pdf_format = db.Column(db.String(20), default='a4_6')
+    baji_size = db.Column(db.String(20), default='68x68')
+    filter_status = db.Column(db.String(20))
+    auto_complete = db.Column(db.Boolean, default=False)
+    pages_done = db.Column(db.Integer, default=0)
+    pages_total = db.Column(db.Integer, default=0)
+    file_path = db.Column(db.String(500))
+    file_size = db.Column(db.Integer)
+    exported_count = db.Column(db.Integer, default=0)
+    error_message = db.Column(db.Text)
+    started_at = db.Column(db.DateTime)
+    completed_at = db.Column(db.DateTime)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    def to_dict(self):
+        return {
+            'job_id': self.job_id,
+            'status': self.status,
+            'order_count': len(json.loads(self.order_ids)),
+            'pdf_format': self.pdf_format,
+            'baji_size': self.baji_size,
+            'filter_status': self.filter_status,
+            'auto_complete': self.auto_complete,
+            'pages_done': self.pages_done,
+            'pages_total': self.pages_total,
+            'filename': os.path.basename(self.file_path) if self.file_path else None,
+            'file_size': self.file_size,
+            'exported_count': self.exported_count,
+            'error_message': self.error_message,
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'completed_at': self.completed_at.isoformat() if self.completed_at else None,
+            'created_at': self.created_at.isoformat(),
+            'updated_at': self.updated_at.isoformat()
+        }
@@ -7,20 +7,31 @@ from datetime import datetime
 # utils/order_service.py - 订单服务
 from flask import request
 from utils.models import Order, Case, db
+from utils.upload_store import upload_store
 import json
 from datetime import datetime
 
-def create_order_record(params, output_path, device_id=None):
-    """创建订单记录"""
+def create_order_record(params, output_path, device_id=None, order_no=None, preview_path=None, status='processing',
+                        print_master=None):
+    """创建订单记录（渲染排队中的订单 status 为 rendering，图片路径和打印母版元数据由渲染任务完成后回填）"""
     from flask import current_app, request
     
-    order_no = Order.generate_order_no()
+    order_no = order_no or Order.generate_order_no()
     
     # 计算价格
     quantity = params.get('quantity', 1)
     unit_price = current_app.config['DEFAULT_PRICE']
     total_price = unit_price * quantity
     
+    notes = {
+        'image': params['image'],
+        'edit_params': params['edit_params'],
+        'baji_specs': params['baji_specs'],
+        'user_preferences': params['user_preferences']
+    }
+    if print_master:
+        notes['print_master'] = print_master
+    
     # 创建数据库订单记录
     order = Order(
         order_no=order_no,
@@ -29,19 +40,16 @@ def create_order_record(params, output_path, device_id=None):
         user_agent=request.headers.get('User-Agent'),
         original_image_path=params['image']['original_path'],
         processed_image_path=output_path,
-        preview_image_path=params['image'].get('preview_path', ''),
+        preview_image_path=preview_path or params['image'].get('preview_path', ''),
         quantity=quantity,
         unit_price=unit_price,
         total_price=total_price,
-        status='processing',
-        notes=json.dumps({
-            'image': params['image'],
-            'edit_params': params['edit_params'],
-            'baji_specs': params['baji_specs'],
-            'user_preferences': params['user_preferences']
-        })
+        status=status,
+        notes=json.dumps(notes)
     )
     
+    # 订单指向去重存储中的原图时增加引用，删除订单时释放
+    upload_store.acquire(order.original_image_path)
     db.session.add(order)
     db.session.commit()
     
@@ -55,6 +63,47 @@ def create_order_record(params, output_path, device_id=None):
     
     return order.to_dict()
 
+def record_print_master(order, print_master):
+    """在订单备注中记录打印母版元数据（路径、像素尺寸、DPI、颜色模式），不提交事务"""
+    notes = json.loads(order.notes) if order.notes else {}
+    notes['print_master'] = print_master
+    order.notes = json.dumps(notes)
+    order.processed_image_path = print_master['path']
+
+def get_print_master(order):
+    """订单的打印母版元数据
+    
+    每个订单的打印母版只生成一次，PDF导出、下载和打印任务都直接使用它，不再从其它文件重新缩放。
+    没有记录元数据的旧订单以 processed_image_path 为母版，DPI 和颜色模式从文件头读取。
+    没有母版时返回 None。
+    """
+    notes = {}
+    if order.notes:
+        try:
+            notes = json.loads(order.notes)
+        except ValueError:
+            notes = {}
+    if notes.get('print_master'):
+        return notes['print_master']
+    
+    if not order.processed_image_path:
+        return None
+    print_master = {'path': order.processed_image_path}
+    try:
+        from PIL import Image
+        with Image.open(order.processed_image_path) as header:
+            print_master.update({
+                'format': header.format,
+                'width': header.width,
+                'height': header.height,
+                # PNG 的 pHYs 以像素/米存储，读回的DPI有微小误差
+                'dpi': round(header.info['dpi'][0]) if header.info.get('dpi') else None,
+                'color_mode': header.mode
+            })
+    except OSError:
+        pass
+    return print_master
+
 def create_case_from_order(order_id):
     """从订单创建案例"""
     order = Order.query.get(order_id)
@@ -68,6 +117,7 @@ def create_case_from_order(order_id):
     
     # 创建案例
     case = Case.create_from_order(order)
+    upload_store.acquire(case.original_image_path)
     db.session.add(case)
     db.session.commit()
     
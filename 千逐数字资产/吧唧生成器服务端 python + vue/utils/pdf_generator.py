@@ -4,13 +4,148 @@ from reportlab.lib.units import mm
 from reportlab.pdfgen import canvas
 from reportlab.lib.utils import ImageReader
 from PIL import Image
+import io
 import os
+import hashlib
+from collections import deque, namedtuple
+from concurrent.futures import Future, ThreadPoolExecutor
+from flask import current_app, has_app_context
 from datetime import datetime
 
+
+# 准备阶段的结果：源文件路径、目标像素尺寸（None 为保持原尺寸）、内容键、可直接嵌入的JPEG字节
+PreparedImage = namedtuple('PreparedImage', ['path', 'size', 'key', 'data'])
+
+
+class PDFImageRegistry:
+    """一个PDF文档内的图片注册表
+
+    图片完全在内存中准备（按目标尺寸重采样，透明区域按白底合成为RGB，编码为JPEG字节后原样以 DCT 流嵌入），
+    按内容哈希注册为一个命名的表单 XObject，每个不同的图片只嵌入一次；
+    同一图片的后续放置（同一订单重印、多个订单使用同一设计）只引用该对象，
+    PDF大小和导出时间随不同图片数增长，而不是随放置次数增长。
+
+    准备（解码、重采样、编码）与画布无关，可以通过 submit() 提交到线程池并行执行；
+    注册和放置操作画布，只在绘制线程中按顺序调用。
+    """
+
+    JPEG_QUALITY = 95
+
+    def __init__(self, canvas):
+        self.canvas = canvas
+        self._forms = {}     # 内容键 -> 表单名
+        self._prepared = {}  # (路径, 目标尺寸) -> 已注册的内容键
+        self._pending = {}   # (路径, 目标尺寸) -> 准备中的 Future
+        self.stats = {'placements': 0, 'embedded': 0}
+
+    @classmethod
+    def prepare(cls, path, size=None):
+        """读取图片文件并准备为可直接嵌入PDF的JPEG字节，返回 PreparedImage（不访问画布，可在工作线程中执行）"""
+        with open(path, 'rb') as f:
+            data = f.read()
+        key = hashlib.sha256(data).hexdigest()
+        if size:
+            key = f"{key}:{size[0]}x{size[1]}"
+
+        with Image.open(io.BytesIO(data)) as pil_image:
+            # 转换为RGB模式（PDF需要），透明区域按白底合成
+            if pil_image.mode in ('RGBA', 'LA', 'P'):
+                rgba = pil_image.convert('RGBA')
+                rgb_image = Image.new('RGB', rgba.size, (255, 255, 255))
+                rgb_image.paste(rgba, mask=rgba.getchannel('A'))
+            elif pil_image.mode != 'RGB':
+                rgb_image = pil_image.convert('RGB')
+            else:
+                rgb_image = pil_image
+            # 重采样到打印尺寸（母版尺寸已经一致时不处理）
+            if size and rgb_image.size != tuple(size):
+                rgb_image = rgb_image.resize(tuple(size), Image.Resampling.LANCZOS)
+            buffer = io.BytesIO()
+            rgb_image.save(buffer, 'JPEG', quality=cls.JPEG_QUALITY)
+        return PreparedImage(path, size, key, buffer.getvalue())
+
+    def submit(self, executor, path, size=None):
+        """提交准备任务，返回 Future；同一文件和尺寸已注册或正在准备时不重复准备"""
+        spec = (path, size)
+        if spec in self._prepared:
+            future = Future()
+            future.set_result(PreparedImage(path, size, self._prepared[spec], None))
+            return future
+        future = self._pending.get(spec)
+        if future is None:
+            future = self._pending[spec] = executor.submit(self.prepare, path, size)
+        return future
+
+    def register(self, prepared):
+        """把准备好的图片注册为表单 XObject（单位正方形内的图片），返回表单名；已注册时直接返回"""
+        form_name = self._forms.get(prepared.key)
+        if form_name is None:
+            form_name = f"baji_{prepared.key[:16]}"
+            self.canvas.beginForm(form_name, 0, 0, 1, 1)
+            self.canvas.drawImage(ImageReader(io.BytesIO(prepared.data)), 0, 0, width=1, height=1)
+            self.canvas.endForm()
+            self._forms[prepared.key] = form_name
+            self.stats['embedded'] += 1
+        # 注册后释放准备结果，后续相同的提交直接引用内容键
+        spec = (prepared.path, prepared.size)
+        self._prepared[spec] = prepared.key
+        self._pending.pop(spec, None)
+        return form_name
+
+    def place_prepared(self, prepared, x, y, width, height):
+        """放置准备好的图片：首次出现时注册"""
+        self.register(prepared)
+        self.place(prepared.key, x, y, width, height)
+
+    def place_file(self, path, x, y, width, height, size=None):
+        """在当前线程中准备并放置图片文件"""
+        spec = (path, size)
+        if spec in self._prepared:
+            self.place(self._prepared[spec], x, y, width, height)
+        else:
+            self.place_prepared(self.prepare(path, size), x, y, width, height)
+
+    def place(self, key, x, y, width, height):
+        """引用已注册的图片，缩放到指定区域"""
+        self.canvas.saveState()
+        self.canvas.translate(x, y)
+        self.canvas.scale(width, height)
+        self.canvas.doForm(self._forms[key])
+        self.canvas.restoreState()
+        self.stats['placements'] += 1
+
+
 class PDFGenerator:
+    # 生成器版本：版面或图片编码变化时递增，使导出缓存中旧版本生成的文件失效
+    VERSION = 2
+    
+    # 导出配置 -> (应用配置项, 默认值)
+    SETTING_CONFIG = {
+        # 图片准备线程数（Pillow 解码、重采样、编码时释放GIL）
+        'prepare_workers': ('PDF_PREPARE_WORKERS', os.cpu_count() or 2),
+        # 已提交准备但尚未绘制的订单数上限，限制同时驻留内存的图片
+        'prepare_max_inflight': ('PDF_PREPARE_MAX_INFLIGHT', 32)
+    }
+
     def __init__(self):
         self.page_size = A4
         self.margin = 20 * mm
+    
+    def get_setting(self, name):
+        """读取导出配置：有应用上下文时使用应用配置"""
+        config_key, default = self.SETTING_CONFIG[name]
+        if has_app_context():
+            return current_app.config.get(config_key, default)
+        return default
+    
+    @staticmethod
+    def image_size(print_master, baji_size):
+        """按母版DPI计算吧唧物理尺寸对应的像素尺寸；母版没有DPI时返回 None（保持原尺寸）"""
+        dpi = print_master.get('dpi')
+        if not dpi:
+            return None
+        # PDF单位为点（1/72英寸）
+        return (max(1, round(baji_size[0] / 72 * dpi)), max(1, round(baji_size[1] / 72 * dpi)))
         
     def _get_layout_config(self, format_type, baji_size):
         """获取布局配置"""
@@ -53,8 +188,12 @@ class PDFGenerator:
             'v_spacing': v_spacing
         }
         
-    def generate_baji_pdf(self, order_ids, format_type='a4_6', baji_size='68x68'):
-        """生成吧唧PDF"""
+    def generate_baji_pdf(self, order_ids, format_type='a4_6', baji_size='68x68', output_path=None, progress=None):
+        """生成吧唧PDF
+        
+        output_path 为输出文件路径（默认按时间生成在 static/exports 下）；
+        progress(已完成页数, 总页数) 在每页绘制完成和保存后调用，用于后台导出任务记录进度。
+        """
         try:
             from utils.models import Order
             
@@ -78,77 +217,94 @@ class PDFGenerator:
             
             # 生成PDF文件路径
             pdf_filename = f"baji_export_{datetime.now().strftime('%Y%m%d_%H%M%S')}.pdf"
-            pdf_path = os.path.join(export_dir, pdf_filename)
+            pdf_path = output_path or os.path.join(export_dir, pdf_filename)
             
             # 获取布局配置
             layout = self._get_layout_config(format_type, baji_size)
+            items_per_page = layout['items_per_page']
+            pages_total = (len(orders) + items_per_page - 1) // items_per_page
+            
+            def draw(index, order, prepared):
+                self._draw_slot(c, layout, images, index, order, prepared)
+                if progress and (index + 1) % items_per_page == 0 and index + 1 < len(orders):
+                    progress((index + 1) // items_per_page, pages_total)
             
             # 创建PDF
             c = canvas.Canvas(pdf_path, pagesize=self.page_size)
-            
-            current_page = 0
-            current_item = 0
-            
-            for order in orders:
-                # 检查是否需要新页面
-                if current_item % layout['items_per_page'] == 0:
-                    if current_page > 0:
-                        c.showPage()
-                    current_page += 1
-                
-                # 计算位置
-                item_in_page = current_item % layout['items_per_page']
-                row = item_in_page // layout['items_per_col']  # 除以列数得到行
-                col = item_in_page % layout['items_per_col']   # 模列数得到列
-                
-                # 计算坐标
-                x = self.margin + col * (layout['baji_size'][0] + layout['h_spacing'])
-                y = self.page_size[1] - self.margin - (row + 1) * (layout['baji_size'][1] + layout['v_spacing'])
-                
-                # 绘制吧唧
-                self.draw_baji(c, order, x, y, layout['baji_size'])
-                
-                current_item += 1
+            images = PDFImageRegistry(c)
+            
+            if progress:
+                progress(0, pages_total)
+            
+            # 准备阶段在线程池中解码、重采样和编码图片；绘制阶段按订单顺序放置。
+            # 已提交但尚未绘制的订单数有上限，超过时先绘制最早的订单。
+            max_inflight = max(1, self.get_setting('prepare_max_inflight'))
+            with ThreadPoolExecutor(max_workers=max(1, self.get_setting('prepare_workers')),
+                                    thread_name_prefix='pdf-prepare') as executor:
+                pending = deque()
+                for index, order in enumerate(orders):
+                    pending.append((index, order, self.submit_image(images, executor, order, layout['baji_size'])))
+                    if len(pending) >= max_inflight:
+                        draw(*pending.popleft())
+                while pending:
+                    draw(*pending.popleft())
             
             c.save()
+            if progress:
+                progress(pages_total, pages_total)
             return pdf_path
             
         except Exception as e:
             raise Exception(f"生成PDF失败: {str(e)}")
     
-    def draw_baji(self, canvas, order, x, y, baji_size):
-        """绘制单个吧唧"""
+    def submit_image(self, images, executor, order, baji_size):
+        """提交订单打印母版的准备任务，返回 Future；没有母版时返回 None（在请求线程中读取订单）"""
+        from utils.order_service import get_print_master
+        print_master = get_print_master(order)
+        if not print_master or not os.path.exists(print_master['path']):
+            return None
+        return images.submit(executor, print_master['path'], self.image_size(print_master, baji_size))
+    
+    def _draw_slot(self, c, layout, images, index, order, prepared):
+        """在版面的第 index 个位置绘制订单，需要时换页"""
+        item_in_page = index % layout['items_per_page']
+        if index > 0 and item_in_page == 0:
+            c.showPage()
+        
+        # 计算位置
+        row = item_in_page // layout['items_per_col']  # 除以列数得到行
+        col = item_in_page % layout['items_per_col']   # 模列数得到列
+        
+        # 计算坐标
+        x = self.margin + col * (layout['baji_size'][0] + layout['h_spacing'])
+        y = self.page_size[1] - self.margin - (row + 1) * (layout['baji_size'][1] + layout['v_spacing'])
+        
+        # 绘制吧唧
+        self.draw_baji(c, order, x, y, layout['baji_size'], images, prepared)
+    
+    def draw_baji(self, canvas, order, x, y, baji_size, images=None, prepared=None):
+        """绘制单个吧唧
+        
+        images 为文档的图片注册表，相同图片只嵌入一次；prepared 为准备阶段返回的 Future，
+        未提供时在当前线程中准备。
+        """
         try:
+            if images is None:
+                images = PDFImageRegistry(canvas)
+            
             # 绘制边框
             canvas.rect(x, y, baji_size[0], baji_size[1])
             
-            # 绘制图片
-            if order.processed_image_path and os.path.exists(order.processed_image_path):
+            # 绘制图片：使用订单的打印母版（按打印DPI生成），只在尺寸不一致时重采样
+            from utils.order_service import get_print_master
+            print_master = get_print_master(order) if prepared is None else None
+            if prepared is not None or (print_master and os.path.exists(print_master['path'])):
                 try:
-                    # 使用PIL处理图片，确保正确的尺寸和格式
-                    from PIL import Image
-                    pil_image = Image.open(order.processed_image_path)
-                    
-                    # 转换为RGB模式（PDF需要）
-                    if pil_image.mode != 'RGB':
-                        pil_image = pil_image.convert('RGB')
-                    
-                    # 调整图片尺寸以适应吧唧尺寸
-                    pil_image = pil_image.resize((int(baji_size[0]), int(baji_size[1])), Image.Resampling.LANCZOS)
-                    
-                    # 创建临时文件
-                    import tempfile
-                    temp_file = tempfile.NamedTemporaryFile(suffix='.jpg', delete=False)
-                    pil_image.save(temp_file.name, 'JPEG', quality=95)
-                    temp_file.close()
-                    
-                    # 绘制图片
-                    img = ImageReader(temp_file.name)
-                    canvas.drawImage(img, x, y, width=baji_size[0], height=baji_size[1])
-                    
-                    # 清理临时文件
-                    os.unlink(temp_file.name)
-                    
+                    if prepared is not None:
+                        images.place_prepared(prepared.result(), x, y, baji_size[0], baji_size[1])
+                    else:
+                        images.place_file(print_master['path'], x, y, baji_size[0], baji_size[1],
+                                          self.image_size(print_master, baji_size))
                 except Exception as img_error:
                     # 如果图片处理失败，绘制占位符
                     canvas.setFont("Helvetica", 10)
@@ -165,11 +321,11 @@ class PDFGenerator:
         except Exception as e:
             raise Exception(f"绘制吧唧失败: {str(e)}")
     
-    def generate_invoice(self, order):
-        """生成发票PDF"""
+    def generate_invoice(self, order, output_path=None):
+        """生成发票PDF（output_path 默认为 static/exports/invoice_<订单号>.pdf）"""
         try:
             pdf_filename = f"invoice_{order.order_no}.pdf"
-            pdf_path = os.path.join('static', 'exports', pdf_filename)
+            pdf_path = output_path or os.path.join('static', 'exports', pdf_filename)
             
             c = canvas.Canvas(pdf_path, pagesize=A4)
             
@@ -0,0 +1,170 @@
+# utils/preview_store.py - 临时预览存储
+import os
+import time
+import secrets
+import tempfile
+import threading
+from collections import OrderedDict, namedtuple
+from flask import current_app, has_app_context
+
+# 存储条目：编码后的字节（溢出到磁盘的条目为 None）、MIME类型、过期时间、溢出文件路径
+PreviewEntry = namedtuple('PreviewEntry', ['data', 'mimetype', 'expires_at', 'spill_path'])
+
+
+class PreviewStore:
+    """临时预览存储（进程内）
+
+    编辑时每次拖动滑块都会生成预览，预览图只在编辑会话中短暂使用：
+    - 编码后的字节按不透明ID保存在内存中，到期（TTL）后删除，不写 EXPORT_FOLDER
+    - 内存总字节数超过上限时淘汰最早的预览（最新的一份总是保留）；开启溢出时淘汰的预览写入临时目录，到期后删除
+    - 通过 /api/v1/previews/<ID> 读取
+
+    存储在每个Web进程内，多进程部署时预览ID只在生成它的进程中有效，
+    此时客户端可以让 /preview 直接返回图片字节。
+    """
+
+    ID_BYTES = 16
+
+    # 存储配置 -> (应用配置项, 默认值)
+    SETTING_CONFIG = {
+        'ttl': ('PREVIEW_STORE_TTL', 300),
+        'max_bytes': ('PREVIEW_STORE_MAX_BYTES', 64 * 1024 * 1024),
+        'spill': ('PREVIEW_STORE_SPILL', False),
+        'spill_dir': ('PREVIEW_STORE_SPILL_DIR', None)
+    }
+
+    def __init__(self):
+        self._entries = OrderedDict()
+        self._memory_bytes = 0
+        self._lock = threading.Lock()
+        self.stats = {
+            'stored': 0,
+            'hits': 0,
+            'misses': 0,
+            'expired': 0,
+            'evicted': 0,
+            'spilled': 0
+        }
+
+    def get_setting(self, name):
+        """读取存储配置：有应用上下文时使用应用配置"""
+        config_key, default = self.SETTING_CONFIG[name]
+        if has_app_context():
+            return current_app.config.get(config_key, default)
+        return default
+
+    def spill_dir(self):
+        return self.get_setting('spill_dir') or os.path.join(tempfile.gettempdir(), 'baji_previews')
+
+    @classmethod
+    def is_valid_id(cls, preview_id):
+        return bool(preview_id) and len(preview_id) <= 64 and all(c.isalnum() or c in '-_' for c in preview_id)
+
+    def put(self, data, mimetype):
+        """保存一份预览，返回预览ID"""
+        preview_id = secrets.token_urlsafe(self.ID_BYTES)
+        entry = PreviewEntry(data, mimetype, time.time() + self.get_setting('ttl'), None)
+        max_bytes = self.get_setting('max_bytes')
+        spill = self.get_setting('spill')
+
+        with self._lock:
+            self._purge_expired()
+            self._entries[preview_id] = entry
+            self._memory_bytes += len(data)
+            self.stats['stored'] += 1
+            # 刚保存的预览不淘汰：单个超过上限的预览也能通过返回的ID读取
+            evicted = self._evict_memory(max_bytes, keep=preview_id)
+
+        if spill:
+            for evicted_id, evicted_entry in evicted:
+                self._spill(evicted_id, evicted_entry)
+        return preview_id
+
+    def get(self, preview_id):
+        """读取预览，返回 (字节, MIME类型)；不存在或已过期时返回 None"""
+        with self._lock:
+            self._purge_expired()
+            entry = self._entries.get(preview_id)
+            if entry is None:
+                self.stats['misses'] += 1
+                return None
+            self.stats['hits'] += 1
+
+        if entry.spill_path is None:
+            return entry.data, entry.mimetype
+        try:
+            with open(entry.spill_path, 'rb') as f:
+                return f.read(), entry.mimetype
+        except OSError:
+            return None
+
+    def _evict_memory(self, max_bytes, keep=None):
+        """内存超过上限时从最早的预览开始淘汰（keep 除外），返回被淘汰的 [(ID, 条目)]（调用方持有锁）"""
+        evicted = []
+        for preview_id, entry in list(self._entries.items()):
+            if self._memory_bytes <= max_bytes:
+                break
+            if entry.spill_path is not None or preview_id == keep:
+                continue
+            del self._entries[preview_id]
+            self._memory_bytes -= len(entry.data)
+            self.stats['evicted'] += 1
+            evicted.append((preview_id, entry))
+        return evicted
+
+    def _spill(self, preview_id, entry):
+        """把淘汰的预览写入临时目录，到期前仍可读取"""
+        spill_dir = self.spill_dir()
+        spill_path = os.path.join(spill_dir, preview_id)
+        try:
+            os.makedirs(spill_dir, exist_ok=True)
+            with open(spill_path, 'wb') as f:
+                f.write(entry.data)
+        except OSError:
+            return
+
+        with self._lock:
+            # 溢出条目按原过期时间排在队列末尾，_purge_expired 遍历时跳过未到期条目
+            self._entries[preview_id] = entry._replace(data=None, spill_path=spill_path)
+            self.stats['spilled'] += 1
+
+    def _purge_expired(self):
+        """删除已过期的预览（调用方持有锁）"""
+        now = time.time()
+        expired = [preview_id for preview_id, entry in self._entries.items() if entry.expires_at <= now]
+        for preview_id in expired:
+            entry = self._entries.pop(preview_id)
+            if entry.spill_path is None:
+                self._memory_bytes -= len(entry.data)
+            else:
+                try:
+                    os.remove(entry.spill_path)
+                except OSError:
+                    pass
+            self.stats['expired'] += 1
+
+    def clear(self):
+        """清空预览存储"""
+        with self._lock:
+            entries = list(self._entries.values())
+            self._entries.clear()
+            self._memory_bytes = 0
+        for entry in entries:
+            if entry.spill_path is not None:
+                try:
+                    os.remove(entry.spill_path)
+                except OSError:
+                    pass
+
+    def get_stats(self):
+        """存储统计"""
+        with self._lock:
+            stats = dict(self.stats)
+            stats['entries'] = len(self._entries)
+            stats['spilled_entries'] = sum(1 for entry in self._entries.values() if entry.spill_path is not None)
+            stats['memory_bytes'] = self._memory_bytes
+        return stats
+
+
+# 全局临时预览存储实例（每个进程一份）
+preview_store = PreviewStore()
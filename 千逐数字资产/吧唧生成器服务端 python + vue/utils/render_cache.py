@@ -0,0 +1,271 @@
+# utils/render_cache.py - 内容寻址渲染缓存
+import io
+import os
+import json
+import shutil
+import hashlib
+import threading
+from collections import OrderedDict
+from PIL import Image
+from flask import current_app, has_app_context
+from utils.file_manager import file_manager
+from utils.baji_processor import BajiProcessor
+
+
+class RenderCache:
+    """内容寻址渲染缓存
+
+    缓存键 = 原图内容哈希 + 规范化后的渲染参数。用户来回拖动缩放/旋转滑块时，
+    同一组参数只渲染一次。质量档位是参数的一部分：预览（draft / standard）的结果只供预览复用，
+    订单总是按 final 档位渲染，只有相同原图和参数的 final 结果（如重复下单）才会被复用为打印母版。
+
+    两级缓存：
+    - 内存层：最近使用的渲染结果（PIL图片），按条目数LRU淘汰
+    - 磁盘层：static/cache/render/<键>/ 下的PNG文件，按总字节数LRU淘汰（以目录修改时间为使用时间）
+
+    磁盘层的PNG按 preview 编码配置（低压缩级别）编码一次，编码结果随渲染结果保留，
+    以相同编码配置保存的文件不再重复编码。
+    """
+
+    ARTIFACT_NAMES = ('print_master', 'design_preview', 'thumbnail')
+    # 磁盘层是临时预览，使用低压缩级别的PNG（文件固定为PNG格式）
+    ENCODER_PROFILE = 'preview'
+    HASH_CHUNK_SIZE = 1024 * 1024
+
+    # 缓存配置 -> (应用配置项, 默认值)
+    SETTING_CONFIG = {
+        'enabled': ('RENDER_CACHE_ENABLED', True),
+        'max_bytes': ('RENDER_CACHE_MAX_BYTES', 512 * 1024 * 1024),
+        'memory_items': ('RENDER_CACHE_MEMORY_ITEMS', 32),
+        'source_hash_items': ('RENDER_CACHE_SOURCE_HASH_ITEMS', 4096)
+    }
+
+    def __init__(self, cache_path=None):
+        self.cache_path = cache_path or file_manager.render_cache_path
+        self._memory = OrderedDict()
+        self._source_hashes = OrderedDict()
+        self._disk_bytes = None
+        self._lock = threading.Lock()
+        self.stats = {
+            'memory_hits': 0,
+            'disk_hits': 0,
+            'misses': 0,
+            'stores': 0,
+            'evictions': 0
+        }
+
+    def get_setting(self, name):
+        """读取缓存配置：有应用上下文时使用应用配置"""
+        config_key, default = self.SETTING_CONFIG[name]
+        if has_app_context():
+            return current_app.config.get(config_key, default)
+        return default
+
+    def source_hash(self, image_path):
+        """原图内容哈希（按路径、大小、修改时间记忆，文件不变时不重复读取）"""
+        stat = os.stat(image_path)
+        memo_key = (os.path.abspath(image_path), stat.st_size, stat.st_mtime_ns)
+        with self._lock:
+            digest = self._source_hashes.get(memo_key)
+            if digest:
+                self._source_hashes.move_to_end(memo_key)
+                return digest
+
+        sha256 = hashlib.sha256()
+        with open(image_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(self.HASH_CHUNK_SIZE), b''):
+                sha256.update(chunk)
+        digest = sha256.hexdigest()
+        self._remember_hash(memo_key, digest)
+        return digest
+
+    def remember_source_hash(self, image_path, digest):
+        """记录上传时已计算的内容哈希，渲染时不再读取原图计算"""
+        stat = os.stat(image_path)
+        self._remember_hash((os.path.abspath(image_path), stat.st_size, stat.st_mtime_ns), digest)
+
+    def _remember_hash(self, memo_key, digest):
+        """记忆内容哈希，超过 RENDER_CACHE_SOURCE_HASH_ITEMS 条时淘汰最久未使用的条目"""
+        max_items = self.get_setting('source_hash_items')
+        with self._lock:
+            self._source_hashes[memo_key] = digest
+            self._source_hashes.move_to_end(memo_key)
+            while len(self._source_hashes) > max_items:
+                self._source_hashes.popitem(last=False)
+
+    def make_key(self, processor):
+        """根据原图内容和规范化渲染参数计算缓存键"""
+        payload = {
+            'source': processor.memory_digest or self.source_hash(processor.resolve_image_path()),
+            'params': processor.cache_params()
+        }
+        encoded = json.dumps(payload, sort_keys=True, separators=(',', ':'))
+        return hashlib.sha256(encoded.encode('utf-8')).hexdigest()
+
+    def entry_dir(self, key):
+        return self.cache_path / key[:2] / key
+
+    def artifact_path(self, key, name):
+        """磁盘层中某个渲染结果的路径"""
+        return str(self.entry_dir(key) / f"{name}.png").replace('\\', '/')
+
+    def get(self, key):
+        """读取缓存，依次查找内存层和磁盘层；未命中返回 None"""
+        with self._lock:
+            artifacts = self._memory.get(key)
+            if artifacts is not None:
+                self._memory.move_to_end(key)
+                self.stats['memory_hits'] += 1
+                return artifacts
+
+        entry_dir = self.entry_dir(key)
+        if entry_dir.is_dir():
+            try:
+                # 保留读到的PNG字节，以相同编码配置保存时直接写出，不重新编码
+                artifacts = {}
+                for name in self.ARTIFACT_NAMES:
+                    data = (entry_dir / f"{name}.png").read_bytes()
+                    with Image.open(io.BytesIO(data)) as image:
+                        image.load()
+                        artifacts[name] = image
+                    BajiProcessor.remember_encoded(artifacts, name, self.ENCODER_PROFILE, data, 'PNG')
+                # 更新目录修改时间，作为磁盘层LRU的使用时间
+                os.utime(entry_dir)
+            except OSError:
+                artifacts = None
+
+            if artifacts is not None:
+                with self._lock:
+                    self.stats['disk_hits'] += 1
+                self._remember(key, artifacts)
+                return artifacts
+
+        with self._lock:
+            self.stats['misses'] += 1
+        return None
+
+    def put(self, key, artifacts):
+        """写入两级缓存，磁盘层先写临时目录再整体改名，避免读到半写入的条目"""
+        self._remember(key, artifacts)
+
+        entry_dir = self.entry_dir(key)
+        if entry_dir.is_dir():
+            return
+
+        entry_dir.parent.mkdir(parents=True, exist_ok=True)
+        temp_dir = entry_dir.parent / f".{key}.{os.getpid()}.{threading.get_ident()}"
+        temp_dir.mkdir(parents=True, exist_ok=True)
+        try:
+            for name in self.ARTIFACT_NAMES:
+                # 编码结果记录在 artifacts 中，以相同编码配置保存时复用
+                _, data = BajiProcessor.encode_artifact(artifacts, name, self.ENCODER_PROFILE, 'PNG')
+                (temp_dir / f"{name}.png").write_bytes(data)
+            os.replace(temp_dir, entry_dir)
+        except OSError:
+            # 其它进程已经写入了同一个键
+            shutil.rmtree(temp_dir, ignore_errors=True)
+            return
+
+        with self._lock:
+            self.stats['stores'] += 1
+            if self._disk_bytes is not None:
+                self._disk_bytes += self._dir_size(entry_dir)
+
+        self._evict_disk(keep=entry_dir)
+
+    def get_or_render(self, processor, render=None):
+        """返回 (渲染结果, 缓存键, 是否命中)；未命中时渲染并写入缓存
+
+        render 为实际执行渲染的函数（如渲染进程池），默认在当前线程调用 processor.render_artifacts()。
+        """
+        render = render or (lambda p: p.render_artifacts())
+        if not self.get_setting('enabled'):
+            return render(processor), None, False
+
+        key = self.make_key(processor)
+        artifacts = self.get(key)
+        if artifacts is not None:
+            return artifacts, key, True
+
+        artifacts = render(processor)
+        self.put(key, artifacts)
+        return artifacts, key, False
+
+    def _remember(self, key, artifacts):
+        """写入内存层并按条目数淘汰最久未使用的结果"""
+        memory_items = self.get_setting('memory_items')
+        with self._lock:
+            self._memory[key] = artifacts
+            self._memory.move_to_end(key)
+            while len(self._memory) > memory_items:
+                self._memory.popitem(last=False)
+
+    @staticmethod
+    def _dir_size(path):
+        return sum(f.stat().st_size for f in path.iterdir() if f.is_file())
+
+    def _scan_entries(self):
+        """扫描磁盘层，返回 [(使用时间, 大小, 目录)]"""
+        entries = []
+        if not self.cache_path.exists():
+            return entries
+        for bucket in self.cache_path.iterdir():
+            if not bucket.is_dir():
+                continue
+            for entry_dir in bucket.iterdir():
+                if entry_dir.is_dir() and not entry_dir.name.startswith('.'):
+                    try:
+                        entries.append((entry_dir.stat().st_mtime, self._dir_size(entry_dir), entry_dir))
+                    except OSError:
+                        continue
+        return entries
+
+    def _evict_disk(self, keep=None):
+        """磁盘层超过容量上限时，删除最久未使用的条目直到降到上限的90%（刚写入的条目除外）"""
+        max_bytes = self.get_setting('max_bytes')
+        if self._disk_bytes is not None and self._disk_bytes <= max_bytes:
+            return
+
+        # 首次使用或超出上限时重新扫描磁盘（多个进程共享同一个缓存目录）
+        entries = self._scan_entries()
+        total = sum(size for _, size, _ in entries)
+        if total > max_bytes:
+            target = max_bytes * 0.9
+            for _, size, entry_dir in sorted(entries, key=lambda entry: entry[0]):
+                if total <= target:
+                    break
+                if entry_dir == keep:
+                    continue
+                shutil.rmtree(entry_dir, ignore_errors=True)
+                total -= size
+                with self._lock:
+                    self.stats['evictions'] += 1
+
+        with self._lock:
+            self._disk_bytes = total
+
+    def clear(self):
+        """清空两级缓存"""
+        with self._lock:
+            self._memory.clear()
+            self._source_hashes.clear()
+            self._disk_bytes = None
+        if self.cache_path.exists():
+            for bucket in self.cache_path.iterdir():
+                if bucket.is_dir():
+                    shutil.rmtree(bucket, ignore_errors=True)
+
+    def get_stats(self):
+        """命中统计"""
+        with self._lock:
+            stats = dict(self.stats)
+            stats['memory_items'] = len(self._memory)
+            stats['source_hashes'] = len(self._source_hashes)
+            stats['disk_bytes'] = self._disk_bytes
+        lookups = stats['memory_hits'] + stats['disk_hits'] + stats['misses']
+        stats['hit_rate'] = round((stats['memory_hits'] + stats['disk_hits']) / lookups, 4) if lookups else 0.0
+        return stats
+
+
+# 全局渲染缓存实例
+render_cache = RenderCache()
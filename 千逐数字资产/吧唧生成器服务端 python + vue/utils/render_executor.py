@@ -0,0 +1,212 @@
+# utils/render_executor.py - 吧唧渲染进程池
+import os
+import zlib
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from flask import Flask, current_app, has_app_context
+from utils.render_metrics import render_metrics
+
+
+class RenderQueueFull(Exception):
+    """渲染队列已满"""
+
+
+class RenderTimeout(Exception):
+    """渲染任务超时"""
+
+
+# 工作进程中的最小Flask应用（只承载渲染相关配置，供 BajiProcessor 读取）
+_worker_app = None
+
+
+def _init_worker(config):
+    """工作进程初始化：创建只带渲染配置的最小应用"""
+    global _worker_app
+    _worker_app = Flask('render_worker')
+    _worker_app.config.update(config)
+
+
+def _render_in_worker(params, source_data=None):
+    """在工作进程中执行一次渲染，返回 (渲染结果, 阶段指标样本, 本进程阶段缓存统计)
+    （PIL图片可以直接pickle回主进程）"""
+    from utils.baji_processor import BajiProcessor
+    from utils.render_stage_cache import stage_cache
+
+    with _worker_app.app_context(), render_metrics.capture() as samples:
+        artifacts = BajiProcessor(params, source_data).render_artifacts()
+        stage_stats = stage_cache.get_stats()
+    return artifacts, samples, stage_stats
+
+
+class RenderExecutor:
+    """吧唧渲染进程池
+
+    Pillow 的部分Python层处理持有GIL，在请求线程中渲染会拖慢同一进程的其它请求。
+    渲染任务提交到有界的进程池执行：
+    - 进程池大小、单任务超时、最大排队数可配置，排队已满时立即拒绝；
+      超时的任务无法中断，在工作进程中运行结束前仍计入排队数
+    - 进程池由 RENDER_POOL_SIZE 个单进程通道组成，同一原图的任务总是提交到同一个通道，
+      阶段缓存（utils/render_stage_cache.py，每个进程一份）因此能在同一编辑会话的连续渲染之间命中
+    - 每个通道执行N个任务后替换为新进程（旧进程处理完手上任务后退出），
+      控制Pillow长期运行产生的内存碎片
+    - 进程池大小为0时在当前线程中直接渲染
+    """
+
+    # 执行器配置 -> (应用配置项, 默认值)
+    SETTING_CONFIG = {
+        'pool_size': ('RENDER_POOL_SIZE', 2),
+        'job_timeout': ('RENDER_JOB_TIMEOUT', 30),
+        'queue_depth': ('RENDER_QUEUE_DEPTH', 16),
+        'max_jobs_per_worker': ('RENDER_WORKER_MAX_JOBS', 200)
+    }
+
+    # 传递给工作进程的配置项前缀
+    WORKER_CONFIG_PREFIXES = ('RENDER_', 'IMAGE_PYRAMID_')
+
+    def __init__(self):
+        # 通道序号 -> 单进程进程池 / 该进程已执行的任务数 / 该进程最近一次返回的阶段缓存统计
+        self._lanes = {}
+        self._lane_jobs = {}
+        self._lane_stage_stats = {}
+        self._pending = 0
+        self._lock = threading.Lock()
+        self.stats = {
+            'submitted': 0,
+            'completed': 0,
+            'failed': 0,
+            'rejected': 0,
+            'timeouts': 0,
+            'recycles': 0
+        }
+
+    def get_setting(self, name):
+        """读取执行器配置：有应用上下文时使用应用配置"""
+        config_key, default = self.SETTING_CONFIG[name]
+        if has_app_context():
+            return current_app.config.get(config_key, default)
+        return default
+
+    def _worker_config(self):
+        """工作进程需要的配置（上传目录和渲染相关配置）"""
+        config = {}
+        if has_app_context():
+            config['UPLOAD_FOLDER'] = current_app.config.get('UPLOAD_FOLDER')
+            for key, value in current_app.config.items():
+                if key.startswith(self.WORKER_CONFIG_PREFIXES):
+                    config[key] = value
+        return config
+
+    @staticmethod
+    def lane_for(processor, pool_size):
+        """按原图选择通道（内存原图按内容哈希，文件按路径，与阶段缓存的解码键一致）"""
+        source = processor.memory_digest or processor.params['image']['original_path']
+        return zlib.crc32(str(source).encode('utf-8')) % pool_size
+
+    def _get_lane(self, lane):
+        """获取通道的进程池，达到任务数上限时替换为新进程（调用方持有锁）"""
+        max_jobs = self.get_setting('max_jobs_per_worker')
+        pool = self._lanes.get(lane)
+        if pool is not None and max_jobs and self._lane_jobs[lane] >= max_jobs:
+            # 旧进程处理完已提交的任务后自行退出
+            pool.shutdown(wait=False)
+            pool = None
+            self.stats['recycles'] += 1
+
+        if pool is None:
+            # spawn 启动的工作进程不继承Web进程的线程、数据库连接和内存碎片
+            pool = ProcessPoolExecutor(
+                max_workers=1,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=_init_worker,
+                initargs=(self._worker_config(),)
+            )
+            self._lanes[lane] = pool
+            self._lane_jobs[lane] = 0
+            self._lane_stage_stats.pop(lane, None)
+        return pool
+
+    def render(self, processor):
+        """渲染 BajiProcessor 任务并等待结果，返回与 render_artifacts() 相同的结果"""
+        pool_size = self.get_setting('pool_size')
+        if not pool_size:
+            return processor.render_artifacts()
+
+        with self._lock:
+            if self._pending >= self.get_setting('queue_depth'):
+                self.stats['rejected'] += 1
+                raise RenderQueueFull('渲染任务繁忙，请稍后重试')
+            self._pending += 1
+            self.stats['submitted'] += 1
+            lane = self.lane_for(processor, pool_size)
+            try:
+                pool = self._get_lane(lane)
+                future = pool.submit(_render_in_worker, processor.params, processor.source_data)
+                self._lane_jobs[lane] += 1
+            except Exception:
+                self._pending -= 1
+                raise
+        # 任务真正结束（完成、失败或取消）时才减少排队数：超时后仍在运行的任务继续占用工作进程，
+        # 必须计入排队上限。已结束的任务会立即回调，因此不能在持有锁时注册
+        future.add_done_callback(self._job_done)
+
+        try:
+            artifacts, samples, stage_stats = future.result(timeout=self.get_setting('job_timeout'))
+        except FutureTimeoutError:
+            future.cancel()
+            with self._lock:
+                self.stats['timeouts'] += 1
+            raise RenderTimeout('渲染超时，请稍后重试')
+        except BrokenProcessPool:
+            # 工作进程异常退出（如内存不足被杀），下次提交时重建该通道
+            with self._lock:
+                if self._lanes.get(lane) is pool:
+                    del self._lanes[lane]
+                self.stats['failed'] += 1
+            raise
+        except Exception:
+            with self._lock:
+                self.stats['failed'] += 1
+            raise
+
+        with self._lock:
+            self.stats['completed'] += 1
+            if self._lanes.get(lane) is pool:
+                self._lane_stage_stats[lane] = stage_stats
+        # 工作进程中记录的阶段指标合并到本进程的指标注册表
+        render_metrics.merge(samples)
+        return artifacts
+
+    def _job_done(self, future):
+        with self._lock:
+            self._pending -= 1
+
+    def shutdown(self, wait=True):
+        """关闭进程池"""
+        with self._lock:
+            for pool in self._lanes.values():
+                pool.shutdown(wait=wait)
+            self._lanes.clear()
+            self._lane_stage_stats.clear()
+
+    def get_stats(self):
+        """任务统计、当前排队数和各通道工作进程的阶段缓存统计"""
+        with self._lock:
+            stats = dict(self.stats)
+            stats['pending'] = self._pending
+            stats['pool_jobs'] = sum(self._lane_jobs.get(lane, 0) for lane in self._lanes)
+            stats['lanes'] = {
+                lane: {
+                    'jobs': self._lane_jobs.get(lane, 0),
+                    'stage_cache': self._lane_stage_stats.get(lane)
+                }
+                for lane in sorted(self._lanes)
+            }
+        stats['pool_size'] = self.get_setting('pool_size')
+        stats['pid'] = os.getpid()
+        return stats
+
+
+# 全局渲染执行器实例
+render_executor = RenderExecutor()
@@ -0,0 +1,192 @@
+# utils/render_geometry.py - 吧唧渲染几何引擎
+import math
+
+
+class RenderGeometry:
+    """渲染几何引擎
+
+    前端的变换语义是：整图绕中心旋转（expand）后，在旋转后的图片上按偏移
+    裁切设计区域和打印区域。这里在"旋转后坐标系"中计算同样的裁切窗口，
+    再把窗口映射回原图坐标，这样只需要取出窗口覆盖的那一小块原图来旋转，
+    内存和CPU开销只和裁切区域大小有关，与上传图片的尺寸无关。
+    """
+
+    PRINT_BLEED_RATIO = 68 / 58  # 打印区域(68mm)相对设计区域(58mm)的外扩比例
+    FIXED_POINT_ONE = 65536      # PIL最近邻仿射变换使用的16.16定点数
+
+    def __init__(self, source_size, edit_params, source_scale=1.0):
+        self.source_width, self.source_height = source_size
+        # 解码时缩小了原图（source_scale < 1），可视区域和偏移按同样比例换算到解码后的像素
+        self.source_scale = source_scale
+
+        self.scale = edit_params['scale']
+        self.rotation = edit_params['rotation']
+        self.offset_x = edit_params['offset_x']
+        self.offset_y = edit_params['offset_y']
+
+        # 获取Canvas真实宽度331（前端传递）
+        self.canvas_client_width = edit_params.get('canvas_client_width', 331)
+        self.canvas_client_height = edit_params.get('canvas_client_height', 331)
+        self.canvas_size = min(self.canvas_client_width, self.canvas_client_height)
+
+        # 可视区域大小：Canvas宽度331，缩放0.6时 = 331/0.6 = 551.67
+        self.visible_area_size = self.canvas_size / self.scale * self.source_scale
+        self.half_visible_area = self.visible_area_size / 2
+
+        # Canvas偏移转换为图片偏移（前端向右拖拽时，裁切区域向左移动）
+        self.offset_scale_factor = self.visible_area_size / self.canvas_size
+        self.image_offset_x = -self.offset_x * self.offset_scale_factor
+        self.image_offset_y = -self.offset_y * self.offset_scale_factor
+
+        # 打印模式在设计区域基础上加上68mm中多出的部分
+        self.print_crop_half = self.half_visible_area * self.PRINT_BLEED_RATIO
+
+        self._build_rotation_matrix()
+
+    def _build_rotation_matrix(self):
+        """计算与 Image.rotate(-rotation, expand=True) 完全一致的仿射矩阵
+
+        矩阵把旋转后图片的坐标映射回原图坐标（PIL transform 的约定）。
+        """
+        w, h = self.source_width, self.source_height
+        center_x, center_y = w / 2, h / 2
+
+        # PIL的rotate是逆时针，Canvas的rotate是顺时针，所以需要取反
+        angle = -math.radians(-self.rotation)
+        a = round(math.cos(angle), 15)
+        b = round(math.sin(angle), 15)
+        d = round(-math.sin(angle), 15)
+        e = round(math.cos(angle), 15)
+
+        c = a * -center_x + b * -center_y + center_x
+        f = d * -center_x + e * -center_y + center_y
+
+        # 计算expand后的图片尺寸
+        xx = []
+        yy = []
+        for x, y in ((0, 0), (w, 0), (w, h), (0, h)):
+            xx.append(a * x + b * y + c)
+            yy.append(d * x + e * y + f)
+        rotated_width = math.ceil(max(xx)) - math.floor(min(xx))
+        rotated_height = math.ceil(max(yy)) - math.floor(min(yy))
+
+        shift_x = -(rotated_width - w) / 2.0
+        shift_y = -(rotated_height - h) / 2.0
+        c, f = a * shift_x + b * shift_y + c, d * shift_x + e * shift_y + f
+
+        self.matrix = (a, b, c, d, e, f)
+        self.rotated_size = (rotated_width, rotated_height)
+
+    @property
+    def is_rotated(self):
+        return self.rotation != 0
+
+    def _window(self, half_size):
+        """在旋转后坐标系中计算裁切窗口（不超出旋转后图片边界）"""
+        rotated_width, rotated_height = self.rotated_size
+        center_x = rotated_width / 2 + self.image_offset_x
+        center_y = rotated_height / 2 + self.image_offset_y
+
+        return (
+            max(0, center_x - half_size),
+            max(0, center_y - half_size),
+            min(rotated_width, center_x + half_size),
+            min(rotated_height, center_y + half_size)
+        )
+
+    def design_window(self):
+        """设计模式裁切窗口"""
+        return self._window(self.half_visible_area)
+
+    def print_window(self):
+        """打印模式裁切窗口"""
+        return self._window(self.print_crop_half)
+
+    @staticmethod
+    def pixel_box(window):
+        """窗口取整，与 Image.crop 的取整方式一致"""
+        return tuple(int(round(v)) for v in window)
+
+    def map_to_source(self, x, y):
+        """旋转后坐标 -> 原图坐标"""
+        a, b, c, d, e, f = self.matrix
+        return a * x + b * y + c, d * x + e * y + f
+
+    def source_bbox(self, box, padding=2):
+        """计算旋转后坐标系中的窗口在原图中需要的最小外接矩形
+
+        返回裁剪到原图范围内的整数区域 (left, top, right, bottom)；
+        窗口完全落在原图之外时返回 None。
+        """
+        left, top, right, bottom = box
+        corners = [self.map_to_source(x, y) for x, y in
+                   ((left, top), (right, top), (right, bottom), (left, bottom))]
+        xs = [x for x, _ in corners]
+        ys = [y for _, y in corners]
+
+        src_left = max(0, math.floor(min(xs)) - padding)
+        src_top = max(0, math.floor(min(ys)) - padding)
+        src_right = min(self.source_width, math.ceil(max(xs)) + padding)
+        src_bottom = min(self.source_height, math.ceil(max(ys)) + padding)
+
+        if src_left >= src_right or src_top >= src_bottom:
+            return None
+        return src_left, src_top, src_right, src_bottom
+
+    def region_matrix(self, box, region_origin):
+        """计算从局部区域直接采样出窗口的仿射矩阵
+
+        box 为旋转后坐标系中的整数窗口，region_origin 为局部区域在原图中的左上角。
+        用于 region.transform(窗口尺寸, AFFINE, matrix)，结果与整图旋转后再裁切一致。
+
+        PIL 的最近邻仿射变换使用16.16定点数逐像素累加坐标，这里按同样的定点
+        步长推算窗口起点，保证局部采样和整图旋转取到完全相同的像素。
+        """
+        a, b, c, d, e, f = self.matrix
+        x0, y0 = box[0], box[1]
+        origin_x, origin_y = region_origin
+
+        def fixed(v):
+            return math.floor(v * self.FIXED_POINT_ONE + 0.5)
+
+        start_x = (fixed(c + a * 0.5 + b * 0.5) + x0 * fixed(a) + y0 * fixed(b)) / self.FIXED_POINT_ONE
+        start_y = (fixed(f + d * 0.5 + e * 0.5) + x0 * fixed(d) + y0 * fixed(e)) / self.FIXED_POINT_ONE
+
+        return (
+            a, b, start_x - a * 0.5 - b * 0.5 - origin_x,
+            d, e, start_y - d * 0.5 - e * 0.5 - origin_y
+        )
+
+    def tile_matrix(self, box, output_size, region_origin=(0, 0)):
+        """计算把窗口直接采样成输出尺寸图块的仿射矩阵
+
+        把 偏移 + 旋转 + 缩放 + 裁切 合并成一个输出坐标 -> 原图坐标的矩阵，
+        用一次 Image.transform 直接得到最终尺寸，不产生旋转后的整图和裁切中间图。
+        窗口非正方形（贴边被截断）时与 crop + resize 一样按两个方向分别缩放。
+        """
+        a, b, c, d, e, f = self.matrix
+        left, top, right, bottom = box
+        output_width, output_height = output_size
+        scale_x = (right - left) / output_width
+        scale_y = (bottom - top) / output_height
+        origin_x, origin_y = region_origin
+
+        return (
+            a * scale_x, b * scale_y, a * left + b * top + c - origin_x,
+            d * scale_x, e * scale_y, d * left + e * top + f - origin_y
+        )
+
+    def describe(self):
+        """几何信息摘要（用于调试日志）"""
+        return {
+            'source_size': (self.source_width, self.source_height),
+            'source_scale': self.source_scale,
+            'rotated_size': self.rotated_size,
+            'canvas_size': self.canvas_size,
+            'scale': self.scale,
+            'rotation': self.rotation,
+            'visible_area_size': self.visible_area_size,
+            'image_offset': (self.image_offset_x, self.image_offset_y),
+            'design_window': self.design_window(),
+            'print_window': self.print_window()
+        }
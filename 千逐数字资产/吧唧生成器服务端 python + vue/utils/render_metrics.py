@@ -0,0 +1,188 @@
+# utils/render_metrics.py - 渲染阶段指标
+import time
+import random
+import bisect
+import threading
+from contextlib import contextmanager
+from PIL import Image
+from flask import current_app, has_app_context
+
+
+class Histogram:
+    """固定分桶直方图：记录次数、总和、最小/最大值和各桶计数，按桶上界估算分位数"""
+
+    def __init__(self, buckets):
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.total += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def quantile(self, q):
+        """分位数估算：所在桶的上界（不超过最大值）"""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank and count:
+                bound = self.buckets[index] if index < len(self.buckets) else self.max
+                return min(bound, self.max)
+        return self.max
+
+    def snapshot(self):
+        return {
+            'count': self.count,
+            'sum': round(self.total, 3),
+            'min': self.min,
+            'max': self.max,
+            'avg': round(self.total / self.count, 3) if self.count else None,
+            'p50': self.quantile(0.5),
+            'p95': self.quantile(0.95),
+            'p99': self.quantile(0.99),
+            'buckets': {str(bound): count for bound, count in zip(self.buckets + ('+Inf',), self.counts)}
+        }
+
+
+class RenderMetrics:
+    """渲染阶段指标（直方图注册表）
+
+    BajiProcessor 每个阶段（decode / normalize / rotate / crop / resize / color / sample / encode / save）
+    实际执行时（阶段缓存未命中）记录：
+    - wall_ms：耗时（毫秒）
+    - input_pixels / output_pixels：输入、输出像素数
+    - peak_bytes：阶段内同时存在的输入和输出图片缓冲区字节数（Pillow 多通道模式每像素4字节）
+    - output_bytes：编码阶段输出的字节数（编码按配置名分别记录为 encode.<配置名>）
+    每个指标是一个以 "<阶段>.<指标>" 命名的直方图，由管理端 /monitor/metrics 输出。
+
+    渲染进程池的工作进程在 capture() 中收集本次渲染的样本，随渲染结果返回主进程合并（merge）。
+    几何调试日志默认关闭，开启后按采样率输出，避免逐次渲染写标准输出。
+    """
+
+    # 指标配置 -> (应用配置项, 默认值)
+    SETTING_CONFIG = {
+        'enabled': ('RENDER_METRICS_ENABLED', True),
+        'debug_log': ('RENDER_DEBUG_LOG', False),
+        'debug_sample_rate': ('RENDER_DEBUG_SAMPLE_RATE', 0.01)
+    }
+
+    # 各类指标的分桶上界
+    BUCKETS = {
+        'wall_ms': (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 30000),
+        'input_pixels': (10 ** 4, 10 ** 5, 250000, 10 ** 6, 4 * 10 ** 6, 16 * 10 ** 6, 40 * 10 ** 6, 10 ** 8),
+        'output_pixels': (10 ** 4, 10 ** 5, 250000, 10 ** 6, 4 * 10 ** 6, 16 * 10 ** 6, 40 * 10 ** 6, 10 ** 8),
+        'peak_bytes': tuple(2 ** power for power in range(16, 31, 2)),
+        'output_bytes': tuple(2 ** power for power in range(12, 27, 2))
+    }
+
+    def __init__(self):
+        self._histograms = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def get_setting(self, name):
+        """读取指标配置：有应用上下文时使用应用配置"""
+        config_key, default = self.SETTING_CONFIG[name]
+        if has_app_context():
+            return current_app.config.get(config_key, default)
+        return default
+
+    @staticmethod
+    def image_bytes(image):
+        """Pillow 图片缓冲区的字节数"""
+        if not isinstance(image, Image.Image):
+            return len(image) if isinstance(image, (bytes, bytearray)) else 0
+        pixel_bytes = 1 if image.mode in ('1', 'L', 'P') else 4
+        return image.width * image.height * pixel_bytes
+
+    @staticmethod
+    def pixel_count(image):
+        return image.width * image.height if isinstance(image, Image.Image) else None
+
+    def measure(self, stage, compute, input_image=None, input_pixels=None, peak_bytes=None):
+        """执行一个阶段并记录耗时、像素数和峰值字节数，返回阶段输出"""
+        if not self.get_setting('enabled'):
+            return compute()
+
+        start = time.perf_counter()
+        result = compute()
+        wall_ms = (time.perf_counter() - start) * 1000
+
+        if input_pixels is None and input_image is not None:
+            input_pixels = self.pixel_count(input_image)
+        if peak_bytes is None:
+            peak_bytes = self.image_bytes(input_image) + self.image_bytes(result)
+
+        samples = [('wall_ms', round(wall_ms, 3)), ('peak_bytes', peak_bytes)]
+        if input_pixels is not None:
+            samples.append(('input_pixels', input_pixels))
+        output_pixels = self.pixel_count(result)
+        if output_pixels is not None:
+            samples.append(('output_pixels', output_pixels))
+        elif isinstance(result, (bytes, bytearray)):
+            samples.append(('output_bytes', len(result)))
+        for metric, value in samples:
+            self.observe(f"{stage}.{metric}", value)
+        return result
+
+    def observe(self, name, value):
+        """记录一个样本；处于 capture() 中时只收集，不写入注册表"""
+        captured = getattr(self._local, 'captured', None)
+        if captured is not None:
+            captured.append((name, value))
+            return
+
+        metric = name.rsplit('.', 1)[-1]
+        with self._lock:
+            histogram = self._histograms.get(name)
+            if histogram is None:
+                histogram = self._histograms[name] = Histogram(self.BUCKETS[metric])
+            histogram.observe(value)
+
+    @contextmanager
+    def capture(self):
+        """收集当前线程中记录的样本（渲染工作进程随结果返回给主进程）"""
+        captured = []
+        self._local.captured = captured
+        try:
+            yield captured
+        finally:
+            self._local.captured = None
+
+    def merge(self, samples):
+        """合并工作进程返回的样本"""
+        for name, value in samples or ():
+            self.observe(name, value)
+
+    def sample_debug_log(self):
+        """本次渲染是否输出调试日志（默认关闭，开启后按采样率抽样）"""
+        if not self.get_setting('debug_log'):
+            return False
+        return random.random() < self.get_setting('debug_sample_rate')
+
+    def reset(self):
+        with self._lock:
+            self._histograms.clear()
+
+    def get_stats(self):
+        """按阶段分组的直方图快照：{阶段: {指标: 快照}}"""
+        with self._lock:
+            snapshots = {name: histogram.snapshot() for name, histogram in self._histograms.items()}
+        stages = {}
+        for name, snapshot in sorted(snapshots.items()):
+            stage, metric = name.rsplit('.', 1)
+            stages.setdefault(stage, {})[metric] = snapshot
+        return stages
+
+
+# 全局渲染指标实例（每个进程一份）
+render_metrics = RenderMetrics()
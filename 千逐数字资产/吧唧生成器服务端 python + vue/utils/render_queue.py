@@ -0,0 +1,233 @@
+# utils/render_queue.py - 持久化渲染队列
+import os
+import json
+import socket
+import threading
+from datetime import datetime, timedelta
+from flask import current_app, has_app_context
+from sqlalchemy import or_, and_
+from utils.models import RenderJob, Order, db
+
+
+class RenderQueue:
+    """持久化渲染队列（render_jobs 表）
+
+    创建订单时只入队渲染任务并立即返回 rendering 状态的订单；worker 进程
+    （python worker.py，可以在本机或共享数据库和文件目录的其它节点上运行）领取任务：
+    - 领取时写入租约（lease_owner / lease_expires_at），用条件更新保证同一任务只被一个 worker 领取
+    - worker 崩溃导致租约过期的任务会被其它 worker 重新领取
+    - 失败的任务按退避时间重试，超过最大次数后标记为 failed，订单标记为 render_failed
+    - 完成后回填订单的 processed_image_path / preview_image_path，订单进入 processing 状态
+    """
+
+    ORDER_STATUS_RENDERING = 'rendering'
+    ORDER_STATUS_RENDER_FAILED = 'render_failed'
+    ORDER_STATUS_RENDERED = 'processing'
+
+    # 队列配置 -> (应用配置项, 默认值)
+    SETTING_CONFIG = {
+        'enabled': ('RENDER_QUEUE_ENABLED', True),
+        'lease_seconds': ('RENDER_QUEUE_LEASE_SECONDS', 120),
+        'max_attempts': ('RENDER_QUEUE_MAX_ATTEMPTS', 3),
+        'retry_delay': ('RENDER_QUEUE_RETRY_DELAY', 10),
+        'poll_interval': ('RENDER_QUEUE_POLL_INTERVAL', 1.0)
+    }
+
+    def get_setting(self, name):
+        """读取队列配置：有应用上下文时使用应用配置"""
+        config_key, default = self.SETTING_CONFIG[name]
+        if has_app_context():
+            return current_app.config.get(config_key, default)
+        return default
+
+    @staticmethod
+    def default_worker_id():
+        """worker 标识：主机名 + 进程号 + 线程号"""
+        return f"{socket.gethostname()}:{os.getpid()}:{threading.get_ident()}"
+
+    def enqueue(self, order_id, order_no, params, output_path):
+        """入队一个订单渲染任务"""
+        job = RenderJob(
+            order_id=order_id,
+            order_no=order_no,
+            params=json.dumps(params),
+            output_path=output_path,
+            status='queued',
+            max_attempts=self.get_setting('max_attempts'),
+            available_at=datetime.utcnow()
+        )
+        db.session.add(job)
+        db.session.commit()
+        return job
+
+    def claim(self, worker_id):
+        """领取一个可执行的任务（排队中且到达重试时间，或租约已过期），没有任务时返回 None"""
+        now = datetime.utcnow()
+        claimable = or_(
+            and_(RenderJob.status == 'queued', RenderJob.available_at <= now),
+            and_(RenderJob.status == 'running', RenderJob.lease_expires_at < now)
+        )
+
+        candidates = RenderJob.query.with_entities(RenderJob.id, RenderJob.attempts, RenderJob.max_attempts) \
+            .filter(claimable).order_by(RenderJob.created_at).limit(10).all()
+
+        for job_id, attempts, max_attempts in candidates:
+            if attempts >= max_attempts:
+                # 租约过期且已用完重试次数（worker 在渲染中崩溃）
+                self._mark_failed(job_id, '渲染任务多次中断，已放弃')
+                continue
+
+            # 条件更新：只有仍处于可领取状态时才能领取成功，多个 worker 并发时只有一个成功
+            claimed = RenderJob.query.filter(RenderJob.id == job_id, claimable).update({
+                'status': 'running',
+                'lease_owner': worker_id,
+                'lease_expires_at': now + timedelta(seconds=self.get_setting('lease_seconds')),
+                'attempts': RenderJob.attempts + 1,
+                'started_at': now,
+                'updated_at': now
+            }, synchronize_session=False)
+            db.session.commit()
+
+            if claimed == 1:
+                return RenderJob.query.get(job_id)
+        return None
+
+    def complete(self, job, saved_paths, print_master=None):
+        """任务完成：回填订单图片路径和打印母版元数据，rendering 状态的订单进入 processing"""
+        now = datetime.utcnow()
+        updated = RenderJob.query.filter(RenderJob.id == job.id, RenderJob.lease_owner == job.lease_owner,
+                                         RenderJob.status == 'running').update({
+            'status': 'done',
+            'lease_expires_at': None,
+            'error_message': None,
+            'completed_at': now,
+            'updated_at': now
+        }, synchronize_session=False)
+        if updated != 1:
+            # 租约已过期并被其它 worker 领取，结果以对方为准
+            db.session.rollback()
+            return False
+
+        order = Order.query.get(job.order_id)
+        if order:
+            order.processed_image_path = saved_paths['print_master']
+            order.preview_image_path = saved_paths['thumbnail']
+            if print_master:
+                from utils.order_service import record_print_master
+                record_print_master(order, print_master)
+            if order.status == self.ORDER_STATUS_RENDERING:
+                order.status = self.ORDER_STATUS_RENDERED
+        db.session.commit()
+        return True
+
+    def fail(self, job, error):
+        """任务失败：未超过最大次数时按退避时间重新排队，否则标记为失败"""
+        now = datetime.utcnow()
+        if job.attempts >= job.max_attempts:
+            self._mark_failed(job.id, error)
+            return
+
+        delay = self.get_setting('retry_delay') * (2 ** (job.attempts - 1))
+        RenderJob.query.filter(RenderJob.id == job.id, RenderJob.lease_owner == job.lease_owner).update({
+            'status': 'queued',
+            'lease_owner': None,
+            'lease_expires_at': None,
+            'available_at': now + timedelta(seconds=delay),
+            'error_message': str(error),
+            'updated_at': now
+        }, synchronize_session=False)
+        db.session.commit()
+
+    def _mark_failed(self, job_id, error):
+        """任务最终失败，订单标记为 render_failed"""
+        now = datetime.utcnow()
+        job = RenderJob.query.get(job_id)
+        if not job:
+            return
+        job.status = 'failed'
+        job.lease_expires_at = None
+        job.error_message = str(error)
+        job.completed_at = now
+
+        order = Order.query.get(job.order_id)
+        if order and order.status == self.ORDER_STATUS_RENDERING:
+            order.status = self.ORDER_STATUS_RENDER_FAILED
+        db.session.commit()
+
+    def process_job(self, job):
+        """执行一个已领取的任务：渲染（优先命中渲染缓存）并保存衍生图，返回 (各衍生图路径, 打印母版元数据)"""
+        from utils.baji_processor import BajiProcessor
+        from utils.render_cache import render_cache
+        from utils.render_executor import render_executor
+
+        processor = BajiProcessor(json.loads(job.params))
+        artifacts, _, _ = render_cache.get_or_render(processor, render=render_executor.render)
+        os.makedirs(os.path.dirname(job.output_path) or '.', exist_ok=True)
+        saved_paths = processor.save_artifacts(artifacts, job.output_path)
+        return saved_paths, processor.print_master_metadata(artifacts, saved_paths['print_master'])
+
+    def process_next(self, worker_id=None):
+        """领取并执行一个任务，返回是否处理了任务"""
+        worker_id = worker_id or self.default_worker_id()
+        job = self.claim(worker_id)
+        if job is None:
+            return False
+
+        try:
+            saved_paths, print_master = self.process_job(job)
+        except Exception as e:
+            db.session.rollback()
+            current_app.logger.error(f"渲染任务失败 #{job.id} ({job.order_no}): {str(e)}")
+            self.fail(job, e)
+            return True
+
+        self.complete(job, saved_paths, print_master)
+        return True
+
+    def run_worker(self, worker_id=None, stop_event=None):
+        """worker 主循环：有任务时连续处理，没有任务时按轮询间隔等待"""
+        worker_id = worker_id or self.default_worker_id()
+        stop_event = stop_event or threading.Event()
+        current_app.logger.info(f"渲染队列 worker 启动: {worker_id}")
+
+        while not stop_event.is_set():
+            try:
+                processed = self.process_next(worker_id)
+            except Exception as e:
+                # 数据库暂时不可用等情况，等待后继续
+                db.session.rollback()
+                current_app.logger.error(f"渲染队列 worker 异常: {str(e)}")
+                processed = False
+            finally:
+                db.session.remove()
+
+            if not processed:
+                stop_event.wait(self.get_setting('poll_interval'))
+
+    def start_embedded_workers(self, app, count):
+        """在 Web 进程中启动后台 worker 线程（单机部署时无需单独运行 worker.py）"""
+        stop_event = threading.Event()
+
+        def run():
+            with app.app_context():
+                self.run_worker(stop_event=stop_event)
+
+        for index in range(count):
+            thread = threading.Thread(target=run, name=f"render-worker-{index}", daemon=True)
+            thread.start()
+        return stop_event
+
+    def get_stats(self):
+        """各状态的任务数"""
+        counts = dict(db.session.query(RenderJob.status, db.func.count(RenderJob.id))
+                      .group_by(RenderJob.status).all())
+        return {
+            'queued': counts.get('queued', 0),
+            'running': counts.get('running', 0),
+            'done': counts.get('done', 0),
+            'failed': counts.get('failed', 0)
+        }
+
+
+# 全局渲染队列实例
+render_queue = RenderQueue()
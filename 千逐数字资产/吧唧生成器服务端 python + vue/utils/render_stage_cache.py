@@ -0,0 +1,106 @@
+# utils/render_stage_cache.py - 渲染流水线阶段缓存
+import threading
+from collections import OrderedDict
+from PIL import Image
+from flask import current_app, has_app_context
+
+
+class StageCache:
+    """渲染流水线阶段缓存（进程内）
+
+    BajiProcessor 的每个阶段（解码 -> 模式转换 -> 旋转 -> 裁切 -> 缩放 -> 颜色校正 -> 编码）
+    以"上游阶段的键 + 本阶段输入"为键缓存输出。同一编辑会话中只改动一个参数时，
+    变化点之前的阶段直接命中，只重新执行下游阶段。
+
+    缓存只在所在进程内有效：使用渲染进程池时每个工作进程各有一份，
+    RenderExecutor 把同一原图的任务固定提交到同一个工作进程，
+    工作进程的统计见 render_executor.get_stats() 的 lanes（Web进程的统计只包含进程内直接渲染）。
+
+    按估算的字节数做LRU淘汰；缓存的图片视为只读，各阶段都返回新图片而不修改输入。
+    """
+
+    # 缓存配置 -> (应用配置项, 默认值)
+    SETTING_CONFIG = {
+        'enabled': ('RENDER_STAGE_CACHE_ENABLED', True),
+        'max_bytes': ('RENDER_STAGE_CACHE_MAX_BYTES', 128 * 1024 * 1024)
+    }
+
+    def __init__(self):
+        self._entries = OrderedDict()
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+        self.stats = {}
+
+    def get_setting(self, name):
+        """读取缓存配置：有应用上下文时使用应用配置"""
+        config_key, default = self.SETTING_CONFIG[name]
+        if has_app_context():
+            return current_app.config.get(config_key, default)
+        return default
+
+    @classmethod
+    def estimate_size(cls, value):
+        """估算阶段输出占用的内存字节数"""
+        if isinstance(value, Image.Image):
+            return value.width * value.height * len(value.getbands())
+        if isinstance(value, (bytes, bytearray)):
+            return len(value)
+        if isinstance(value, (tuple, list)):
+            return sum(cls.estimate_size(item) for item in value)
+        return 64
+
+    def _count(self, stage, result):
+        stage_stats = self.stats.setdefault(stage, {'hits': 0, 'misses': 0})
+        stage_stats[result] += 1
+
+    def get_or_compute(self, stage, key, compute):
+        """返回阶段输出，未命中时调用 compute() 计算并缓存"""
+        if not self.get_setting('enabled'):
+            return compute()
+
+        entry_key = (stage, key)
+        with self._lock:
+            if entry_key in self._entries:
+                self._entries.move_to_end(entry_key)
+                self._count(stage, 'hits')
+                return self._entries[entry_key][0]
+            self._count(stage, 'misses')
+
+        value = compute()
+        self.put(entry_key, value)
+        return value
+
+    def put(self, entry_key, value):
+        """写入缓存并按字节数淘汰最久未使用的阶段输出"""
+        size = self.estimate_size(value)
+        max_bytes = self.get_setting('max_bytes')
+        if size > max_bytes:
+            return
+
+        with self._lock:
+            if entry_key in self._entries:
+                self._total_bytes -= self._entries.pop(entry_key)[1]
+            self._entries[entry_key] = (value, size)
+            self._total_bytes += size
+            while self._total_bytes > max_bytes and self._entries:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self._total_bytes -= evicted_size
+
+    def clear(self):
+        """清空阶段缓存"""
+        with self._lock:
+            self._entries.clear()
+            self._total_bytes = 0
+
+    def get_stats(self):
+        """各阶段命中统计和占用内存"""
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self._total_bytes,
+                'stages': {stage: dict(counts) for stage, counts in self.stats.items()}
+            }
+
+
+# 全局阶段缓存实例（每个进程一份）
+stage_cache = StageCache()
@@ -0,0 +1,247 @@
+# utils/upload_ingest.py - 单次读取的上传处理
+import io
+import os
+import re
+import stat
+import struct
+import base64
+import binascii
+import hashlib
+from collections import namedtuple
+from PIL import Image
+from flask import current_app, has_app_context
+
+# 处理结果：保存路径、图片信息（/upload 响应中的 image_info）、内容哈希（sha256）
+IngestResult = namedtuple('IngestResult', ['path', 'image_info', 'content_hash'])
+
+
+class UploadRejected(ValueError):
+    """上传内容未通过校验（大小、格式、像素数），消息可直接返回给客户端"""
+
+
+class UploadIngestor:
+    """单次读取的上传处理
+
+    请求体只按块读取一次，同一遍中：
+    - 写入目标目录的临时文件（完成后原子重命名），超过 MAX_CONTENT_LENGTH 时立即中止
+    - 计算内容哈希（sha256）
+    - 用开头的字节判断文件类型（magic bytes），与扩展名、解析出的格式互相校验
+    - 只用开头的字节解析图片文件头得到尺寸和格式，不解码像素；
+      像素数超过 UPLOAD_MAX_PIXELS（解压缩炸弹）或尺寸超过 MAX_IMAGE_SIZE 时拒绝
+    保存后不再重新打开文件，/upload 需要的信息全部来自这一遍。
+
+    订单请求中的 data URL / base64 图片由 ingest_base64 直接解码到内存，经过相同的大小、
+    格式、文件头和像素数检查，不写临时文件；订单需要保留的原图由 store() 写入上传目录。
+    """
+
+    # 文件头 -> 格式（WEBP 还需检查第8-12字节）
+    MAGIC_BYTES = (
+        (b'\xff\xd8\xff', 'JPEG'),
+        (b'\x89PNG\r\n\x1a\n', 'PNG'),
+        (b'RIFF', 'WEBP'),
+        (b'GIF87a', 'GIF'),
+        (b'GIF89a', 'GIF')
+    )
+    # 扩展名 -> 格式
+    EXTENSION_FORMATS = {'jpg': 'JPEG', 'jpeg': 'JPEG', 'png': 'PNG', 'webp': 'WEBP', 'gif': 'GIF'}
+    # base64 每次解码的字符数（4的倍数）
+    BASE64_CHUNK_CHARS = 4 * 64 * 1024
+    WHITESPACE = re.compile(r'\s')
+
+    # 处理配置 -> (应用配置项, 默认值)
+    SETTING_CONFIG = {
+        'chunk_size': ('UPLOAD_CHUNK_SIZE', 1024 * 1024),
+        'header_bytes': ('UPLOAD_HEADER_BYTES', 1024 * 1024),
+        # 与 Pillow 抛出 DecompressionBombError 的阈值一致
+        'max_pixels': ('UPLOAD_MAX_PIXELS', 2 * Image.MAX_IMAGE_PIXELS)
+    }
+
+    def get_setting(self, name):
+        """读取处理配置：有应用上下文时使用应用配置"""
+        config_key, default = self.SETTING_CONFIG[name]
+        if has_app_context():
+            return current_app.config.get(config_key, default)
+        return default
+
+    def sniff(self, head):
+        """按文件头判断格式，无法识别时返回 None"""
+        for magic, format_name in self.MAGIC_BYTES:
+            if head.startswith(magic):
+                if format_name == 'WEBP' and head[8:12] != b'WEBP':
+                    return None
+                return format_name
+        return None
+
+    def ingest(self, file, target_path):
+        """读取上传文件并保存到 target_path，返回 IngestResult；校验失败时抛出 UploadRejected"""
+        extension = file.filename.rsplit('.', 1)[-1].lower() if '.' in file.filename else ''
+        if extension not in current_app.config['ALLOWED_EXTENSIONS']:
+            raise UploadRejected('不支持的文件格式')
+
+        max_size = current_app.config['MAX_CONTENT_LENGTH']
+        chunk_size = self.get_setting('chunk_size')
+        header_limit = self.get_setting('header_bytes')
+        sha256 = hashlib.sha256()
+        header = bytearray()
+        size = 0
+
+        part_path = f"{target_path}.part"
+        try:
+            with open(part_path, 'wb') as out:
+                for chunk in iter(lambda: file.stream.read(chunk_size), b''):
+                    size += len(chunk)
+                    if size > max_size:
+                        raise UploadRejected(f'文件太大，请选择小于{max_size // (1024*1024)}MB的图片')
+                    if not header:
+                        # 第一个块：先判断文件类型，不是图片时不再继续读取
+                        if self.sniff(chunk[:16]) is None:
+                            raise UploadRejected('不是有效的图片文件')
+                    if len(header) < header_limit:
+                        header += chunk[:header_limit - len(header)]
+                    sha256.update(chunk)
+                    out.write(chunk)
+
+            if size == 0:
+                raise UploadRejected('文件为空')
+            image_info = self._probe(bytes(header), extension)
+            image_info['size'] = size
+
+            os.replace(part_path, target_path)
+        except BaseException:
+            try:
+                os.remove(part_path)
+            except OSError:
+                pass
+            raise
+
+        self._restrict_permissions(target_path)
+        return IngestResult(target_path, image_info, sha256.hexdigest())
+
+    def _probe(self, header, extension):
+        """只解析文件头，返回图片信息（宽、高、格式）"""
+        sniffed = self.sniff(header[:16])
+        try:
+            if sniffed == 'WEBP':
+                # Pillow 打开 WebP 需要完整数据，尺寸直接从 RIFF 块头读取
+                width, height = self._webp_size(header)
+                image_format = 'WEBP'
+            else:
+                with Image.open(io.BytesIO(header)) as image:
+                    width, height = image.size
+                    image_format = image.format
+        except Image.DecompressionBombError:
+            raise UploadRejected('图片像素数过大')
+        except Exception as e:
+            raise UploadRejected(f'图片文件验证失败: {str(e)}')
+
+        # 文件头、解析结果和扩展名必须一致（GIF 等不在允许列表中的格式已被扩展名拒绝）
+        if image_format != sniffed or self.EXTENSION_FORMATS.get(extension) != image_format:
+            raise UploadRejected('文件内容与扩展名不符')
+
+        if width * height > self.get_setting('max_pixels'):
+            raise UploadRejected('图片像素数过大')
+        max_dimensions = current_app.config.get('MAX_IMAGE_SIZE', (2048, 2048))
+        if width > max_dimensions[0] or height > max_dimensions[1]:
+            raise UploadRejected(f'图片尺寸过大，最大支持{max_dimensions[0]}x{max_dimensions[1]}像素')
+
+        return {
+            'width': width,
+            'height': height,
+            'format': image_format.lower()
+        }
+
+    def ingest_base64(self, value):
+        """解码 data URL 或纯 base64 图片，返回 (图片字节, IngestResult)；path 为 None（保存见 store()）
+
+        按块解码到内存，不生成整段的中间副本；data URL 声明的类型作为扩展名参与一致性校验。
+        """
+        start, extension = 0, None
+        if value.startswith('data:'):
+            start = value.find(',') + 1
+            if not start:
+                raise UploadRejected('无效的图片数据格式')
+            media_type = value[5:start - 1].split(';', 1)[0].strip().lower()
+            extension = media_type.split('/', 1)[1] if media_type.startswith('image/') else ''
+            if extension not in current_app.config['ALLOWED_EXTENSIONS']:
+                raise UploadRejected('不支持的文件格式')
+
+        # 解码前按长度估算解码后的大小，超限时不解码
+        max_size = current_app.config['MAX_CONTENT_LENGTH']
+        if (len(value) - start) // 4 * 3 > max_size + 3:
+            raise UploadRejected(f'文件太大，请选择小于{max_size // (1024*1024)}MB的图片')
+
+        data = self._decode_base64(value, start)
+        if not data:
+            raise UploadRejected('文件为空')
+        if len(data) > max_size:
+            raise UploadRejected(f'文件太大，请选择小于{max_size // (1024*1024)}MB的图片')
+        image_format = self.sniff(data[:16])
+        if image_format is None:
+            raise UploadRejected('不是有效的图片文件')
+
+        header_limit = self.get_setting('header_bytes')
+        if extension is None:
+            # 纯 base64 没有声明类型：按文件头识别的格式检查允许的扩展名（如拒绝 GIF）
+            extension = next(ext for ext, name in self.EXTENSION_FORMATS.items() if name == image_format)
+            if extension not in current_app.config['ALLOWED_EXTENSIONS']:
+                raise UploadRejected('不支持的文件格式')
+        image_info = self._probe(data[:header_limit], extension)
+        image_info['size'] = len(data)
+        return data, IngestResult(None, image_info, hashlib.sha256(data).hexdigest())
+
+    def store(self, data, ingested, target_path):
+        """把已校验的图片字节写入 target_path（完成后原子重命名），返回带路径的 IngestResult"""
+        part_path = f"{target_path}.part"
+        try:
+            with open(part_path, 'wb') as out:
+                out.write(data)
+            os.replace(part_path, target_path)
+        except BaseException:
+            try:
+                os.remove(part_path)
+            except OSError:
+                pass
+            raise
+        self._restrict_permissions(target_path)
+        return ingested._replace(path=target_path)
+
+    @staticmethod
+    def _restrict_permissions(path):
+        # 设置文件权限 (仅所有者可读写)，挂载的卷可能无法修改
+        try:
+            os.chmod(path, stat.S_IRUSR | stat.S_IWUSR)
+        except PermissionError:
+            pass
+
+    def _decode_base64(self, value, start):
+        """从 value[start:] 按块解码 base64"""
+        try:
+            if self.WHITESPACE.search(value, start):
+                # 带换行等空白的数据无法按固定长度分块，整体解码
+                return base64.b64decode(value[start:])
+            buffer = io.BytesIO()
+            for offset in range(start, len(value), self.BASE64_CHUNK_CHARS):
+                buffer.write(binascii.a2b_base64(value[offset:offset + self.BASE64_CHUNK_CHARS]))
+            return buffer.getvalue()
+        except (binascii.Error, ValueError):
+            raise UploadRejected('无效的base64图片数据')
+
+    @staticmethod
+    def _webp_size(header):
+        """从 WebP 的第一个块（VP8 / VP8L / VP8X）读取画布尺寸"""
+        chunk = header[12:16]
+        if chunk == b'VP8 ' and len(header) >= 30 and header[23:26] == b'\x9d\x01\x2a':
+            width, height = struct.unpack('<HH', header[26:30])
+            return width & 0x3fff, height & 0x3fff
+        if chunk == b'VP8L' and len(header) >= 25 and header[20] == 0x2f:
+            bits = struct.unpack('<I', header[21:25])[0]
+            return (bits & 0x3fff) + 1, ((bits >> 14) & 0x3fff) + 1
+        if chunk == b'VP8X' and len(header) >= 30:
+            width = int.from_bytes(header[24:27], 'little') + 1
+            height = int.from_bytes(header[27:30], 'little') + 1
+            return width, height
+        raise ValueError('无法解析WebP文件头')
+
+
+# 全局上传处理实例
+upload_ingestor = UploadIngestor()
@@ -0,0 +1,196 @@
+# utils/upload_store.py - 上传内容去重存储
+import os
+import time
+import threading
+from datetime import datetime, timedelta
+from sqlalchemy.exc import IntegrityError
+from flask import current_app, has_app_context
+from utils.models import db, UploadObject
+
+
+class UploadStore:
+    """按内容哈希去重的上传存储
+
+    上传时单次读取已经计算出内容哈希（见 utils/upload_ingest.py），以哈希查找已存储的内容：
+    - 已存在且文件仍在：删除刚写入的副本，返回已存储文件的路径
+    - 不存在：登记新对象，引用计数为 0
+    相同图片不论由哪个设备上传都指向同一个文件，金字塔、渲染缓存（按内容哈希）和
+    阶段缓存（按路径）因此在设备和订单之间共享。
+
+    引用计数按实际指向文件的记录计算：创建订单或案例时 acquire()，删除时 release()，
+    计数归零后才删除文件和金字塔。上传后没有被任何订单引用的对象，
+    超过 UPLOAD_ORPHAN_SECONDS 后由 collect_orphans() 删除。
+    """
+
+    # 存储配置 -> (应用配置项, 默认值)
+    SETTING_CONFIG = {
+        'orphan_seconds': ('UPLOAD_ORPHAN_SECONDS', 24 * 3600),
+        'collect_interval': ('UPLOAD_ORPHAN_COLLECT_INTERVAL', 3600)
+    }
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._last_collect = time.time()
+
+    def get_setting(self, name):
+        """读取存储配置：有应用上下文时使用应用配置"""
+        config_key, default = self.SETTING_CONFIG[name]
+        if has_app_context():
+            return current_app.config.get(config_key, default)
+        return default
+
+    def register(self, ingested):
+        """登记一次上传（只查找或创建对象，不增加引用），返回 (实际使用的文件路径, 是否命中已有内容)"""
+        self._maybe_collect_orphans()
+        now = datetime.utcnow()
+        for _ in range(2):
+            upload_object = UploadObject.query.filter_by(content_hash=ingested.content_hash).first()
+            if upload_object is not None and os.path.exists(upload_object.file_path):
+                # 刷新时间，避免重新上传后、下单前被当作无引用对象回收
+                upload_object.last_referenced_at = now
+                db.session.commit()
+                if os.path.abspath(ingested.path) != os.path.abspath(upload_object.file_path):
+                    self._remove_file(ingested.path)
+                return upload_object.file_path, True
+
+            if upload_object is not None:
+                # 已登记但文件已丢失：以本次上传的文件替换
+                upload_object.file_path = ingested.path
+                upload_object.last_referenced_at = now
+                db.session.commit()
+                return ingested.path, False
+
+            image_info = ingested.image_info
+            db.session.add(UploadObject(
+                content_hash=ingested.content_hash,
+                file_path=ingested.path,
+                file_size=image_info['size'],
+                width=image_info.get('width'),
+                height=image_info.get('height'),
+                format=image_info.get('format'),
+                ref_count=0,
+                last_referenced_at=now
+            ))
+            try:
+                db.session.commit()
+                return ingested.path, False
+            except IntegrityError:
+                # 相同内容被并发登记，重新查找后按命中处理
+                db.session.rollback()
+        raise RuntimeError(f"登记上传内容失败: {ingested.content_hash}")
+
+    def acquire(self, file_path):
+        """增加一个引用（订单或案例开始指向该文件）；返回文件是否由去重存储管理
+
+        不受去重存储管理的文件（旧数据）不做处理。调用方负责提交事务。
+        """
+        if not file_path:
+            return False
+        upload_object = self._find(file_path)
+        if upload_object is None:
+            return False
+        upload_object.ref_count = (upload_object.ref_count or 0) + 1
+        upload_object.last_referenced_at = datetime.utcnow()
+        return True
+
+    def release(self, file_path):
+        """释放一个引用（如删除订单或案例），计数归零时删除文件和金字塔；返回是否删除了文件
+
+        不受去重存储管理的文件（旧数据）直接删除。调用方负责提交事务。
+        """
+        if not file_path:
+            return False
+        upload_object = self._find(file_path)
+        if upload_object is None:
+            return self._remove_file(file_path)
+
+        upload_object.ref_count = max(0, (upload_object.ref_count or 0) - 1)
+        if upload_object.ref_count > 0:
+            return False
+
+        db.session.delete(upload_object)
+        self._remove_derivatives(upload_object.file_path)
+        return self._remove_file(upload_object.file_path)
+
+    @staticmethod
+    def _find(file_path):
+        """按路径查找对象；订单中的路径可能已被规范为绝对路径，相对/绝对两种写法都匹配"""
+        absolute = os.path.abspath(file_path)
+        candidates = {file_path, absolute}
+        try:
+            candidates.add(os.path.relpath(absolute))
+        except ValueError:
+            # Windows 下不同盘符没有相对路径
+            pass
+        return UploadObject.query.filter(UploadObject.file_path.in_(candidates)).first()
+
+    def _maybe_collect_orphans(self):
+        """距上次回收超过 UPLOAD_ORPHAN_COLLECT_INTERVAL 时回收无引用对象"""
+        with self._lock:
+            if time.time() - self._last_collect < self.get_setting('collect_interval'):
+                return
+            self._last_collect = time.time()
+        try:
+            self.collect_orphans()
+        except Exception as e:
+            db.session.rollback()
+            current_app.logger.warning(f"回收无引用上传失败: {str(e)}")
+
+    def collect_orphans(self):
+        """删除引用计数为 0 且超过 UPLOAD_ORPHAN_SECONDS 未被引用的对象（上传后未下单），返回删除数"""
+        cutoff = datetime.utcnow() - timedelta(seconds=self.get_setting('orphan_seconds'))
+        orphans = UploadObject.query.filter(
+            UploadObject.ref_count <= 0,
+            UploadObject.last_referenced_at < cutoff
+        ).all()
+
+        removed = 0
+        for object_id, file_path in [(orphan.id, orphan.file_path) for orphan in orphans]:
+            # 条件删除：回收期间被下单引用或重新上传的对象保留
+            deleted = UploadObject.query.filter(
+                UploadObject.id == object_id,
+                UploadObject.ref_count <= 0,
+                UploadObject.last_referenced_at < cutoff
+            ).delete(synchronize_session=False)
+            db.session.commit()
+            if deleted:
+                self._remove_derivatives(file_path)
+                self._remove_file(file_path)
+                removed += 1
+        return removed
+
+    @staticmethod
+    def _remove_file(file_path):
+        if not os.path.exists(file_path):
+            return False
+        try:
+            os.remove(file_path)
+            return True
+        except OSError as e:
+            current_app.logger.warning(f"删除上传文件失败 {file_path}: {str(e)}")
+            return False
+
+    @staticmethod
+    def _remove_derivatives(file_path):
+        from utils.image_pyramid import image_pyramid
+        image_pyramid.remove(file_path)
+
+    def get_stats(self):
+        """存储对象数、总字节数、引用数、去重节省的引用数和无引用对象数"""
+        objects, total_bytes, references, referenced = db.session.query(
+            db.func.count(UploadObject.id),
+            db.func.coalesce(db.func.sum(UploadObject.file_size), 0),
+            db.func.coalesce(db.func.sum(UploadObject.ref_count), 0),
+            db.func.count(UploadObject.id).filter(UploadObject.ref_count > 0)
+        ).one()
+        return {
+            'objects': objects,
+            'bytes': int(total_bytes),
+            'references': int(references),
+            'deduplicated_references': max(0, int(references) - referenced),
+            'orphans': objects - referenced
+        }
+
+
+# 全局上传存储实例
+upload_store = UploadStore()
@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+# worker.py - 渲染队列 worker 启动脚本
+"""
+渲染队列 worker
+
+从 render_jobs 表领取订单渲染任务并回填订单图片路径。可以在本机或其它节点上运行多个，
+各节点需要连接同一个数据库（DATABASE_URL）并共享 static/uploads 和 static/exports 目录。
+
+用法:
+    python worker.py              # 持续运行
+    python worker.py --once       # 处理完当前排队的任务后退出
+"""
+import argparse
+import signal
+import threading
+from config.app_factory import create_app
+from utils.render_queue import render_queue
+
+
+def main():
+    """主函数"""
+    parser = argparse.ArgumentParser(description='吧唧渲染队列 worker')
+    parser.add_argument('--worker-id', help='worker 标识（默认: 主机名:进程号:线程号）')
+    parser.add_argument('--once', action='store_true', help='处理完当前排队的任务后退出')
+    args = parser.parse_args()
+
+    app = create_app()
+
+    with app.app_context():
+        if args.once:
+            count = 0
+            while render_queue.process_next(args.worker_id):
+                count += 1
+            print(f"✅ 已处理 {count} 个渲染任务")
+            return
+
+        # 收到停止信号后处理完当前任务再退出
+        stop_event = threading.Event()
+        signal.signal(signal.SIGTERM, lambda *_: stop_event.set())
+        signal.signal(signal.SIGINT, lambda *_: stop_event.set())
+
+        print("🚀 渲染队列 worker 启动...")
+        render_queue.run_worker(worker_id=args.worker_id, stop_event=stop_event)
+        print("👋 渲染队列 worker 已停止")
+
+
+if __name__ == '__main__':
+    main()